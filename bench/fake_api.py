@@ -0,0 +1,120 @@
+""" Local stand-in for cache endpoints of API service"""
+import argparse
+import logging
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Lock, Thread
+
+import jwt
+import orjson
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from etl.cache import FLUSH_PATH, INVALIDATE_PATH  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+
+class CacheStats:
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self.lock:
+            self.flushes = 0
+            self.requests = 0
+            self.invalidated = {}
+
+    def flush(self) -> None:
+        with self.lock:
+            self.flushes += 1
+
+    def invalidate(self, index_name: str, ids: list[str]) -> None:
+        with self.lock:
+            self.requests += 1
+            self.invalidated.setdefault(index_name, set()).update(ids)
+
+    def as_dict(self) -> dict:
+        with self.lock:
+            return {
+                'flushes': self.flushes,
+                'invalidate_requests': self.requests,
+                'invalidated': {name: len(ids) for name, ids in self.invalidated.items()},
+            }
+
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    """
+    Handler that check token of ETL and count flushes of the whole cache and invalidated ids by index
+    """
+
+    protocol_version = 'HTTP/1.1'
+    server: 'FakeApi'
+
+    def _send(self, status: int, body: object) -> None:
+        data = orjson.dumps(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _is_authorized(self) -> bool:
+        token = self.headers.get('Authorization', '').removeprefix('Bearer ')
+        try:
+            jwt.decode(token, self.server.secret, algorithms=['HS256'])
+        except jwt.PyJWTError:
+            return False
+        return True
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if not self._is_authorized():
+            self._send(401, {'detail': 'invalid token'})
+        elif self.path == FLUSH_PATH:
+            self.server.stats.flush()
+            self._send(200, {'detail': 'flushed'})
+        elif self.path == INVALIDATE_PATH:
+            payload = orjson.loads(body)
+            self.server.stats.invalidate(payload['index'], payload['ids'])
+            self._send(200, {'detail': 'invalidated'})
+        else:
+            self._send(404, {'detail': 'not found'})
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+class FakeApi(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int, secret: str, host: str = '127.0.0.1') -> None:
+        super().__init__((host, port), FakeApiHandler)
+        self.secret = secret
+        self.stats = CacheStats()
+
+    def start(self) -> Thread:
+        thread = Thread(target=self.serve_forever, name='fake-api', daemon=True)
+        thread.start()
+        return thread
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Fake API service that accepts cache flush and invalidation')
+    parser.add_argument('--port', type=int, help='Port to listen', default=8000)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    from config import settings
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s: %(message)s')
+    args = parse_args()
+    server = FakeApi(args.port, settings.SECRET)
+    logger.info('Fake API listens on port %s', args.port)
+    try:
+        server.serve_forever()
+    finally:
+        logger.info('Cache requests: %s', server.stats.as_dict())
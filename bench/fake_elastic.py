@@ -0,0 +1,165 @@
+""" Local stand-in for elasticsearch that accepts bulk requests without indexing"""
+import argparse
+import logging
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+VERSION = {'number': '7.17.4', 'build_flavor': 'default'}
+BODY_OPERATIONS = ('index', 'create', 'update')
+
+
+class BulkStats:
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self.lock:
+            self.requests = 0
+            self.documents = 0
+            self.rejected = 0
+            self.bytes = 0
+
+    def add(self, documents: int, rejected: int, size: int) -> None:
+        with self.lock:
+            self.requests += 1
+            self.documents += documents
+            self.rejected += rejected
+            self.bytes += size
+
+    def as_dict(self) -> dict:
+        with self.lock:
+            return {
+                'requests': self.requests, 'documents': self.documents, 'rejected': self.rejected, 'bytes': self.bytes,
+            }
+
+
+class FakeElasticHandler(BaseHTTPRequestHandler):
+    """
+    Handler that answers like elasticsearch: every index exists after it is created,
+    bulk requests are parsed and acknowledged after latency of server
+    """
+
+    protocol_version = 'HTTP/1.1'
+    server: 'FakeElastic'
+
+    def _send(self, status: int, body: object = None) -> None:
+        data = orjson.dumps(body) if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('X-Elastic-Product', 'Elasticsearch')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(data)
+
+    def _read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def _index_name(self) -> str:
+        return self.path.split('?')[0].strip('/').split('/')[0]
+
+    def do_HEAD(self) -> None:
+        self._send(200 if self._index_name() in self.server.indexes else 404)
+
+    def do_GET(self) -> None:
+        if self._index_name() == '':
+            self._send(200, {'name': 'fake', 'version': VERSION, 'tagline': 'You Know, for Search'})
+        else:
+            self._send(200, {})
+
+    def do_PUT(self) -> None:
+        self._read_body()
+        self.server.indexes.add(self._index_name())
+        self._send(200, {'acknowledged': True})
+
+    def do_DELETE(self) -> None:
+        self.server.indexes.discard(self._index_name())
+        self._send(200, {'acknowledged': True})
+
+    def do_POST(self) -> None:
+        body = self._read_body()
+        if '_bulk' in self.path:
+            self._send(200, self.server.bulk(body))
+        else:
+            self._send(200, {'acknowledged': True})
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+class FakeElastic(ThreadingHTTPServer):
+    """
+    Server with latency of bulk request = base_latency + latency_per_mb * size of body,
+    reject_rate part of documents is answered by 429 status
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        port: int,
+        base_latency: float = 0.0,
+        latency_per_mb: float = 0.0,
+        reject_rate: float = 0.0,
+        host: str = '127.0.0.1',
+    ) -> None:
+        super().__init__((host, port), FakeElasticHandler)
+        self.base_latency = base_latency
+        self.latency_per_mb = latency_per_mb
+        self.reject_rate = reject_rate
+        self.indexes = set()
+        self.stats = BulkStats()
+        self.rnd = random.Random(1)
+
+    def _item(self, meta: dict) -> dict:
+        op_type, action = next(iter(meta.items()))
+        status = 429 if self.reject_rate and self.rnd.random() < self.reject_rate else 201
+        item = {'_index': action.get('_index'), '_id': action.get('_id'), 'status': status}
+        if status == 429:
+            item['error'] = {'type': 'es_rejected_execution_exception', 'reason': 'rejected by fake elastic'}
+        return {op_type: item}
+
+    def bulk(self, body: bytes) -> dict:
+        started = time.perf_counter()
+        lines = iter(line for line in body.split(b'\n') if line)
+        items = []
+        for line in lines:
+            meta = orjson.loads(line)
+            if next(iter(meta)) in BODY_OPERATIONS:
+                next(lines)
+            items.append(self._item(meta))
+
+        rejected = sum(1 for item in items if next(iter(item.values()))['status'] == 429)
+        self.stats.add(len(items), rejected, len(body))
+        delay = self.base_latency + self.latency_per_mb * len(body) / (1024 * 1024)
+        time.sleep(max(0.0, delay - (time.perf_counter() - started)))
+        return {'took': int(delay * 1000), 'errors': bool(rejected), 'items': items}
+
+    def start(self) -> Thread:
+        thread = Thread(target=self.serve_forever, name='fake-elastic', daemon=True)
+        thread.start()
+        return thread
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Fake elasticsearch that accepts bulk requests')
+    parser.add_argument('--port', type=int, help='Port to listen', default=9200)
+    parser.add_argument('--base-latency', type=float, help='Seconds of every bulk request', default=0.0)
+    parser.add_argument('--latency-per-mb', type=float, help='Seconds added per MB of bulk body', default=0.0)
+    parser.add_argument('--reject-rate', type=float, help='Part of documents rejected with 429', default=0.0)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s: %(message)s')
+    args = parse_args()
+    server = FakeElastic(args.port, args.base_latency, args.latency_per_mb, args.reject_rate)
+    logger.info('Fake elasticsearch listens on port %s', args.port)
+    server.serve_forever()
@@ -0,0 +1,175 @@
+""" Generator of synthetic content schema for benchmarks"""
+import argparse
+import datetime
+import io
+import logging
+import random
+import sys
+import uuid
+from itertools import accumulate
+from pathlib import Path
+
+import psycopg2
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from config import settings  # noqa: E402
+from etl.indexes import create_indexes  # noqa: E402
+from utils import db_conn  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_PATH = Path(__file__).parent / 'schema.sql'
+COPY_ROWS = 50000
+ROLES = ('actor', 'actor', 'actor', 'director', 'writer')
+WORDS = (
+    'star', 'night', 'river', 'ghost', 'city', 'last', 'storm', 'empire', 'dream', 'shadow',
+    'winter', 'blood', 'secret', 'war', 'love', 'machine', 'island', 'queen', 'road', 'fire',
+)
+
+
+def zipf_weights(count: int, skew: float) -> list[float]:
+    """
+    Cumulative weights of ranks, with skew 0 all items are equally popular,
+    with bigger skew first items are referenced by much more films
+    """
+    return list(accumulate(1 / (rank ** skew) for rank in range(1, count + 1)))
+
+
+def words(rnd: random.Random, count: int) -> str:
+    return ' '.join(rnd.choice(WORDS) for _ in range(count))
+
+
+class ContentGenerator:
+    """
+    Rows of content tables generated from seed, the same arguments give the same data
+    """
+
+    def __init__(
+        self,
+        films: int,
+        persons: int,
+        genres: int,
+        persons_per_film: int,
+        genres_per_film: int,
+        skew: float,
+        seed: int,
+    ) -> None:
+        self.rnd = random.Random(seed)
+        self.films = films
+        self.persons_per_film = persons_per_film
+        self.genres_per_film = genres_per_film
+        self.skew = skew
+        self.start = datetime.datetime(2015, 1, 1, tzinfo=datetime.timezone.utc)
+        self.film_ids = [self._uuid() for _ in range(films)]
+        self.person_ids = [self._uuid() for _ in range(persons)]
+        self.genre_ids = [self._uuid() for _ in range(genres)]
+
+    def _uuid(self) -> str:
+        return str(uuid.UUID(int=self.rnd.getrandbits(128), version=4))
+
+    def _time(self) -> str:
+        return (self.start + datetime.timedelta(seconds=self.rnd.randrange(10 ** 8))).isoformat()
+
+    def film_rows(self):
+        for film_id in self.film_ids:
+            updated_at = self._time()
+            yield (
+                film_id, words(self.rnd, 3).title(), words(self.rnd, 30), round(self.rnd.uniform(1, 10), 1),
+                'movie', self.rnd.random() < 0.1, updated_at, updated_at,
+            )
+
+    def person_rows(self):
+        for person_id in self.person_ids:
+            updated_at = self._time()
+            yield person_id, words(self.rnd, 2).title(), updated_at, updated_at
+
+    def genre_rows(self):
+        for number, genre_id in enumerate(self.genre_ids):
+            updated_at = self._time()
+            yield genre_id, f'{words(self.rnd, 1).title()} {number}', words(self.rnd, 10), updated_at, updated_at
+
+    def _links(self, ids: list[str], per_film: int):
+        weights = zipf_weights(len(ids), self.skew)
+        for film_id in self.film_ids:
+            count = self.rnd.randint(1, per_film * 2 - 1) if per_film > 1 else per_film
+            yield film_id, set(self.rnd.choices(ids, cum_weights=weights, k=count))
+
+    def person_film_rows(self):
+        for film_id, person_ids in self._links(self.person_ids, self.persons_per_film):
+            for person_id in person_ids:
+                yield self._uuid(), film_id, person_id, self.rnd.choice(ROLES)
+
+    def genre_film_rows(self):
+        for film_id, genre_ids in self._links(self.genre_ids, self.genres_per_film):
+            for genre_id in genre_ids:
+                yield self._uuid(), film_id, genre_id
+
+
+def copy_rows(conn: psycopg2.extensions.connection, table: str, columns: tuple[str, ...], rows) -> int:
+    """
+    Write rows to table by COPY in chunks of COPY_ROWS rows
+    """
+    total = 0
+    buffer = io.StringIO()
+    with conn.cursor() as cur:
+        for number, row in enumerate(rows, 1):
+            buffer.write('\t'.join('\\N' if value is None else str(value) for value in row) + '\n')
+            if number % COPY_ROWS == 0:
+                buffer.seek(0)
+                cur.copy_expert(f'COPY content.{table} ({", ".join(columns)}) FROM STDIN', buffer)
+                buffer = io.StringIO()
+            total = number
+        buffer.seek(0)
+        cur.copy_expert(f'COPY content.{table} ({", ".join(columns)}) FROM STDIN', buffer)
+    logger.info('%s rows are written to %s', total, table)
+    return total
+
+
+def generate(conn: psycopg2.extensions.connection, generator: ContentGenerator) -> None:
+    with conn.cursor() as cur:
+        cur.execute(SCHEMA_PATH.read_text())
+        cur.execute(
+            'TRUNCATE content.person_film_work, content.genre_film_work, '
+            'content.film_work, content.person, content.genre;',
+        )
+    copy_rows(
+        conn, 'film_work',
+        ('id', 'title', 'description', 'rating', 'type', 'only_sub', 'created_at', 'updated_at'),
+        generator.film_rows(),
+    )
+    copy_rows(conn, 'person', ('id', 'full_name', 'created_at', 'updated_at'), generator.person_rows())
+    copy_rows(conn, 'genre', ('id', 'name', 'description', 'created_at', 'updated_at'), generator.genre_rows())
+    copy_rows(conn, 'person_film_work', ('id', 'film_work_id', 'person_id', 'role'), generator.person_film_rows())
+    copy_rows(conn, 'genre_film_work', ('id', 'film_work_id', 'genre_id'), generator.genre_film_rows())
+    conn.commit()
+    create_indexes(conn)
+    with conn.cursor() as cur:
+        cur.execute('ANALYZE;')
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Fill content schema of PG_* database with synthetic data')
+    parser.add_argument('--films', type=int, help='Count of films', default=100000)
+    parser.add_argument('--persons', type=int, help='Count of persons', default=30000)
+    parser.add_argument('--genres', type=int, help='Count of genres', default=30)
+    parser.add_argument('--persons-per-film', type=int, help='Average count of persons of film', default=10)
+    parser.add_argument('--genres-per-film', type=int, help='Average count of genres of film', default=2)
+    parser.add_argument(
+        '--skew',
+        type=float,
+        help='Skew of popularity of persons and genres, 0 for uniform, 1 and more for a few very popular ones',
+        default=1.0,
+    )
+    parser.add_argument('--seed', type=int, help='Seed of random generator', default=1)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s: %(message)s')
+    args = parse_args()
+    content = ContentGenerator(
+        args.films, args.persons, args.genres, args.persons_per_film, args.genres_per_film, args.skew, args.seed,
+    )
+    with db_conn(psycopg2.connect(**settings.postgres.dsl)) as connection:
+        generate(connection, content)
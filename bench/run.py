@@ -0,0 +1,207 @@
+""" End-to-end benchmark scenarios of ETL against generated database and fake elasticsearch"""
+import argparse
+import json
+import logging
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Optional
+
+import psycopg2
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from config import settings  # noqa: E402
+from utils import db_conn  # noqa: E402
+
+from fake_elastic import FakeElastic  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+ALL_PARTS = ['films', 'films_persons', 'films_genres', 'persons', 'genres']
+SCENARIOS = {
+    # scenario: parts that are run, state is kept between scenarios in the order of this dict
+    'init': ['films'],
+    'copy': ['films'],
+    'incremental': ALL_PARTS,
+    'fanout': ['films_persons', 'films_genres'],
+}
+# options of pipeline that differ for scenario, copy re-extracts all films as backlog read by one COPY stream
+SCENARIO_OPTIONS = {
+    'copy': {'copy_threshold': 1},
+}
+
+TOUCH_FILMS = """
+UPDATE content.film_work SET updated_at = now()
+WHERE id IN (SELECT id FROM content.film_work TABLESAMPLE BERNOULLI (%(percent)s));
+"""
+
+TOUCH_PERSONS = """
+UPDATE content.person SET updated_at = now()
+WHERE id IN (
+    SELECT person_id FROM content.person_film_work GROUP BY person_id ORDER BY count(*) DESC LIMIT %(limit)s
+);
+"""
+
+TOUCH_GENRES = """
+UPDATE content.genre SET updated_at = now()
+WHERE id IN (
+    SELECT genre_id FROM content.genre_film_work GROUP BY genre_id ORDER BY count(*) DESC LIMIT %(limit)s
+);
+"""
+
+
+def _metric_total(metric, index: Optional[int] = None) -> float:
+    """
+    Sum of metric values of all labels, for histograms index 1 is sum of observed values
+    """
+    values = metric.values.values()
+    if index is None:
+        return sum(values)
+    return sum(value[index] for value in values)
+
+
+def run_scenario(name: str, parts: list[str], es_port: int, state_path: str, options: dict) -> dict:
+    """
+    Run one pipeline cycle in fresh process, so peak memory belongs to the scenario only
+    """
+    from elasticsearch import Elasticsearch
+
+    from etl import metrics
+    from etl.extract import PartName
+    from etl.load import LoadMode
+    from etl.pipeline import EtlPipeline
+    from etl.records import RecordCursor
+    from states.state import State
+    from states.state_storage import JsonFileStorage
+
+    state = State(JsonFileStorage(state_path), flush_interval=5)
+    pipeline = EtlPipeline(
+        Elasticsearch([{'host': '127.0.0.1', 'port': es_port}]),
+        state,
+        options['ex_batch_size'],
+        options['ld_batch_size'],
+        options['ex_page_size'],
+        options['server_side'],
+        LoadMode(options['ld_mode']),
+        options['ld_threads'],
+        options['queue_size'],
+        options['fast_transform'],
+        copy_threshold=options.get('copy_threshold', 0),
+    )
+    started = time.perf_counter()
+    with db_conn(psycopg2.connect(**settings.postgres.dsl, cursor_factory=RecordCursor)) as conn:
+        pipeline.run(conn, [PartName(part) for part in parts])
+    state.flush()
+    seconds = time.perf_counter() - started
+
+    rows = _metric_total(metrics.ROWS_FETCHED)
+    documents = _metric_total(metrics.LOADED_DOCUMENTS)
+    stages = {
+        'extract': _metric_total(metrics.FETCH_SECONDS, 1),
+        'transform': _metric_total(metrics.TRANSFORM_SECONDS, 1),
+        'load': _metric_total(metrics.BULK_SECONDS, 1),
+    }
+    return {
+        'scenario': name,
+        'parts': parts,
+        'seconds': round(seconds, 3),
+        'rows': int(rows),
+        'documents': int(documents),
+        'failed': int(_metric_total(metrics.FAILED_DOCUMENTS)),
+        'rows_per_second': round(rows / seconds, 1) if seconds else None,
+        'documents_per_second': round(documents / seconds, 1) if seconds else None,
+        'stage_seconds': {stage: round(value, 3) for stage, value in stages.items()},
+        'films_checkpoint': state.get_state('films'),
+        # ru_maxrss is in kilobytes on linux
+        'peak_memory_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        'options': options,
+    }
+
+
+def prepare(name: str, args: argparse.Namespace) -> None:
+    """
+    Change rows that scenario should process, time of changes is not measured
+    """
+    with db_conn(psycopg2.connect(**settings.postgres.dsl)) as conn:
+        with conn.cursor() as cur:
+            if name == 'copy':
+                cur.execute(TOUCH_FILMS, {'percent': 100})
+            elif name == 'incremental':
+                cur.execute(TOUCH_FILMS, {'percent': args.touch_percent})
+            elif name == 'fanout':
+                cur.execute(TOUCH_PERSONS, {'limit': args.touch_persons})
+                cur.execute(TOUCH_GENRES, {'limit': args.touch_genres})
+        conn.commit()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Run ETL scenarios against PG_* database and fake elasticsearch')
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--output', help='File for JSON results, stdout by default')
+    parser.add_argument('--touch-percent', type=float, help='Percent of films changed for incremental', default=1)
+    parser.add_argument('--touch-persons', type=int, help='Most popular persons changed for fanout', default=50)
+    parser.add_argument('--touch-genres', type=int, help='Count of most popular genres changed for fanout', default=1)
+    parser.add_argument('--es-port', type=int, help='Port of fake elasticsearch', default=19200)
+    parser.add_argument('--es-latency', type=float, help='Seconds of every bulk request', default=0.0)
+    parser.add_argument('--es-latency-per-mb', type=float, help='Seconds added per MB of bulk body', default=0.0)
+    parser.add_argument('--ex-batch-size', type=int, default=1000)
+    parser.add_argument('--ld-batch-size', type=int, default=1000)
+    parser.add_argument('--ex-page-size', type=int, default=10000)
+    parser.add_argument('--server-side', action='store_true')
+    parser.add_argument('--ld-mode', choices=['bulk', 'streaming', 'parallel', 'raw'], default='bulk')
+    parser.add_argument('--ld-threads', type=int, default=4)
+    parser.add_argument('--queue-size', type=int, default=0)
+    parser.add_argument('--fast-transform', action='store_true')
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    options = {
+        'ex_batch_size': args.ex_batch_size,
+        'ld_batch_size': args.ld_batch_size,
+        'ex_page_size': args.ex_page_size,
+        'server_side': args.server_side,
+        'ld_mode': args.ld_mode,
+        'ld_threads': args.ld_threads,
+        'queue_size': args.queue_size,
+        'fast_transform': args.fast_transform,
+    }
+    server = FakeElastic(args.es_port, args.es_latency, args.es_latency_per_mb)
+    server.start()
+
+    state_dir = tempfile.mkdtemp(prefix='etl-bench-')
+    state_path = os.path.join(state_dir, 'state.json')
+    results = []
+    try:
+        for name in args.scenarios:
+            prepare(name, args)
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                run_options = {**options, **SCENARIO_OPTIONS.get(name, {})}
+                future = executor.submit(run_scenario, name, SCENARIOS[name], args.es_port, state_path, run_options)
+                result = future.result()
+            result['elastic'] = server.stats.as_dict()
+            server.stats.reset()
+            logger.info('%s: %s rows/s', name, result['rows_per_second'])
+            results.append(result)
+    finally:
+        server.shutdown()
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    else:
+        sys.stdout.write(output + '\n')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s: %(message)s')
+    main()
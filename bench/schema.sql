@@ -0,0 +1,48 @@
+CREATE SCHEMA IF NOT EXISTS content;
+
+CREATE TABLE IF NOT EXISTS content.film_work (
+    id uuid PRIMARY KEY,
+    title text NOT NULL,
+    description text,
+    creation_date date,
+    rating float,
+    type text NOT NULL,
+    only_sub boolean NOT NULL DEFAULT false,
+    created_at timestamp with time zone NOT NULL DEFAULT now(),
+    updated_at timestamp with time zone NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS content.person (
+    id uuid PRIMARY KEY,
+    full_name text NOT NULL,
+    created_at timestamp with time zone NOT NULL DEFAULT now(),
+    updated_at timestamp with time zone NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS content.genre (
+    id uuid PRIMARY KEY,
+    name text NOT NULL,
+    description text,
+    created_at timestamp with time zone NOT NULL DEFAULT now(),
+    updated_at timestamp with time zone NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS content.person_film_work (
+    id uuid PRIMARY KEY,
+    film_work_id uuid NOT NULL REFERENCES content.film_work (id) ON DELETE CASCADE,
+    person_id uuid NOT NULL REFERENCES content.person (id) ON DELETE CASCADE,
+    role text NOT NULL,
+    created_at timestamp with time zone NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS content.genre_film_work (
+    id uuid PRIMARY KEY,
+    film_work_id uuid NOT NULL REFERENCES content.film_work (id) ON DELETE CASCADE,
+    genre_id uuid NOT NULL REFERENCES content.genre (id) ON DELETE CASCADE,
+    created_at timestamp with time zone NOT NULL DEFAULT now()
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS film_work_person_role_idx
+    ON content.person_film_work (film_work_id, person_id, role);
+CREATE UNIQUE INDEX IF NOT EXISTS film_work_genre_idx
+    ON content.genre_film_work (film_work_id, genre_id);
@@ -41,6 +41,13 @@ class PostgresSettings(BaseConfig):
     DB: str
     HOST: str
     PORT: str = '5432'
+    ITERSIZE: dict[str, int] = {
+        'films': 500,
+        'films_persons': 2000,
+        'films_genres': 2000,
+        'persons': 2000,
+        'genres': 2000,
+    }
 
     @property
     def uri(self):
@@ -70,6 +77,12 @@ class ElasticSettings(BaseConfig):
         'genres': Path(Path(__file__).parent, 'index_scheme/genres_schema.json'),
     }
 
+    BULK_PROFILES: dict[str, dict] = {
+        'films': {'max_bytes': 10 * 1024 * 1024, 'min_docs': 50, 'max_docs': 2000, 'target_latency': 1.0},
+        'persons': {'max_bytes': 10 * 1024 * 1024, 'min_docs': 100, 'max_docs': 5000, 'target_latency': 1.0},
+        'genres': {'max_bytes': 5 * 1024 * 1024, 'min_docs': 100, 'max_docs': 5000, 'target_latency': 1.0},
+    }
+
     class Config:
         env_prefix = 'ES_'
 
@@ -86,6 +99,7 @@ class ProjectSettings(BaseConfig):
     postgres: PostgresSettings = PostgresSettings()
     elastic: ElasticSettings = ElasticSettings()
     FAST_APU_URL: str = 'http://fastapi:8000'
+    CACHE_INVALIDATE_BATCH: int = 500
 
 
 settings = ProjectSettings()
@@ -0,0 +1,125 @@
+""" Adaptive size and rate of bulk requests"""
+import logging
+import time
+from threading import Lock
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class BulkProfile:
+    """
+    Size of bulk requests to one index. Count of documents is tuned from observed bulk results:
+    it grows by step while requests are faster than target latency
+    and is halved on rejected documents or too slow requests
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 10 * 1024 * 1024,
+        min_docs: int = 50,
+        max_docs: int = 5000,
+        start_docs: int = 1000,
+        target_latency: float = 1.0,
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.min_docs = min_docs
+        self.max_docs = max_docs
+        self.docs = min(max(start_docs, min_docs), max_docs)
+        self.target_latency = target_latency
+        self.lock = Lock()
+
+    def observe(self, docs: int, latency: float, rejected: int = 0) -> None:
+        """
+        Tune count of documents by result of bulk request
+        :param docs: count of documents in request
+        :param latency: time of request in seconds
+        :param rejected: count of documents rejected by elasticsearch
+        """
+        with self.lock:
+            if rejected or latency > self.target_latency * 2:
+                self.docs = max(self.min_docs, self.docs // 2)
+            elif latency < self.target_latency and docs >= self.docs:
+                self.docs = min(self.max_docs, self.docs + max(1, self.docs // 10))
+
+
+class AdaptiveBatcher:
+    """
+    Bulk profiles of indexes, profile is created from settings of index or from default values
+    """
+
+    def __init__(self, index_names: dict, profiles: dict[str, dict], start_docs: int) -> None:
+        self.start_docs = start_docs
+        self.profiles = {}
+        for name, index_name in index_names.items():
+            self.profiles[index_name] = BulkProfile(**{'start_docs': start_docs, **profiles.get(name, {})})
+
+    def profile(self, index_name: Optional[str]) -> BulkProfile:
+        if index_name not in self.profiles:
+            self.profiles[index_name] = BulkProfile(start_docs=self.start_docs)
+        return self.profiles[index_name]
+
+    def observe(self, index_name: Optional[str], docs: int, latency: float, rejected: int = 0) -> None:
+        profile = self.profile(index_name)
+        profile.observe(docs, latency, rejected)
+        logger.debug(
+            'Bulk of %s documents to %s took %.3fs, next bulk size %s', docs, index_name, latency, profile.docs,
+        )
+
+
+class BulkThrottle:
+    """
+    Token bucket of documents per second shared by all bulk requests, rate is tuned by AIMD:
+    it is halved when elasticsearch rejects documents and grows by increase after every accepted request.
+    Until the first rejection rate is not limited, limit is removed again when it is twice the observed rate
+    """
+
+    def __init__(self, min_rate: float = 50, increase: float = 50, window: float = 1.0) -> None:
+        self.min_rate = min_rate
+        self.increase = increase
+        self.window = window
+        self.rate = None
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.window_start = self.updated
+        self.window_docs = 0
+        self.observed_rate = None
+        self.lock = Lock()
+
+    def acquire(self, docs: int) -> None:
+        """
+        Wait until docs documents can be sent, waiting requests reserve tokens in order of their calls
+        """
+        with self.lock:
+            now = time.monotonic()
+            self._count(now, docs)
+            if self.rate is None:
+                return
+            # bucket keeps at most one second of tokens, reserved ones make it negative
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate) - docs
+            self.updated = now
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+    def _count(self, now: float, docs: int) -> None:
+        self.window_docs += docs
+        if now - self.window_start >= self.window:
+            self.observed_rate = self.window_docs / (now - self.window_start)
+            self.window_start, self.window_docs = now, 0
+
+    def rejected(self) -> None:
+        with self.lock:
+            base = self.rate or self.observed_rate or self.min_rate * 2
+            self.rate = max(self.min_rate, base / 2)
+            self.tokens = min(self.tokens, 0.0)
+            logger.debug('Bulk rate is limited to %.0f docs/s', self.rate)
+
+    def accepted(self) -> None:
+        with self.lock:
+            if self.rate is None:
+                return
+            self.rate += self.increase
+            if self.observed_rate and self.rate > self.observed_rate * 2:
+                self.rate = None
+                logger.info('Bulk rate limit is removed')
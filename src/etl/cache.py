@@ -0,0 +1,106 @@
+""" Invalidation of API cache logic"""
+import datetime
+import logging
+from collections import defaultdict
+from itertools import islice
+from threading import Lock
+from typing import Optional
+
+import jwt
+import requests
+
+logger = logging.getLogger(__name__)
+
+FLUSH_PATH = '/api/v1/services/flush-cache'
+INVALIDATE_PATH = '/api/v1/services/invalidate-cache'
+
+
+class TouchedDocuments:
+    """
+    Ids of documents loaded during the cycle by index, shared by loaders of all parts.
+    When more than limit documents are touched ids are dropped and the whole cache should be flushed,
+    limit 0 means that the whole cache is flushed whenever any document is touched.
+    Ids are kept until they are invalidated, so documents of failed cycle are invalidated later
+    """
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.ids = defaultdict(set)
+        self.count = 0
+        self.overflow = False
+        self.lock = Lock()
+
+    def add(self, index_name: str, doc_ids: list[str]) -> None:
+        if self.overflow:
+            return
+        with self.lock:
+            ids = self.ids[index_name]
+            self.count -= len(ids)
+            ids.update(doc_ids)
+            self.count += len(ids)
+            if self.count > self.limit:
+                self.overflow = True
+                self.ids.clear()
+
+    def clear(self) -> None:
+        with self.lock:
+            self.ids.clear()
+            self.count = 0
+            self.overflow = False
+
+    def __bool__(self) -> bool:
+        return self.overflow or self.count > 0
+
+
+class CacheInvalidator:
+    """
+    Client of API service cache: documents are invalidated by batches of ids of their index,
+    the whole cache is flushed when touched documents overflowed their limit or targeted request failed
+    """
+
+    def __init__(self, api_url: str, secret: str, batch_size: int = 500, timeout: float = 10) -> None:
+        self.api_url = api_url
+        self.secret = secret
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def _headers(self) -> dict:
+        now = datetime.datetime.utcnow()
+        token = jwt.encode({'exp': now + datetime.timedelta(minutes=5), 'iat': now}, self.secret, algorithm='HS256')
+        return {'Authorization': f'Bearer {token}'}
+
+    def _post(self, path: str, payload: Optional[dict] = None) -> bool:
+        url = self.api_url + path
+        response = self.session.post(url=url, json=payload, headers=self._headers(), timeout=self.timeout)
+        if response.status_code != 200:
+            logger.warning('Request for url %s, return status_code: %s', url, response.status_code)
+            return False
+        return True
+
+    def flush(self) -> None:
+        """
+        Ask API service to flush its whole cache
+        """
+        self._post(FLUSH_PATH)
+
+    def invalidate(self, touched: TouchedDocuments) -> None:
+        """
+        Ask API service to drop cached documents touched during the cycle and cached lists of their indexes
+        """
+        if not touched:
+            return
+        if touched.overflow:
+            logger.info('Too many documents are touched, the whole cache is flushed')
+            self.flush()
+            return
+
+        requests_count = 0
+        for index_name, ids in touched.ids.items():
+            ids = iter(sorted(ids))
+            while batch := list(islice(ids, self.batch_size)):
+                requests_count += 1
+                if not self._post(INVALIDATE_PATH, {'index': index_name, 'ids': batch}):
+                    self.flush()
+                    return
+        logger.info('%s documents are invalidated by %s requests', touched.count, requests_count)
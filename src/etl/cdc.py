@@ -0,0 +1,113 @@
+""" Change data capture by LISTEN/NOTIFY logic"""
+import logging
+import select
+import time
+
+import orjson
+import psycopg2
+from psycopg2 import extensions as pg_ext
+
+import raw_sql
+
+logger = logging.getLogger(__name__)
+
+RECONNECT_DELAY = 5
+
+
+class Changes:
+    """
+    Ids of changed films, persons and genres collected from notifications
+    """
+
+    def __init__(self) -> None:
+        self.film_ids = set()
+        self.person_ids = set()
+        self.genre_ids = set()
+
+    def __bool__(self) -> bool:
+        return bool(self.film_ids or self.person_ids or self.genre_ids)
+
+    def __len__(self) -> int:
+        return len(self.film_ids) + len(self.person_ids) + len(self.genre_ids)
+
+    def add(self, payload: dict) -> None:
+        """
+        Add ids of notification sent by content.etl_notify_change trigger
+        """
+        table = payload.get('table')
+        if table in ('film_work', 'person_film_work', 'genre_film_work'):
+            self.film_ids.add(payload['id'])
+        if table == 'person':
+            self.person_ids.add(payload['id'])
+        elif table == 'person_film_work':
+            self.person_ids.add(payload['ref_id'])
+        elif table == 'genre':
+            self.genre_ids.add(payload['id'])
+
+
+def install_triggers(conn: pg_ext.connection) -> None:
+    """
+    Create triggers that notify about changed rows of content tables
+    """
+    with conn.cursor() as cur:
+        cur.execute(raw_sql.cdc_triggers)
+    conn.commit()
+
+
+class ChangeListener:
+    """
+    Listener of notifications about changed rows, connection is opened again after it was lost
+    """
+
+    def __init__(self, dsl: dict, channel: str = raw_sql.cdc_channel) -> None:
+        self.dsl = dsl
+        self.channel = channel
+        self.conn = None
+
+    def connect(self) -> None:
+        self.conn = psycopg2.connect(**self.dsl)
+        self.conn.set_session(autocommit=True)
+        with self.conn.cursor() as cur:
+            cur.execute(f'LISTEN {self.channel};')
+        logger.info('Listening notifications on channel %s', self.channel)
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def _read(self, changes: Changes, timeout: float) -> None:
+        if select.select([self.conn], [], [], max(timeout, 0)) == ([], [], []):
+            return
+        self.conn.poll()
+        while self.conn.notifies:
+            notify = self.conn.notifies.pop(0)
+            try:
+                changes.add(orjson.loads(notify.payload))
+            except (orjson.JSONDecodeError, KeyError):
+                logger.warning('Unexpected notification payload: %s', notify.payload)
+
+    def wait(self, timeout: float, debounce: float, max_ids: int = 0) -> Changes:
+        """
+        Wait for the first notification up to timeout seconds,
+        then collect notifications that come in debounce seconds after it
+        :param timeout: max time to wait for the first notification
+        :param debounce: time to collect notifications after the first one
+        :param max_ids: collecting stops early at this count of ids, the rest is read by the next wait, 0 to disable
+        :return: collected changes, empty if there were no notifications or connection was lost
+        """
+        changes = Changes()
+        try:
+            if self.conn is None or self.conn.closed:
+                self.connect()
+            self._read(changes, timeout)
+            deadline = time.monotonic() + debounce
+            while changes and (left := deadline - time.monotonic()) > 0:
+                if max_ids and len(changes) >= max_ids:
+                    break
+                self._read(changes, left)
+        except psycopg2.OperationalError as e:
+            logger.error('Connection of listener is lost, changes will be caught up by sweep', exc_info=e)
+            self.close()
+            time.sleep(min(max(timeout, 0), RECONNECT_DELAY))
+        return changes
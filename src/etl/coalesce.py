@@ -0,0 +1,76 @@
+""" Coalescing of actions to the same documents"""
+import logging
+from typing import Iterator, Optional
+
+from etl import ndjson
+from etl.transform import Transform
+from states.state import Checkpoint
+from utils import TransformedData
+
+logger = logging.getLogger(__name__)
+
+FILMS_PARTS = ('films', 'films_persons', 'films_genres')
+
+
+def merge_actions(previous: Optional[dict], action: dict) -> dict:
+    """
+    Merge action to document with previous pending action to the same document,
+    the result is the same as after applying both actions one after another
+    """
+    if previous is None or action['_op_type'] == 'index':
+        return action
+    if previous['_op_type'] == 'index':
+        return {**previous, '_source': {**previous['_source'], **action['doc']}}
+    return {**previous, 'doc': {**previous['doc'], **action['doc']}}
+
+
+class CoalescingTransform:
+    """
+    Transform that merge actions of films parts into one stream with one action per film.
+    Actions are kept in memory up to max_documents films, then they are returned with checkpoints met before
+    """
+
+    def __init__(self, transform: Transform, max_documents: int, serialize: bool = False) -> None:
+        self.source = transform
+        self.max_documents = max_documents
+        self.serialize = serialize
+
+    def transform(self) -> TransformedData:
+        result = self.source.transform()
+        parts = [name for name in FILMS_PARTS if name in result]
+        if len(parts) > 1:
+            films = self._coalesce([result.pop(name) for name in parts])
+            result = {'films': films, **result}
+        if self.serialize:
+            result = {name: ndjson.encode_actions(actions) for name, actions in result.items()}
+        return result
+
+    def _flush(self, pending: dict, checkpoints: list) -> Iterator:
+        yield from pending.values()
+        yield from checkpoints
+        pending.clear()
+        checkpoints.clear()
+
+    def _coalesce(self, parts: list[Iterator[dict]]) -> Iterator[dict]:
+        """
+        Generator that read parts one after another and return merged actions to films
+        """
+        pending, checkpoints = {}, []
+        merged = 0
+        for actions in parts:
+            while action := next(actions):
+                if isinstance(action, Checkpoint):
+                    checkpoints.append(action)
+                    continue
+                _id = str(action['_id'])
+                if _id in pending:
+                    merged += 1
+                pending[_id] = merge_actions(pending.get(_id), action)
+                if len(pending) >= self.max_documents:
+                    yield from self._flush(pending, checkpoints)
+
+        yield from self._flush(pending, checkpoints)
+        if merged:
+            logger.info('%s actions to films were merged with previous ones', merged)
+
+        yield None
@@ -0,0 +1,110 @@
+""" Streaming of query rows by COPY logic"""
+import logging
+from queue import Full, Queue
+from threading import Event, Thread
+from typing import Iterator, Union
+
+import orjson
+from psycopg2 import extensions as pg_ext
+
+logger = logging.getLogger(__name__)
+
+COPY_CHUNK_BYTES = 1024 * 1024
+COPY_QUEUE_SIZE = 8
+
+_COPY_END = object()
+
+
+class CopyStream:
+    """
+    File-like object that COPY of query writes rows to in background thread.
+    Rows are joined into chunks of chunk_bytes passed through queue of queue_size chunks,
+    so database sends next rows while consumer parses current ones.
+    When consumer stops reading before the end, query is cancelled and the rest of rows is dropped
+    """
+
+    def __init__(
+        self,
+        conn: pg_ext.connection,
+        query: Union[str, bytes],
+        chunk_bytes: int = COPY_CHUNK_BYTES,
+        queue_size: int = COPY_QUEUE_SIZE,
+    ) -> None:
+        self.conn = conn
+        self.query = query
+        self.chunk_bytes = chunk_bytes
+        self.chunks = Queue(maxsize=queue_size)
+        self.stop = Event()
+        self.buffer = []
+        self.buffered = 0
+
+    def write(self, data: bytes) -> int:
+        """
+        Called by psycopg2 for every row of COPY
+        """
+        if not self.stop.is_set():
+            self.buffer.append(data)
+            self.buffered += len(data)
+            if self.buffered >= self.chunk_bytes:
+                self._flush()
+        return len(data)
+
+    def _flush(self) -> None:
+        if self.buffer:
+            self.put(b''.join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+
+    def put(self, item: object) -> None:
+        while not self.stop.is_set():
+            try:
+                self.chunks.put(item, timeout=0.1)
+                return
+            except Full:
+                continue
+
+    def produce(self) -> None:
+        try:
+            with self.conn.cursor() as cur:
+                cur.copy_expert(self.query, self)
+            self._flush()
+            self.put(_COPY_END)
+        except Exception as e:
+            self.put(e)
+
+    def read_chunks(self) -> Iterator[bytes]:
+        """
+        Generator that run COPY in background thread and return chunks of whole rows
+        """
+        thread = Thread(target=self.produce, name='etl-copy', daemon=True)
+        thread.start()
+        try:
+            while (chunk := self.chunks.get()) is not _COPY_END:
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+        finally:
+            self.stop.set()
+            if thread.is_alive():
+                # COPY is not finished, connection is free only after the query is cancelled
+                self.conn.cancel()
+                thread.join()
+
+
+def json_batches(chunks: Iterator[bytes], batch_size: int) -> Iterator[list[dict]]:
+    """
+    Generator that parse rows of COPY with one JSON document per line by orjson,
+    rows are returned by lists of batch_size
+    :param chunks: chunks of whole lines
+    :param batch_size: count of rows in list
+    """
+    batch = []
+    for chunk in chunks:
+        batch.extend(orjson.loads(line) for line in chunk.splitlines())
+        start = 0
+        while len(batch) - start >= batch_size:
+            yield batch[start:start + batch_size]
+            start += batch_size
+        batch = batch[start:]
+    if batch:
+        yield batch
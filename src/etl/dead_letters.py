@@ -0,0 +1,138 @@
+""" Dead letter spool of documents that can not be loaded logic"""
+import datetime
+import logging
+import os
+import shutil
+from threading import Lock
+from typing import Optional, Union
+
+import orjson
+
+from etl.cdc import Changes
+
+logger = logging.getLogger(__name__)
+
+REPLAY_SUFFIX = '.replaying'
+REFUSED_SUFFIX = '.refused'
+
+
+def is_permanent(item: dict) -> bool:
+    """
+    Function that check that document is refused by elasticsearch because of document itself:
+    mapping errors, missing documents of updates and other client errors except rejections
+    """
+    status = next(iter(item.values())).get('status', 500)
+    return 400 <= status < 500 and status != 429
+
+
+def _record(action: Union[dict, bytes], item: dict) -> dict:
+    """
+    Function that return spool record of document of action with error, raw actions are decoded from bulk lines.
+    Document itself is not kept: replay extracts its current row, so fixed data is loaded and newer documents
+    are not overwritten by the failed version
+    """
+    if isinstance(action, bytes):
+        op_type, meta = next(iter(orjson.loads(action[:action.index(b'\n')]).items()))
+    else:
+        op_type, meta = action.get('_op_type', 'index'), action
+    return {
+        'op_type': op_type,
+        'index': meta['_index'],
+        'id': str(meta['_id']),
+        'error': next(iter(item.values())).get('error'),
+        'failed_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+
+
+class DeadLetterSpool:
+    """
+    JSON lines file with documents refused by elasticsearch and their errors.
+    Spool is appended by loaders of all parts, for replay it is moved aside. Documents that fail again
+    are collected in refused spool and appended to the new spool only when replay is finished,
+    so replay that failed partway is repeated without duplicates
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = Lock()
+
+    @property
+    def replay_path(self) -> str:
+        return self.path + REPLAY_SUFFIX
+
+    @property
+    def refused_path(self) -> str:
+        return self.path + REFUSED_SUFFIX
+
+    def refused(self) -> 'DeadLetterSpool':
+        """
+        Spool for documents refused again during replay
+        """
+        return DeadLetterSpool(self.refused_path)
+
+    def write(self, action: Union[dict, bytes], item: dict) -> None:
+        """
+        Append action with error of its result to spool
+        """
+        line = orjson.dumps(_record(action, item)) + b'\n'
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'ab') as file:
+                file.write(line)
+
+    def take(self) -> Optional[str]:
+        """
+        Move spool aside for replay, spool left by interrupted replay is replayed first
+        :return: path of spool to replay, None when there is nothing to replay
+        """
+        self.discard_refused()
+        if os.path.exists(self.replay_path):
+            return self.replay_path
+        with self.lock:
+            if not os.path.exists(self.path):
+                return None
+            os.replace(self.path, self.replay_path)
+        return self.replay_path
+
+    def finish(self) -> None:
+        """
+        Append documents refused again to spool and remove replayed spool
+        """
+        if os.path.exists(self.refused_path):
+            with self.lock:
+                with open(self.refused_path, 'rb') as refused, open(self.path, 'ab') as file:
+                    shutil.copyfileobj(refused, file)
+            os.remove(self.refused_path)
+        os.remove(self.replay_path)
+
+    def discard_refused(self) -> None:
+        """
+        Drop documents refused during replay that is not finished, they are kept in replayed spool
+        """
+        if os.path.exists(self.refused_path):
+            os.remove(self.refused_path)
+
+
+def spool_changes(path: str, index_names: dict[str, str]) -> Changes:
+    """
+    Ids of documents of spool file as changed rows, so replay extracts and loads their current versions
+    :param path: spool file
+    :param index_names: names of indexes of films, persons and genres
+    :return: ids of films, persons and genres
+    """
+    changes = Changes()
+    ids = {
+        index_names['films']: changes.film_ids,
+        index_names['persons']: changes.person_ids,
+        index_names['genres']: changes.genre_ids,
+    }
+    with open(path, 'rb') as file:
+        for line in file:
+            if not line.strip():
+                continue
+            record = orjson.loads(line)
+            if record['index'] in ids:
+                ids[record['index']].add(record['id'])
+            else:
+                logger.warning('Document %s of unknown index %s is not replayed', record['id'], record['index'])
+    return changes
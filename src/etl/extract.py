@@ -1,18 +1,27 @@
 """ Extract parts logic"""
 import datetime
 import logging
+import time
+import uuid
 from enum import Enum
-from typing import Iterator, Protocol
+from itertools import islice
+from typing import Iterator, Mapping, NamedTuple, Optional, Protocol
 
 from psycopg2 import extensions as pg_ext
-from psycopg2.extras import DictRow
 
 import raw_sql
-from states.state import BaseState
-from utils import DatabaseData
+from etl import metrics
+from etl.cdc import Changes
+from etl.copy_stream import CopyStream, json_batches
+from etl.records import Record, RecordCursor
+from states.state import BaseState, Checkpoint
+from utils import DatabaseData, parse_timestamp
 
 logger = logging.getLogger(__name__)
 
+FIRST_ID = '00000000-0000-0000-0000-000000000000'
+LAST_ID = 'ffffffff-ffff-ffff-ffff-ffffffffffff'
+
 
 class Extracting(Protocol):
     def extract(self) -> DatabaseData:
@@ -27,6 +36,16 @@ class PartName(Enum):
     genres: str = 'genres'
 
 
+class Shard(NamedTuple):
+    """
+    Range of film ids (start, end] loaded by one worker of sharded initial load
+    """
+
+    number: int
+    start: str
+    end: str
+
+
 class PostgresExtracting:
     def __init__(
         self,
@@ -35,13 +54,21 @@ class PostgresExtracting:
         default_process_time: datetime.datetime,
         extract_parts: list[PartName],
         extract_size: int,
+        page_size: int = 10000,
+        server_side: bool = False,
+        itersize: Optional[dict[str, int]] = None,
+        copy_threshold: int = 0,
     ) -> None:
         self.conn = conn
         self.cur: pg_ext.cursor = conn.cursor()
         self.state = state
         self.extract_size = extract_size
+        self.page_size = page_size
         self.extract_parts = extract_parts
         self.default_process_time = default_process_time
+        self.server_side = server_side
+        self.itersize = itersize or {}
+        self.copy_threshold = copy_threshold
 
     def extract(self) -> DatabaseData:
         """
@@ -56,102 +83,291 @@ class PostgresExtracting:
                 logger.warning('Non-existent extract part: %s', extract_name.value)
         return result
 
-    def _get_process_last_filed_time(self, process_name: str) -> str:
+    def has_changes(self, part: PartName) -> bool:
         """
-        Function that return last extracted data modified field value
+        Function that check by cheap indexed query that part has rows changed after its checkpoint
+        :param part: part to check
+        :return: True if part has changed rows
+        """
+        with self.conn.cursor() as cur:
+            cur.execute(raw_sql.change_probes[part.value], self._get_process_keyset(part.value))
+            return cur.fetchone()[0]
+
+    def _get_process_keyset(self, process_name: str) -> dict:
+        """
+        Function that return keyset (updated_at, id) of last extracted row
         :param process_name: name of process that kept in state
-        :return: time in string format
+        :return: dict with updated_at and id of last extracted row
+        """
+        keyset = self.state.get_state(process_name)
+        if isinstance(keyset, dict):
+            return keyset
+        if keyset is not None:
+            # state saved before keyset pagination keeps only time of last extracted row
+            return {'updated_at': keyset, 'id': FIRST_ID}
+        return {'updated_at': str(self.default_process_time), 'id': FIRST_ID}
+
+    @staticmethod
+    def _row_keyset(row: Mapping) -> dict:
         """
-        if (time := self.state.get_state(process_name)) is not None:
-            return time
-        return str(self.default_process_time)
+        Function that return keyset of row to resume extracting after it. Rows of COPY are decoded from JSON
+        with timestamps as text, they are parsed so state keeps the same format as for rows of pages
+        """
+        updated_at = row.get('updated_at')
+        if isinstance(updated_at, str):
+            updated_at = parse_timestamp(updated_at)
+        return {'updated_at': str(updated_at), 'id': str(row.get('id'))}
 
-    def _extract_films(self) -> Iterator[dict]:
+    def _cursor(self, part_name: str) -> pg_ext.cursor:
         """
-        Generator to extract films data
+        Function that open cursor for streaming query of extract part, rows are returned as compact Record.
+        In server side mode cursor is named, so rows stay on the server and fetched by itersize chunks
+        :param part_name: name of extract part, used for cursor name and itersize lookup
+        :return: new cursor
         """
-        last_extracted_time = self._get_process_last_filed_time('films')
+        if not self.server_side:
+            return self.conn.cursor(cursor_factory=RecordCursor)
+        cursor = self.conn.cursor(name=f'etl_{part_name}_{uuid.uuid4().hex}', cursor_factory=RecordCursor)
+        cursor.itersize = self.itersize.get(part_name, self.extract_size)
+        return cursor
 
-        self.cur.execute(raw_sql.film, [last_extracted_time])
+    def _fetch_batches(self, cursor: pg_ext.cursor) -> Iterator[list[Record]]:
+        """
+        Generator that return executed query rows by batches of self.extract_size
+        :param cursor: cursor with executed query
+        """
+        if cursor.name is None:
+            while rows := cursor.fetchmany(self.extract_size):
+                yield rows
+            return
 
-        while films := self.cur.fetchmany(self.extract_size):
-            yield from films
-            self.state.set_state('films', str(films[-1].get('updated_at')))
+        rows_iter = iter(cursor)
+        while rows := list(islice(rows_iter, self.extract_size)):
+            yield rows
 
-        yield None
-
-    def _extract_films_persons(self) -> Iterator[DictRow]:
+    def _paginate(
+        self,
+        part_name: str,
+        query: str,
+        keyset: dict,
+        params: Optional[dict] = None,
+    ) -> Iterator[list[Record]]:
         """
-        Generator to extract persons data
+        Generator that run keyset paginated query with LIMIT self.page_size page by page,
+        every next page starts after the last row of previous one
+        :param part_name: name of extract part
+        :param query: query with updated_at, id and limit parameters ordered by (updated_at, id)
+        :param keyset: keyset of row to start after
+        :param params: other parameters of query
         """
-        last_extracted_time = self._get_process_last_filed_time('films_persons')
-        self.cur.execute(raw_sql.person_id, [last_extracted_time])
-        persons = self.cur.fetchall()
-        persons_id = [person.get('id') for person in persons]
-
-        if persons_id:
+        params = params or {}
+        while True:
+            page_rows = 0
+            with self._cursor(part_name) as cur:
+                start = time.perf_counter()
+                cur.execute(query, {**params, **keyset, 'limit': self.page_size})
+
+                for rows in self._fetch_batches(cur):
+                    metrics.FETCH_SECONDS.observe(time.perf_counter() - start, part=part_name)
+                    metrics.ROWS_FETCHED.inc(len(rows), part=part_name)
+                    page_rows += len(rows)
+                    keyset = self._row_keyset(rows[-1])
+                    yield rows
+                    start = time.perf_counter()
+
+            if page_rows < self.page_size:
+                return
+
+    def _copy(
+        self,
+        part_name: str,
+        query: str,
+        keyset: dict,
+        params: Optional[dict] = None,
+    ) -> Iterator[list[dict]]:
+        """
+        Generator that run query wrapped in COPY to JSON lines as one stream without pages,
+        rows are parsed by batches of self.extract_size while next ones are received in background thread
+        :param part_name: name of extract part
+        :param query: COPY query with keyset parameters
+        :param keyset: keyset of row to start after
+        :param params: other parameters of query
+        """
+        with self.conn.cursor() as cur:
+            # COPY does not take parameters, so they are bound on client
+            query = cur.mogrify(query, {**(params or {}), **keyset})
+
+        start = time.perf_counter()
+        for rows in json_batches(CopyStream(self.conn, query).read_chunks(), self.extract_size):
+            metrics.FETCH_SECONDS.observe(time.perf_counter() - start, part=part_name)
+            metrics.ROWS_FETCHED.inc(len(rows), part=part_name)
+            yield rows
+            start = time.perf_counter()
+
+    def _is_large_backlog(self, keyset: dict) -> bool:
+        """
+        Function that check that at least self.copy_threshold films are changed after keyset,
+        count query stops at the threshold
+        """
+        if not self.copy_threshold:
+            return False
+        with self.conn.cursor() as cur:
+            cur.execute(raw_sql.film_backlog, {**keyset, 'limit': self.copy_threshold})
+            return cur.fetchone()[0] >= self.copy_threshold
 
-            last_extracted_time = self._get_process_last_filed_time('persons_film')
-            self.cur.execute(raw_sql.person_film_id, [tuple(persons_id), last_extracted_time])
+    def _films_batches(self, keyset: dict) -> Iterator[list[dict]]:
+        """
+        Batches of changed films: large backlog is read by one COPY stream, small one by pages
+        """
+        if self._is_large_backlog(keyset):
+            logger.info('Films are extracted by COPY')
+            return self._copy('films', raw_sql.film_copy, keyset)
+        return self._paginate('films', raw_sql.film, keyset)
 
-            while films := self.cur.fetchmany(self.extract_size):
-                films_ids = [film.get('id') for film in films]
-                self.cur.execute(raw_sql.person_films, [tuple(films_ids)])
+    def _extract_films(self) -> Iterator[dict]:
+        """
+        Generator to extract films data
+        """
+        keyset = self._get_process_keyset('films')
 
-                yield from self.cur.fetchall()
+        for films in self._films_batches(keyset):
+            yield from films
+            yield Checkpoint('films', self._row_keyset(films[-1]))
 
-                self.state.set_state('persons_film', str(films[-1].get('updated_at')))
+        yield None
 
-            self.state.set_state('films_persons', str(persons[-1].get('updated_at')))
+    def _fan_out(self, part_name: str, query: str) -> Iterator[Record]:
+        """
+        Generator that run one pass fan-out query page by page: every query takes page of changed
+        persons or genres and return re-aggregated fields of their films with page bounds in every row
+        :param part_name: name of extract part
+        :param query: fan-out query with updated_at, id and limit parameters
+        """
+        keyset = self._get_process_keyset(part_name)
+        while True:
+            page_rows = 0
+            with self._cursor(part_name) as cur:
+                start = time.perf_counter()
+                cur.execute(query, {**keyset, 'limit': self.page_size})
+
+                for rows in self._fetch_batches(cur):
+                    metrics.FETCH_SECONDS.observe(time.perf_counter() - start, part=part_name)
+                    metrics.ROWS_FETCHED.inc(len(rows), part=part_name)
+                    page_rows = rows[-1].get('page_rows')
+                    keyset = {'updated_at': str(rows[-1].get('last_updated_at')), 'id': str(rows[-1].get('last_id'))}
+                    yield from (row for row in rows if row.get('film_id') is not None)
+                    start = time.perf_counter()
+
+            if not page_rows:
+                return
+            yield Checkpoint(part_name, keyset)
+            if page_rows < self.page_size:
+                return
+
+    def _extract_films_persons(self) -> Iterator[Record]:
+        """
+        Generator to extract persons data
+        """
+        yield from self._fan_out('films_persons', raw_sql.person_films_fanout)
 
         yield None
 
-    def _extract_films_genres(self) -> Iterator[DictRow]:
+    def _extract_films_genres(self) -> Iterator[Record]:
         """
         Generator to extract persons data
         """
-        last_extracted_time = self._get_process_last_filed_time('films_genres')
-        self.cur.execute(raw_sql.genre_id, [last_extracted_time])
-        genres = self.cur.fetchall()
-        genres_id = [genre.get('id') for genre in genres]
-
-        if genres_id:
+        yield from self._fan_out('films_genres', raw_sql.genre_films_fanout)
 
-            last_extracted_time = self._get_process_last_filed_time('genres_film')
-            self.cur.execute(raw_sql.genre_film_id, [tuple(genres_id), last_extracted_time])
+        yield None
 
-            while films := self.cur.fetchmany(self.extract_size):
-                films_ids = [film.get('id') for film in films]
-                self.cur.execute(raw_sql.genre_films, [tuple(films_ids)])
+    def _extract_persons(self) -> Iterator[Record]:
+        keyset = self._get_process_keyset('persons')
 
-                yield from self.cur.fetchall()
+        for persons in self._paginate('persons', raw_sql.persons, keyset):
 
-                self.state.set_state('genres_film', str(films[-1].get('updated_at')))
+            yield from persons
 
-            self.state.set_state('films_genres', str(genres[-1].get('updated_at')))
+            yield Checkpoint('persons', self._row_keyset(persons[-1]))
 
         yield None
 
-    def _extract_persons(self) -> Iterator[DictRow]:
-        last_extracted_time = self._get_process_last_filed_time('persons')
-        self.cur.execute(raw_sql.persons, [last_extracted_time])
+    def _extract_genres(self) -> Iterator[Record]:
+        keyset = self._get_process_keyset('genres')
 
-        while persons := self.cur.fetchmany(self.extract_size):
+        for genres in self._paginate('genres', raw_sql.genres, keyset):
 
-            yield from persons
+            yield from genres
 
-            self.state.set_state('persons', str(persons[-1].get('updated_at')))
+            yield Checkpoint('genres', self._row_keyset(genres[-1]))
 
         yield None
 
-    def _extract_genres(self) -> Iterator[DictRow]:
-        last_extracted_time = self._get_process_last_filed_time('genres')
-        self.cur.execute(raw_sql.genres, [last_extracted_time])
 
-        while genres := self.cur.fetchmany(self.extract_size):
+class PostgresShardExtracting(PostgresExtracting):
+    """
+    Extracting of films of one shard ordered by id, state keeps the last loaded film of the shard
+    """
 
-            yield from genres
+    def __init__(self, conn: pg_ext.connection, state: BaseState, shard: Shard, *args, **kwargs) -> None:
+        super().__init__(conn, state, *args, **kwargs)
+        self.shard = shard
 
-            self.state.set_state('genres', str(genres[-1].get('updated_at')))
+    def _get_process_keyset(self, process_name: str) -> dict:
+        keyset = self.state.get_state(process_name)
+        if isinstance(keyset, dict):
+            return keyset
+        return {'updated_at': str(self.default_process_time), 'id': self.shard.start}
+
+    def _films_batches(self, keyset: dict) -> Iterator[list[dict]]:
+        params = {'shard_end': self.shard.end}
+        if self.copy_threshold:
+            return self._copy('films', raw_sql.film_shard_copy, keyset, params)
+        return self._paginate('films', raw_sql.film_shard, keyset, params)
+
+
+class PostgresChangesExtracting(PostgresExtracting):
+    """
+    Extracting of films, persons and genres by ids of changed rows. Ids are queried by batches of extract_size,
+    films of changed persons and genres get partial updates of their persons and genres fields
+    """
+
+    def __init__(
+        self,
+        conn: pg_ext.connection,
+        state: BaseState,
+        changes: Changes,
+        extract_size: int,
+        server_side: bool = False,
+        itersize: Optional[dict[str, int]] = None,
+    ) -> None:
+        super().__init__(conn, state, None, [], extract_size, server_side=server_side, itersize=itersize)
+        self.changes = changes
+
+    def extract(self) -> DatabaseData:
+        parts = [
+            (PartName.films, raw_sql.films_by_ids, 'film_ids', self.changes.film_ids),
+            (PartName.films_persons, raw_sql.person_films_by_ids, 'person_ids', self.changes.person_ids),
+            (PartName.films_genres, raw_sql.genre_films_by_ids, 'genre_ids', self.changes.genre_ids),
+            (PartName.persons, raw_sql.persons_by_ids, 'person_ids', self.changes.person_ids),
+            (PartName.genres, raw_sql.genres_by_ids, 'genre_ids', self.changes.genre_ids),
+        ]
+        return {part.value: self._extract_by_ids(part, query, name, ids) for part, query, name, ids in parts if ids}
+
+    def _extract_by_ids(self, part: PartName, query: str, param_name: str, ids: set[str]) -> Iterator[Record]:
+        """
+        Generator that run query for batches of ids, rows are fetched by batches of self.extract_size
+        :param part: extract part
+        :param query: query with array of ids parameter
+        :param param_name: name of ids parameter
+        :param ids: changed ids
+        """
+        ids = sorted(ids)
+        for start in range(0, len(ids), self.extract_size):
+            with self._cursor(part.value) as cur:
+                cur.execute(query, {param_name: ids[start:start + self.extract_size]})
+
+                for rows in self._fetch_batches(cur):
+                    metrics.ROWS_FETCHED.inc(len(rows), part=part.value)
+                    yield from rows
 
         yield None
@@ -0,0 +1,136 @@
+""" Validation of rows by pydantic schemes without models instantiation"""
+from typing import Any, Callable, Mapping
+
+from pydantic import BaseModel, ValidationError
+from pydantic.error_wrappers import ErrorWrapper
+from pydantic.errors import MissingError
+from pydantic.fields import SHAPE_LIST, ModelField
+
+from etl.records import Record
+
+Converter = Callable[[Any, dict], Any]
+
+
+class SchemeError(ValidationError):
+    """
+    Error of the first invalid field of row. It is pydantic ValidationError with the same message,
+    so code that handles errors of models handles errors of FastScheme too
+    """
+
+    def __init__(self, model: type[BaseModel], field_name: str, error: Exception):
+        super().__init__([ErrorWrapper(error, loc=field_name)], model)
+        self.scheme_name = model.__name__
+        self.field_name = field_name
+        self.error = error
+
+
+def _compile_field(model: type[BaseModel], field: ModelField) -> Converter:
+    """
+    Build converter of one field value from validators that pydantic prepared for the field,
+    list fields validate every item by validators of their item field
+    :param model: scheme with the field
+    :param field: field of scheme
+    :return: function that return validated value by raw value and already validated values
+    """
+    is_list = field.shape == SHAPE_LIST
+    item_field = field.sub_fields[0] if is_list else field
+    validators = item_field.validators
+    post_validators = field.post_validators or ()
+    config = model.__config__
+
+    def validate_item(value: Any, values: dict) -> Any:
+        for validator in validators:
+            value = validator(model, value, values, item_field, config)
+        return value
+
+    def convert(value: Any, values: dict) -> Any:
+        if value is None:
+            if not field.allow_none:
+                raise ValueError('none is not an allowed value')
+        elif is_list:
+            if not isinstance(value, (list, tuple)):
+                raise ValueError('value is not a valid list')
+            value = [validate_item(item, values) for item in value]
+        else:
+            value = validate_item(value, values)
+
+        for validator in post_validators:
+            value = validator(model, value, values, field, config)
+        return value
+
+    return convert
+
+
+class FastScheme:
+    """
+    Validator that reshape rows to dict equal to Model(**row).dict(),
+    fields are validated by the same pydantic validators, but model instance is not created
+    """
+
+    def __init__(self, model: type[BaseModel]) -> None:
+        self.model = model
+        self.fields = [(name, field, _compile_field(model, field)) for name, field in model.__fields__.items()]
+        self.positions = {}
+
+    def convert(self, row: Mapping) -> dict:
+        """
+        Validate row and return dict of scheme fields
+        :param row: row of database with scheme fields
+        :return: dict of validated scheme fields
+        """
+        values = {}
+        for name, field, convert in self.fields:
+            if name in row:
+                value = row[name]
+            elif field.required:
+                raise SchemeError(self.model, name, MissingError())
+            else:
+                values[name] = field.get_default()
+                continue
+
+            try:
+                values[name] = convert(value, values)
+            except (ValueError, TypeError) as e:
+                raise SchemeError(self.model, name, e) from e
+        return values
+
+    def _record_positions(self, record: type[Record]) -> list[tuple]:
+        """
+        Fields of scheme with positions of their columns in rows of record type, None for missing columns
+        """
+        positions = self.positions.get(record)
+        if positions is None:
+            positions = [(name, field, convert, record.columns.get(name)) for name, field, convert in self.fields]
+            self.positions[record] = positions
+        return positions
+
+    def convert_record(self, row: Record, positions: list[tuple]) -> dict:
+        """
+        Validate row of query by positions of fields, values are read from tuple without lookup of column names
+        :param row: row of query
+        :param positions: fields of scheme with positions of their columns
+        :return: dict of validated scheme fields
+        """
+        values = {}
+        for name, field, convert, index in positions:
+            if index is None:
+                if field.required:
+                    raise SchemeError(self.model, name, MissingError())
+                values[name] = field.get_default()
+                continue
+
+            try:
+                values[name] = convert(tuple.__getitem__(row, index), values)
+            except (ValueError, TypeError) as e:
+                raise SchemeError(self.model, name, e) from e
+        return values
+
+    def convert_batch(self, rows: list[Mapping]) -> list[dict]:
+        """
+        Validate batch of rows, in batch of one query Record positions of fields are resolved once
+        """
+        record = type(rows[0]) if rows else None
+        if record is not None and issubclass(record, Record) and all(type(row) is record for row in rows):
+            positions = self._record_positions(record)
+            return [self.convert_record(row, positions) for row in rows]
+        return [self.convert(row) for row in rows]
@@ -0,0 +1,85 @@
+""" Indexes and query plans checks logic"""
+import datetime
+import json
+import logging
+from typing import Iterator
+
+from psycopg2 import extensions as pg_ext
+
+import raw_sql
+from etl.extract import FIRST_ID
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_IDS = [FIRST_ID]
+
+
+def create_indexes(conn: pg_ext.connection) -> None:
+    """
+    Create indexes that extract queries rely on, indexes are built without locking writes
+    :param conn: connection with database, it is switched to autocommit mode
+    """
+    conn.set_session(autocommit=True)
+    with conn.cursor() as cur:
+        for statement in raw_sql.etl_indexes:
+            logger.info('Execute: %s', statement)
+            cur.execute(statement)
+
+
+def _extract_queries() -> dict[str, tuple[str, dict]]:
+    """
+    Function that return extract queries with parameters of usual incremental cycle:
+    the checkpoint is recent, so only a few rows are changed after it
+    """
+    keyset = {'updated_at': str(datetime.datetime.now(datetime.timezone.utc)), 'id': FIRST_ID, 'limit': 10000}
+    ids = {'film_ids': SAMPLE_IDS, 'person_ids': SAMPLE_IDS, 'genre_ids': SAMPLE_IDS}
+    queries = {
+        'film': (raw_sql.film, keyset),
+        'persons': (raw_sql.persons, keyset),
+        'genres': (raw_sql.genres, keyset),
+        'person_films_fanout': (raw_sql.person_films_fanout, keyset),
+        'genre_films_fanout': (raw_sql.genre_films_fanout, keyset),
+        'films_by_ids': (raw_sql.films_by_ids, ids),
+        'person_films_by_ids': (raw_sql.person_films_by_ids, ids),
+        'genre_films_by_ids': (raw_sql.genre_films_by_ids, ids),
+        'persons_by_ids': (raw_sql.persons_by_ids, ids),
+        'genres_by_ids': (raw_sql.genres_by_ids, ids),
+        'film_backlog': (raw_sql.film_backlog, keyset),
+    }
+    for part, probe in raw_sql.change_probes.items():
+        queries[f'{part}_probe'] = (probe, keyset)
+    return queries
+
+
+def _seq_scans(plan: dict) -> Iterator[str]:
+    """
+    Generator that return relations read by sequential scan in plan node and its children
+    """
+    if plan.get('Node Type') == 'Seq Scan':
+        yield plan.get('Relation Name')
+    for child in plan.get('Plans', []):
+        yield from _seq_scans(child)
+
+
+def verify_plans(conn: pg_ext.connection, min_rows: int) -> list[str]:
+    """
+    Run EXPLAIN for every extract query and find sequential scans of large tables
+    :param conn: connection with database
+    :param min_rows: count of rows from which table is large
+    :return: descriptions of found problems
+    """
+    problems = []
+    with conn.cursor() as cur:
+        cur.execute(raw_sql.table_rows)
+        table_rows = {name: rows for name, rows in cur.fetchall()}
+
+        for name, (query, params) in _extract_queries().items():
+            cur.execute('EXPLAIN (FORMAT JSON) ' + query.strip().rstrip(';'), params)
+            plan = cur.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            for table in _seq_scans(plan[0]['Plan']):
+                if (rows := table_rows.get(table, 0)) >= min_rows:
+                    problems.append(f'Query {name} reads table {table} ({rows:.0f} rows) by sequential scan')
+    conn.rollback()
+    return problems
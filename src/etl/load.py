@@ -1,12 +1,37 @@
 """ Load parts logic"""
 import json
+import logging
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
 from pathlib import Path
-from typing import Iterator
+from typing import Iterator, Optional, Union
 
-from elasticsearch import Elasticsearch
-from elasticsearch.helpers import bulk
+import orjson
+from elasticsearch import Elasticsearch, TransportError
+from elasticsearch.helpers import BulkIndexError, expand_action
 
+from etl import metrics
+from etl.batching import AdaptiveBatcher, BulkThrottle
+from etl.cache import TouchedDocuments
+from etl.dead_letters import DeadLetterSpool, is_permanent
 from etl.transform import Transform
+from states.state import BaseState, Checkpoint
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CHUNK_BYTES = 100 * 1024 * 1024
+ACTION_META_BYTES = 100
+RETRY_INITIAL_BACKOFF = 0.5
+RETRY_MAX_BACKOFF = 30
+
+
+class LoadMode(Enum):
+    bulk: str = 'bulk'
+    streaming: str = 'streaming'
+    parallel: str = 'parallel'
+    raw: str = 'raw'
 
 
 class ElasticLoader:
@@ -17,49 +42,346 @@ class ElasticLoader:
         index_name: dict,
         index_scheme_path: dict[str, Path],
         batch_size: int,
+        state: BaseState,
+        mode: LoadMode = LoadMode.bulk,
+        thread_count: int = 4,
+        batcher: Optional[AdaptiveBatcher] = None,
+        known_indexes: Optional[set] = None,
+        touched: Optional[TouchedDocuments] = None,
+        throttle: Optional[BulkThrottle] = None,
+        max_retries: int = 5,
+        dead_letters: Optional[DeadLetterSpool] = None,
     ) -> None:
         self.elastic = elastic
+        self.state = state
         self.transform = transform
         self.index_names = index_name
         self.index_scheme_path = index_scheme_path
         self.batch_size = batch_size
+        self.mode = mode
+        self.thread_count = thread_count
+        self.batcher = batcher
+        self.known_indexes = known_indexes if known_indexes is not None else set()
+        self.touched = touched
+        self.throttle = throttle
+        self.max_retries = max_retries
+        self.dead_letters = dead_letters
         self.data = self.transform.transform()
         self.index_exist()
         self.is_loaded = False
+        self.loaded_count = 0
+        self.failed_count = 0
+        self.dead_letter_count = 0
 
     def index_exist(self) -> None:
         """
-        Check that index is exists if not call self.create_index()
+        Check that index is exists if not call self.create_index(),
+        indexes from self.known_indexes are not checked
         """
         for name, index_name in self.index_names.items():
+            if index_name in self.known_indexes:
+                continue
             if not self.elastic.indices.exists(index=index_name):
                 self.create_index(index_name, name)
+            self.known_indexes.add(index_name)
 
     def create_index(self, index_name, path_name) -> None:
         """
-        Create elasticsearch index from specified scheme file
+        Create elasticsearch index from specified scheme file,
+        index created by concurrent loader in the meantime is ignored
         """
         with open(self.index_scheme_path.get(path_name), 'r') as file:
             index_scheme = json.load(file)
-            self.elastic.indices.create(index=index_name, body=index_scheme)
+            self.elastic.indices.create(index=index_name, body=index_scheme, ignore=400)
+
+    @staticmethod
+    def _action_index(action: Union[dict, bytes]) -> str:
+        if isinstance(action, bytes):
+            meta = orjson.loads(action[:action.index(b'\n')])
+            return next(iter(meta.values()))['_index']
+        return action['_index']
+
+    @staticmethod
+    def _action_target(action: Union[dict, bytes]) -> tuple[str, str]:
+        """
+        Function that return index and id of document of action
+        """
+        if isinstance(action, bytes):
+            meta = next(iter(orjson.loads(action[:action.index(b'\n')]).values()))
+            return meta['_index'], meta['_id']
+        return action['_index'], str(action['_id'])
+
+    @staticmethod
+    def _action_size(action: Union[dict, bytes]) -> int:
+        if isinstance(action, bytes):
+            return len(action)
+        return len(orjson.dumps(action.get('_source', action.get('doc')))) + ACTION_META_BYTES
 
     def _prepare_chunked_actions(self, actions: Iterator[dict]) -> Iterator[list[dict]]:
-        chunk = []
+        """
+        Generator that return actions by chunks of self.batch_size documents,
+        with batcher chunk is limited by count of documents and bytes of bulk profile of its index.
+        Actions are serialized for their size only with batcher, encoded actions are measured by length
+        """
+        chunk, chunk_bytes = [], 0
+        max_docs, max_bytes = self.batch_size, DEFAULT_MAX_CHUNK_BYTES
         while cur_data := next(actions):
+            if not chunk and self.batcher:
+                profile = self.batcher.profile(self._action_index(cur_data))
+                max_docs, max_bytes = profile.docs, profile.max_bytes
+            if self.batcher or isinstance(cur_data, bytes):
+                size = self._action_size(cur_data)
+                if chunk and chunk_bytes + size > max_bytes:
+                    yield chunk
+                    chunk, chunk_bytes = [], 0
+                chunk_bytes += size
             chunk.append(cur_data)
-            if len(chunk) == self.batch_size:
+            if len(chunk) >= max_docs:
                 yield chunk
-                chunk = []
+                chunk, chunk_bytes = [], 0
         if chunk:
-            self.is_loaded = True
             yield chunk
         yield None
 
+    def _observe(self, chunk: list, latency: float, rejected: int = 0) -> None:
+        index_name = self._action_index(chunk[0])
+        metrics.BULK_SECONDS.observe(latency, index=index_name)
+        if self.batcher:
+            self.batcher.observe(index_name, len(chunk), latency, rejected)
+
+    def _rejected_items(self, chunk: list, error: TransportError) -> list[tuple[bool, dict]]:
+        """
+        Results of documents of bulk request rejected as a whole with 429 status
+        """
+        results = []
+        for action in chunk:
+            index_name, doc_id = self._action_target(action)
+            item = {'_index': index_name, '_id': doc_id, 'status': 429, 'error': str(error.info or error.error)}
+            results.append((False, {'index': item}))
+        return results
+
+    def _bulk_request(self, chunk: list) -> list[tuple[bool, dict]]:
+        """
+        Send chunk by one bulk request, actions encoded to bulk lines are sent as is.
+        Other actions are serialized here by serializer of client, so size of every request body is known
+        :return: result of every document in order of chunk
+        """
+        if isinstance(chunk[0], bytes):
+            body = b''.join(chunk)
+        else:
+            dumps = self.elastic.transport.serializer.dumps
+            lines = (dumps(line) for action in chunk for line in expand_action(action) if line is not None)
+            body = ''.join(f'{line}\n' for line in lines).encode()
+        metrics.BULK_BYTES.inc(len(body), index=self._action_index(chunk[0]))
+        try:
+            response = self.elastic.bulk(body=body)
+        except TransportError as e:
+            if e.status_code != 429:
+                raise
+            return self._rejected_items(chunk, e)
+
+        results = []
+        for item in response['items']:
+            op_type, result = item.popitem()
+            results.append((200 <= result.get('status', 500) < 300, {op_type: result}))
+        return results
+
+    def _send_chunk(self, chunk: list) -> list[tuple[bool, dict]]:
+        """
+        Send chunk and send again only its documents rejected with 429 status, after every rejection
+        throttle rate is decreased and request waits for exponential backoff.
+        Documents are still rejected after self.max_retries attempts are returned as failed.
+        With self.dead_letters permanently refused documents are written to spool and returned with None flag,
+        with self.touched documents acknowledged by elasticsearch are added to it
+        :return: result of every document in order of chunk
+        """
+        results = [None] * len(chunk)
+        pending = list(range(len(chunk)))
+        for attempt in range(self.max_retries + 1):
+            actions = [chunk[position] for position in pending]
+            if self.throttle:
+                self.throttle.acquire(len(actions))
+            start = time.perf_counter()
+            response = self._bulk_request(actions)
+            latency = time.perf_counter() - start
+
+            rejected = []
+            for position, (is_ok, item) in zip(pending, response):
+                results[position] = (is_ok, item)
+                if not is_ok and self._is_rejected(item):
+                    rejected.append(position)
+            self._observe(actions, latency, len(rejected))
+
+            if not rejected:
+                if self.throttle:
+                    self.throttle.accepted()
+                break
+            if self.throttle:
+                self.throttle.rejected()
+            if attempt == self.max_retries:
+                break
+            index_name = self._action_index(chunk[0])
+            delay = min(RETRY_INITIAL_BACKOFF * 2 ** attempt, RETRY_MAX_BACKOFF)
+            rate = self.throttle.rate if self.throttle else None
+            logger.warning(
+                '%s of %s documents of index %s are rejected by elasticsearch, retry %s of %s in %.1f s%s',
+                len(rejected), len(actions), index_name, attempt + 1, self.max_retries, delay,
+                f', bulk rate is limited to {rate:.0f} docs/s' if rate else '',
+            )
+            metrics.RETRIED_DOCUMENTS.inc(len(rejected), index=index_name)
+            time.sleep(delay)
+            pending = rejected
+
+        self._settle(chunk, results)
+        return results
+
+    def _settle(self, chunk: list, results: list[tuple[Optional[bool], dict]]) -> None:
+        """
+        Write permanently refused documents of sent chunk to dead letter spool and add acknowledged ones to touched
+        """
+        if self.dead_letters:
+            self._spool_permanent(chunk, results)
+        if self.touched is not None:
+            self._touch_acknowledged(chunk, results)
+
+    def _spool_permanent(self, chunk: list, results: list[tuple[Optional[bool], dict]]) -> None:
+        """
+        Write permanently refused documents of chunk to dead letter spool and replace their ok flag by None
+        """
+        for position, (is_ok, item) in enumerate(results):
+            if not is_ok and is_permanent(item):
+                self.dead_letters.write(chunk[position], item)
+                results[position] = (None, item)
+
+    def _send_bulk(self, actions: Iterator[dict]) -> Iterator[tuple[bool, dict]]:
+        """
+        Send chunks one by one, raises on the first chunk with failed documents after retries of rejected ones,
+        documents written to dead letter spool are not errors
+        """
+        chunked_actions = self._prepare_chunked_actions(actions)
+        while chunk := next(chunked_actions):
+            results = self._send_chunk(chunk)
+            errors = [item for is_ok, item in results if is_ok is False]
+            if errors:
+                raise BulkIndexError(f'{len(errors)} document(s) failed to index.', errors)
+            yield from results
+
+    def _send_streaming(self, actions: Iterator[dict]) -> Iterator[tuple[bool, dict]]:
+        """
+        Send chunks one by one, result of every document is returned as soon as chunk is indexed
+        """
+        chunked_actions = self._prepare_chunked_actions(actions)
+        while chunk := next(chunked_actions):
+            yield from self._send_chunk(chunk)
+
+    def _send_parallel(self, actions: Iterator[dict]) -> Iterator[tuple[bool, dict]]:
+        """
+        Send chunks by self.thread_count bulk requests in flight at the same time,
+        results are returned in order of chunks
+        """
+        chunked_actions = self._prepare_chunked_actions(actions)
+        with ThreadPoolExecutor(max_workers=self.thread_count, thread_name_prefix='etl-bulk') as executor:
+            futures = deque()
+            while chunk := next(chunked_actions):
+                futures.append(executor.submit(self._send_chunk, chunk))
+                if len(futures) >= self.thread_count:
+                    yield from futures.popleft().result()
+            while futures:
+                yield from futures.popleft().result()
+
+    def _send_raw(self, actions: Iterator[bytes]) -> Iterator[tuple[bool, dict]]:
+        """
+        Send chunks of actions encoded to bulk lines as body of bulk request without serialization by client,
+        result of every document is returned as soon as chunk is indexed
+        """
+        yield from self._send_streaming(actions)
+
+    @staticmethod
+    def _is_rejected(item: dict) -> bool:
+        return next(iter(item.values())).get('status') == 429
+
+    def _split_checkpoints(self, actions: Iterator[dict], checkpoints: deque) -> Iterator[dict]:
+        """
+        Generator that return actions without checkpoints,
+        every met checkpoint is put to checkpoints with count of actions before it
+        """
+        position = 0
+        while action := next(actions):
+            if isinstance(action, Checkpoint):
+                checkpoints.append((position, action))
+                continue
+            position += 1
+            yield action
+        yield None
+
+    def _touch_acknowledged(self, chunk: list, results: list[tuple[Optional[bool], dict]]) -> None:
+        """
+        Add documents of chunk acknowledged by elasticsearch to self.touched
+        """
+        ids = defaultdict(list)
+        for action, (is_ok, _) in zip(chunk, results):
+            if is_ok:
+                index_name, doc_id = self._action_target(action)
+                ids[index_name].append(doc_id)
+        for index_name, doc_ids in ids.items():
+            self.touched.add(index_name, doc_ids)
+
+    def _commit(self, checkpoints: deque, acknowledged: int) -> None:
+        """
+        Save checkpoints that have all actions before them acknowledged by elasticsearch
+        """
+        while checkpoints and checkpoints[0][0] <= acknowledged:
+            _, checkpoint = checkpoints.popleft()
+            self.state.set_state(checkpoint.key, checkpoint.value)
+
+    def _count(self, part: str, is_ok: Optional[bool], item: dict) -> bool:
+        """
+        Count result of document of part
+        :return: True if document is failed
+        """
+        if is_ok:
+            self.loaded_count += 1
+            metrics.LOADED_DOCUMENTS.inc(part=part)
+            return False
+        if is_ok is None:
+            self.dead_letter_count += 1
+            metrics.DEAD_LETTER_DOCUMENTS.inc(part=part)
+            logger.error('Document is written to dead letter spool: %s', item)
+            return False
+
+        self.failed_count += 1
+        metrics.FAILED_DOCUMENTS.inc(part=part)
+        if self._is_rejected(item):
+            metrics.REJECTED_DOCUMENTS.inc(part=part)
+        logger.error('Document was not loaded: %s', item)
+        return True
+
     def load(self) -> None:
         """
-        Main loader function that load transformed data to self.index
+        Main loader function that load transformed data to self.index.
+        State is advanced only by checkpoints that follow loaded documents or documents written to dead letter spool,
+        after the first failed document of part its checkpoints are dropped
         """
-        for cur_data in self.data.values():
-            chunked_actions = self._prepare_chunked_actions(cur_data)
-            while actions := next(chunked_actions):
-                bulk(client=self.elastic, actions=actions)
+        send = getattr(self, f'_send_{self.mode.value}')
+        for name, cur_data in self.data.items():
+            checkpoints = deque()
+            acknowledged = 0
+            is_failed = False
+            for is_ok, item in send(self._split_checkpoints(cur_data, checkpoints)):
+                acknowledged += 1
+                if self._count(name, is_ok, item):
+                    is_failed = True
+                if not is_failed:
+                    self._commit(checkpoints, acknowledged)
+
+            if is_failed:
+                logger.warning('State of part %s is not advanced because of failed documents', name)
+            else:
+                self._commit(checkpoints, acknowledged)
+
+        self.state.flush()
+        self.is_loaded = self.loaded_count > 0
+        if self.failed_count:
+            logger.warning('Loaded %s documents, failed %s documents', self.loaded_count, self.failed_count)
+        if self.dead_letter_count:
+            logger.warning('%s documents are written to dead letter spool', self.dead_letter_count)
@@ -0,0 +1,240 @@
+""" Metrics of pipeline stages in prometheus text format"""
+import logging
+import os
+import tempfile
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from typing import Any, Callable, Iterator, Optional
+
+from states.state import BaseState
+from utils import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+def _labels_text(labels: Labels) -> str:
+    if not labels:
+        return ''
+    values = ','.join(f'{name}="{value}"' for name, value in labels)
+    return f'{{{values}}}'
+
+
+def _value_text(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric:
+    """
+    Base of metrics, values are kept by sorted label pairs given as keyword arguments
+    """
+
+    type_name = 'untyped'
+
+    def __init__(self, name: str, documentation: str) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.lock = Lock()
+        self.values = {}
+
+    @staticmethod
+    def _key(labels: dict[str, Any]) -> Labels:
+        return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+    def samples(self) -> Iterator[tuple[str, Labels, float]]:
+        with self.lock:
+            values = list(self.values.items())
+        for labels, value in values:
+            yield self.name, labels, value
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        for name, labels, value in self.samples():
+            lines.append(f'{name}{_labels_text(labels)} {_value_text(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type_name = 'counter'
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    Gauge with values set directly or calculated by function when metrics are rendered
+    """
+
+    type_name = 'gauge'
+
+    def set(self, value: float, **labels: Any) -> None:
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def set_function(self, function: Callable[[], Optional[float]], **labels: Any) -> None:
+        self.set(function, **labels)
+
+    def samples(self) -> Iterator[tuple[str, Labels, float]]:
+        for name, labels, value in super().samples():
+            if callable(value):
+                value = value()
+            if value is not None:
+                yield name, labels, value
+
+
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        super().__init__(name, documentation)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0))
+            counts[bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value)
+
+    def samples(self) -> Iterator[tuple[str, Labels, float]]:
+        with self.lock:
+            values = [(labels, list(counts), total) for labels, (counts, total) in self.values.items()]
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield f'{self.name}_bucket', labels + (('le', _value_text(bound)),), cumulative
+            yield f'{self.name}_count', labels, cumulative
+            yield f'{self.name}_sum', labels, total
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+ROWS_FETCHED = REGISTRY.register(Counter('etl_rows_fetched_total', 'Rows fetched from database by part'))
+FETCH_SECONDS = REGISTRY.register(
+    Histogram('etl_fetch_batch_seconds', 'Time of query and fetch of batch of rows by part'),
+)
+TRANSFORM_SECONDS = REGISTRY.register(Histogram('etl_transform_batch_seconds', 'Time of transform of batch by part'))
+BULK_SECONDS = REGISTRY.register(Histogram('etl_bulk_seconds', 'Latency of bulk requests by index'))
+BULK_BYTES = REGISTRY.register(Counter('etl_bulk_bytes_total', 'Bytes of bodies of bulk requests by index'))
+LOADED_DOCUMENTS = REGISTRY.register(Counter('etl_loaded_documents_total', 'Documents loaded by part'))
+FAILED_DOCUMENTS = REGISTRY.register(Counter('etl_failed_documents_total', 'Documents not loaded by part'))
+REJECTED_DOCUMENTS = REGISTRY.register(
+    Counter('etl_rejected_documents_total', 'Documents rejected by elasticsearch with 429 status by part'),
+)
+DEAD_LETTER_DOCUMENTS = REGISTRY.register(
+    Counter('etl_dead_letter_documents_total', 'Documents refused by elasticsearch and written to spool by part'),
+)
+RETRIED_DOCUMENTS = REGISTRY.register(
+    Counter('etl_retried_documents_total', 'Documents rejected with 429 status and sent again by index'),
+)
+CHECKPOINT_LAG = REGISTRY.register(
+    Gauge('etl_checkpoint_lag_seconds', 'Seconds between now and updated_at of saved checkpoint by part'),
+)
+CYCLE_SECONDS = REGISTRY.register(
+    Histogram('etl_cycle_seconds', 'Duration of ETL cycles', (1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)),
+)
+CYCLE_FAILURES = REGISTRY.register(Counter('etl_cycle_failures_total', 'ETL cycles failed with exception'))
+
+
+class BatchTimer:
+    """
+    Timer that sum time of transform of separate rows and observe the sum as time of batch
+    """
+
+    def __init__(self, part_name: str) -> None:
+        self.part_name = part_name
+        self.elapsed = 0.0
+        self.started = 0.0
+
+    def __enter__(self) -> 'BatchTimer':
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.elapsed += time.perf_counter() - self.started
+
+    def observe(self) -> None:
+        if self.elapsed:
+            TRANSFORM_SECONDS.observe(self.elapsed, part=self.part_name)
+            self.elapsed = 0.0
+
+
+def _checkpoint_time(value: Any) -> Optional[float]:
+    updated_at = value.get('updated_at') if isinstance(value, dict) else value
+    if updated_at is None:
+        return None
+    try:
+        return parse_timestamp(updated_at).timestamp()
+    except ValueError:
+        logger.warning('Checkpoint time %r is not a timestamp', updated_at)
+        return None
+
+
+def track_checkpoints(state: BaseState, part_names: list[str]) -> None:
+    """
+    Calculate checkpoint lag of parts from current values of state every time metrics are rendered
+    """
+    def lag(part_name: str) -> Optional[float]:
+        checkpoint_time = _checkpoint_time(state.get_state(part_name))
+        return None if checkpoint_time is None else time.time() - checkpoint_time
+
+    for part_name in part_names:
+        CHECKPOINT_LAG.set_function(lambda name=part_name: lag(name), part=part_name)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+def start_http_server(port: int, host: str = '0.0.0.0') -> ThreadingHTTPServer:  # noqa: S104
+    """
+    Serve metrics on every path of port in background thread
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logger.info('Metrics are served on port %s', port)
+    return server
+
+
+def write_textfile(path: str) -> None:
+    """
+    Write metrics to file for textfile collector, file is replaced atomically
+    """
+    dir_path = os.path.dirname(os.path.abspath(path))
+    os.makedirs(dir_path, exist_ok=True)
+    with tempfile.NamedTemporaryFile('w', dir=dir_path, suffix='.tmp', delete=False) as f:
+        f.write(REGISTRY.render())
+    os.replace(f.name, path)
@@ -0,0 +1,44 @@
+""" Bulk request lines encoded with orjson"""
+from typing import Iterator
+
+import orjson
+
+from states.state import Checkpoint
+
+NEWLINE = b'\n'
+
+
+def index_lines(index: str, _id, source: dict) -> bytes:
+    """
+    Encode index action with document as two lines of bulk request body
+    """
+    return orjson.dumps({'index': {'_index': index, '_id': _id}}) + NEWLINE + orjson.dumps(source) + NEWLINE
+
+
+def update_lines(index: str, _id, doc: dict) -> bytes:
+    """
+    Encode update action with partial document as two lines of bulk request body
+    """
+    return orjson.dumps({'update': {'_index': index, '_id': _id}}) + NEWLINE + orjson.dumps({'doc': doc}) + NEWLINE
+
+
+def action_lines(action: dict) -> bytes:
+    """
+    Encode action in format of elasticsearch.helpers as lines of bulk request body
+    """
+    if action['_op_type'] == 'update':
+        return update_lines(action['_index'], action['_id'], action['doc'])
+    return index_lines(action['_index'], action['_id'], action['_source'])
+
+
+def encode_actions(actions: Iterator[dict]) -> Iterator[bytes]:
+    """
+    Generator that encode actions to lines of bulk request body, checkpoints are returned as is
+    """
+    while action := next(actions):
+        if isinstance(action, Checkpoint):
+            yield action
+            continue
+        yield action_lines(action)
+
+    yield None
@@ -0,0 +1,280 @@
+""" Pipeline parts logic"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Optional
+
+from elasticsearch import Elasticsearch
+from psycopg2 import extensions as pg_ext
+from psycopg2.pool import ThreadedConnectionPool
+
+from config import settings
+from etl.batching import AdaptiveBatcher, BulkThrottle
+from etl.cache import TouchedDocuments
+from etl.coalesce import CoalescingTransform
+from etl.cdc import Changes
+from etl.dead_letters import DeadLetterSpool
+from etl.extract import (
+    Extracting,
+    PartName,
+    PostgresChangesExtracting,
+    PostgresExtracting,
+    PostgresShardExtracting,
+    Shard,
+)
+from etl.load import ElasticLoader, LoadMode
+from etl.profiling import ProfiledExtracting, ProfiledTransform, StageProfiler
+from etl.transform import ElasticTransformer, FastElasticTransformer, Transform
+from states.state import BaseState
+from utils import DatabaseData, TransformedData, buffered
+
+logger = logging.getLogger(__name__)
+
+# Parts that write to the films index. Their full and partial documents should be loaded in order,
+# so they are never processed at the same time
+FILMS_INDEX_PARTS = (PartName.films, PartName.films_persons, PartName.films_genres)
+
+
+def part_groups(parts: list[PartName]) -> list[list[PartName]]:
+    """
+    Split parts into groups that can be processed at the same time: parts of films index keep
+    their order in one group, every other part is a group of its own
+    """
+    films_parts = [part for part in parts if part in FILMS_INDEX_PARTS]
+    groups = [[part] for part in parts if part not in FILMS_INDEX_PARTS]
+    return [films_parts, *groups] if films_parts else groups
+
+
+class BufferedExtracting:
+    """
+    Extracting that fetch data of every part in background thread ahead of transform
+    """
+
+    def __init__(self, extract: Extracting, batch_size: int, queue_size: int) -> None:
+        self.source = extract
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+
+    def extract(self) -> DatabaseData:
+        return {
+            name: buffered(data, self.batch_size, self.queue_size)
+            for name, data in self.source.extract().items()
+        }
+
+
+class BufferedTransform:
+    """
+    Transform that transform data of every part in background thread ahead of load
+    """
+
+    def __init__(self, transform: Transform, batch_size: int, queue_size: int) -> None:
+        self.source = transform
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+
+    def transform(self) -> TransformedData:
+        return {
+            name: buffered(data, self.batch_size, self.queue_size)
+            for name, data in self.source.transform().items()
+        }
+
+
+class EtlPipeline:
+    def __init__(
+        self,
+        elastic: Elasticsearch,
+        state: BaseState,
+        pg_batch_size: int,
+        es_batch_size: int,
+        pg_page_size: int = 10000,
+        server_side: bool = False,
+        load_mode: LoadMode = LoadMode.bulk,
+        load_threads: int = 4,
+        queue_size: int = 0,
+        fast_transform: bool = False,
+        batcher: Optional[AdaptiveBatcher] = None,
+        coalesce_limit: int = 0,
+        index_names: Optional[dict] = None,
+        known_indexes: Optional[set] = None,
+        profiler: Optional[StageProfiler] = None,
+        copy_threshold: int = 0,
+        touched: Optional[TouchedDocuments] = None,
+        throttle: Optional[BulkThrottle] = None,
+        load_retries: int = 5,
+        dead_letters: Optional[DeadLetterSpool] = None,
+    ) -> None:
+        self.elastic = elastic
+        self.state = state
+        self.pg_batch_size = pg_batch_size
+        self.es_batch_size = es_batch_size
+        self.pg_page_size = pg_page_size
+        self.server_side = server_side
+        self.load_mode = load_mode
+        self.load_threads = load_threads
+        self.queue_size = queue_size
+        self.fast_transform = fast_transform
+        self.batcher = batcher
+        self.coalesce_limit = coalesce_limit
+        self.index_names = index_names or settings.elastic.INDEX
+        self.known_indexes = known_indexes
+        self.profiler = profiler
+        self.copy_threshold = copy_threshold
+        self.touched = touched
+        self.throttle = throttle
+        self.load_retries = load_retries
+        self.dead_letters = dead_letters
+        self.failed_count = 0
+        # parts of run_concurrently are loaded by several threads
+        self.failed_lock = Lock()
+
+    def run(self, conn: pg_ext.connection, parts: list[PartName]) -> bool:
+        """
+        Run extract -> transform -> load chain for parts one after another.
+        With queue_size extract, transform and load of next batches work at the same time,
+        stages are connected by queues of queue_size batches
+        :param conn: open connection with database
+        :param parts: parts to extract
+        :return: True if any document was loaded
+        """
+        extract = PostgresExtracting(
+            conn,
+            self.state,
+            settings.DEFAULT_PROCESS_TIME,
+            parts,
+            self.pg_batch_size,
+            self.pg_page_size,
+            self.server_side,
+            settings.postgres.ITERSIZE,
+            self.copy_threshold,
+        )
+        return self._transform_and_load(extract)
+
+    def run_shard(self, conn: pg_ext.connection, shard: Shard) -> bool:
+        """
+        Run chain for films of one shard of sharded initial load
+        :param conn: open connection with database, transaction should use exported snapshot
+        :param shard: range of film ids
+        :return: True if any document was loaded
+        """
+        extract = PostgresShardExtracting(
+            conn,
+            self.state,
+            shard,
+            settings.DEFAULT_PROCESS_TIME,
+            [PartName.films],
+            self.pg_batch_size,
+            self.pg_page_size,
+            self.server_side,
+            settings.postgres.ITERSIZE,
+            self.copy_threshold,
+        )
+        return self._transform_and_load(extract)
+
+    def run_changes(self, conn: pg_ext.connection, changes: Changes) -> bool:
+        """
+        Run chain for films, persons and genres changed according to notifications,
+        films of changed persons and genres are updated partially
+        :param conn: open connection with database
+        :param changes: ids of changed rows
+        :return: True if any document was loaded
+        """
+        extract = PostgresChangesExtracting(
+            conn,
+            self.state,
+            changes,
+            self.pg_batch_size,
+            self.server_side,
+            settings.postgres.ITERSIZE,
+        )
+        return self._transform_and_load(extract)
+
+    def _build_transform(self, extract: Extracting) -> Transform:
+        """
+        Chain of extract and transform stages by options of pipeline.
+        With profiler every stage of every part is profiled separately, code of loader is profiled as load stage
+        """
+        if self.profiler:
+            extract = ProfiledExtracting(extract, self.profiler)
+        if self.queue_size:
+            extract = BufferedExtracting(extract, self.pg_batch_size, self.queue_size)
+
+        serialize = self.load_mode == LoadMode.raw
+        # coalesced actions are merged as dicts and encoded after merging
+        transform_serialize = serialize and not self.coalesce_limit
+        if self.fast_transform:
+            transform = FastElasticTransformer(extract, self.pg_batch_size, transform_serialize, self.index_names)
+        else:
+            transform = ElasticTransformer(extract, transform_serialize, self.index_names)
+        if self.profiler:
+            transform = ProfiledTransform(transform, self.profiler)
+        if self.queue_size:
+            transform = BufferedTransform(transform, self.es_batch_size, self.queue_size)
+        if self.coalesce_limit:
+            transform = CoalescingTransform(transform, self.coalesce_limit, serialize)
+        if self.profiler:
+            transform = ProfiledTransform(transform, self.profiler, 'load')
+        return transform
+
+    def _transform_and_load(self, extract: Extracting) -> bool:
+        if self.profiler:
+            self.profiler.enter('load', 'all')
+        try:
+            return self._load(self._build_transform(extract))
+        finally:
+            if self.profiler:
+                self.profiler.exit()
+
+    def _load(self, transform: Transform) -> bool:
+        loader = ElasticLoader(
+            transform,
+            self.elastic,
+            self.index_names,
+            settings.elastic.INDEX_FILES,
+            self.es_batch_size,
+            self.state,
+            self.load_mode,
+            self.load_threads,
+            self.batcher,
+            self.known_indexes,
+            self.touched,
+            self.throttle,
+            self.load_retries,
+            self.dead_letters,
+        )
+
+        loader.load()
+        with self.failed_lock:
+            self.failed_count += loader.failed_count
+
+        return loader.is_loaded
+
+    def run_part(self, pool: ThreadedConnectionPool, parts: list[PartName]) -> bool:
+        """
+        Run chain for group of parts one after another on its own connection from pool
+        :param pool: pool of connections with database
+        :param parts: parts to extract
+        :return: True if any document was loaded
+        """
+        conn = pool.getconn()
+        try:
+            is_loaded = self.run(conn, parts)
+            logger.info('Parts %s are processed', ', '.join(part.value for part in parts))
+            return is_loaded
+        finally:
+            # pool finishes transaction of connection
+            pool.putconn(conn)
+
+    def run_concurrently(self, pool: ThreadedConnectionPool, parts: list[PartName], workers: int) -> bool:
+        """
+        Run chains of parts at the same time, at most workers groups of parts are in progress.
+        Parts of films index are run one after another by one worker, so newer partial updates
+        of films are not overwritten by older full documents
+        :param pool: pool of connections with database, should keep at least workers connections
+        :param parts: parts to extract
+        :param workers: count of groups of parts processed at the same time
+        :return: True if any document was loaded
+        """
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='etl') as executor:
+            futures = [executor.submit(self.run_part, pool, group) for group in part_groups(parts)]
+            results = [future.result() for future in futures]
+        return any(results)
@@ -0,0 +1,172 @@
+""" Profiling of pipeline stages logic"""
+import cProfile
+import io
+import logging
+import os
+import pstats
+import tracemalloc
+from typing import Iterator, Optional
+
+from etl.extract import Extracting
+from etl.transform import Transform
+from states.state import Checkpoint
+from utils import DatabaseData, TransformedData
+
+logger = logging.getLogger(__name__)
+
+TOP_FUNCTIONS = 50
+TOP_ALLOCATIONS = 20
+TRACEMALLOC_FRAMES = 10
+
+
+class StageProfiler:
+    """
+    Profiler that keeps separate cProfile of every stage and part, stages should run in one thread.
+    Stages are nested: transform pulls rows from extract inside its own next(), so profiles are kept in stack
+    and only the top one is enabled. Allocations are compared after every snapshot_every batches of extracted rows
+    """
+
+    def __init__(self, output_dir: str, snapshot_every: int = 1) -> None:
+        self.output_dir = output_dir
+        self.snapshot_every = snapshot_every
+        self.stack = []
+        self.profiles = {}
+        self.batches = {}
+        self.snapshots = {}
+        self.allocations = {}
+
+    def start(self) -> None:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+
+    def enter(self, stage: str, part: str) -> None:
+        if self.stack:
+            self.stack[-1].disable()
+        if (stage, part) not in self.profiles:
+            self.profiles[(stage, part)] = cProfile.Profile()
+        profile = self.profiles[(stage, part)]
+        self.stack.append(profile)
+        profile.enable()
+
+    def exit(self) -> None:
+        self.stack.pop().disable()
+        if self.stack:
+            self.stack[-1].enable()
+
+    def stage(self, stage: str, part: str, data: Iterator) -> Iterator:
+        """
+        Generator that pull every item of data under profile of stage and part,
+        every checkpoint of extract stage ends a batch of part
+        """
+        while True:
+            self.enter(stage, part)
+            try:
+                item = next(data)
+            finally:
+                self.exit()
+            yield item
+            if item is None:
+                return
+            if stage == 'extract' and isinstance(item, Checkpoint):
+                self.batch_done(part)
+
+    def consumer(self, stage: str, part: str, data: Iterator) -> Iterator:
+        """
+        Generator that profile code of consumer of data: time between returned item and request of next one
+        """
+        while (item := next(data)) is not None:
+            self.enter(stage, part)
+            try:
+                yield item
+            finally:
+                self.exit()
+        yield None
+
+    def batch_done(self, part: str) -> None:
+        batch = self.batches[part] = self.batches.get(part, 0) + 1
+        if batch % self.snapshot_every:
+            return
+        # snapshot is not counted in profile of current stage
+        if self.stack:
+            self.stack[-1].disable()
+        try:
+            self._snapshot(part, batch)
+        finally:
+            if self.stack:
+                self.stack[-1].enable()
+
+    def _snapshot(self, part: str, batch: int) -> None:
+        snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        current, peak = tracemalloc.get_traced_memory()
+        previous = self.snapshots.get(part)
+        self.snapshots[part] = snapshot
+        if previous is None:
+            top = snapshot.statistics('lineno')[:TOP_ALLOCATIONS]
+        else:
+            top = snapshot.compare_to(previous, 'lineno')[:TOP_ALLOCATIONS]
+        lines = [f'batch {batch}: traced {current} bytes, peak {peak} bytes']
+        lines.extend(f'    {stat}' for stat in top)
+        self.allocations.setdefault(part, []).append('\n'.join(lines))
+
+    def dump(self) -> None:
+        """
+        Write profile of every stage and part as pstats file and text report sorted by cumulative time,
+        summary of stages and allocation top-lists of parts by batches
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        summary = []
+        for (stage, part), profile in sorted(self.profiles.items()):
+            profile.create_stats()
+            if not profile.stats:
+                continue
+            stats = pstats.Stats(profile)
+            name = f'{stage}_{part}'
+            stats.dump_stats(os.path.join(self.output_dir, f'{name}.prof'))
+            report = io.StringIO()
+            stats.stream = report
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_FUNCTIONS)
+            with open(os.path.join(self.output_dir, f'{name}.txt'), 'w') as file:
+                file.write(report.getvalue())
+            summary.append(f'{stage:<10} {part:<15} {stats.total_tt:10.3f}s')
+
+        with open(os.path.join(self.output_dir, 'summary.txt'), 'w') as file:
+            file.write('\n'.join(summary) + '\n')
+        for part, allocations in self.allocations.items():
+            with open(os.path.join(self.output_dir, f'allocations_{part}.txt'), 'w') as file:
+                file.write('\n\n'.join(allocations) + '\n')
+
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        logger.info('Profile is written to %s', self.output_dir)
+
+
+class ProfiledExtracting:
+    """
+    Extracting with data of every part pulled under extract profile of the part
+    """
+
+    def __init__(self, extract: Extracting, profiler: StageProfiler) -> None:
+        self.source = extract
+        self.profiler = profiler
+
+    def extract(self) -> DatabaseData:
+        return {name: self.profiler.stage('extract', name, data) for name, data in self.source.extract().items()}
+
+
+class ProfiledTransform:
+    """
+    Transform with data of every part pulled under transform profile of the part,
+    with consumer_stage code that reads transformed data is profiled as the consumer stage of the part
+    """
+
+    def __init__(self, transform: Transform, profiler: StageProfiler, consumer_stage: Optional[str] = None) -> None:
+        self.source = transform
+        self.profiler = profiler
+        self.consumer_stage = consumer_stage
+
+    def transform(self) -> TransformedData:
+        if self.consumer_stage:
+            return {
+                name: self.profiler.consumer(self.consumer_stage, name, data)
+                for name, data in self.source.transform().items()
+            }
+        return {name: self.profiler.stage('transform', name, data) for name, data in self.source.transform().items()}
@@ -0,0 +1,86 @@
+""" Compact rows of queries logic"""
+from functools import lru_cache
+from typing import Any, Iterator, Optional
+
+from psycopg2 import extensions as pg_ext
+
+
+class Record(tuple):
+    """
+    Row of query kept as plain tuple. Columns map of name to position is shared by all rows of the query,
+    so row has no dict or index of its own. Values are read by position or by column name like in DictRow
+    """
+
+    __slots__ = ()
+    columns: dict[str, int] = {}
+
+    def __getitem__(self, key: Any) -> Any:
+        if isinstance(key, str):
+            return tuple.__getitem__(self, self.columns[key])
+        return tuple.__getitem__(self, key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        index = self.columns.get(key)
+        if index is None:
+            return default
+        return tuple.__getitem__(self, index)
+
+    def keys(self) -> Iterator[str]:
+        return iter(self.columns)
+
+    def items(self) -> Iterator[tuple[str, Any]]:
+        return zip(self.columns, self)
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self.columns
+
+
+@lru_cache(maxsize=128)
+def record_type(columns: tuple[str, ...]) -> type[Record]:
+    """
+    Function that return Record class of query columns, the same columns give the same class
+    """
+    return type('Record', (Record,), {'__slots__': (), 'columns': {name: index for index, name in enumerate(columns)}})
+
+
+class RecordCursor(pg_ext.cursor):
+    """
+    Cursor that return rows as Record of executed query instead of DictRow
+    """
+
+    def execute(self, query: Any, params: Any = None) -> None:
+        self.record = None
+        return super().execute(query, params)
+
+    def _record_type(self) -> type[Record]:
+        if self.record is None:
+            self.record = record_type(tuple(column.name for column in self.description))
+        return self.record
+
+    def fetchone(self) -> Optional[Record]:
+        row = super().fetchone()
+        if row is None:
+            return None
+        return self._record_type()(row)
+
+    def fetchmany(self, size: Optional[int] = None) -> list[Record]:
+        rows = super().fetchmany(size) if size is not None else super().fetchmany()
+        if not rows:
+            return rows
+        return list(map(self._record_type(), rows))
+
+    def fetchall(self) -> list[Record]:
+        rows = super().fetchall()
+        if not rows:
+            return rows
+        return list(map(self._record_type(), rows))
+
+    def __iter__(self) -> Iterator[Record]:
+        rows = super().__iter__()
+        try:
+            row = next(rows)
+        except StopIteration:
+            return
+        record = self._record_type()
+        yield record(row)
+        yield from map(record, rows)
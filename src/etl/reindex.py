@@ -0,0 +1,90 @@
+""" Rebuild of indexes without downtime logic"""
+import datetime
+import json
+import logging
+from pathlib import Path
+
+from elasticsearch import Elasticsearch
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REPLICAS = 1
+DEFAULT_REFRESH_INTERVAL = '1s'
+
+
+class IndexRebuild:
+    """
+    New version of index behind alias. Version is created from scheme file with refresh disabled
+    and without replicas for fast bulk load, settings of scheme are restored before alias is moved to it
+    """
+
+    def __init__(self, elastic: Elasticsearch, alias: str, scheme_path: Path, version: str) -> None:
+        self.elastic = elastic
+        self.alias = alias
+        self.index_name = f'{alias}_{version}'
+        with open(scheme_path, 'r') as file:
+            self.scheme = json.load(file)
+        index_settings = self.scheme.get('settings', {})
+        self.refresh_interval = index_settings.get('refresh_interval', DEFAULT_REFRESH_INTERVAL)
+        self.replicas = index_settings.get('number_of_replicas', DEFAULT_REPLICAS)
+
+    def create(self) -> None:
+        body = {**self.scheme}
+        body['settings'] = {**self.scheme.get('settings', {}), 'refresh_interval': '-1', 'number_of_replicas': 0}
+        self.elastic.indices.create(index=self.index_name, body=body)
+        logger.info('Index %s is created for alias %s', self.index_name, self.alias)
+
+    def finish(self) -> None:
+        """
+        Restore refresh interval and replicas of scheme, merge segments and wait until index can serve reads
+        """
+        self.elastic.indices.put_settings(
+            index=self.index_name,
+            body={'index': {'refresh_interval': self.refresh_interval, 'number_of_replicas': self.replicas}},
+        )
+        self.elastic.indices.forcemerge(index=self.index_name, max_num_segments=1, request_timeout=3600)
+        self.elastic.indices.refresh(index=self.index_name)
+        self.elastic.cluster.health(index=self.index_name, wait_for_status='yellow', request_timeout=600)
+
+    def alias_actions(self) -> list[dict]:
+        """
+        Actions that move alias to new version, previous versions are removed.
+        Index created before aliases were used has the name of alias and is removed too
+        """
+        actions = [{'add': {'index': self.index_name, 'alias': self.alias}}]
+        if self.elastic.indices.exists_alias(name=self.alias):
+            for index_name in self.elastic.indices.get_alias(name=self.alias):
+                actions.append({'remove_index': {'index': index_name}})
+        elif self.elastic.indices.exists(index=self.alias):
+            actions.append({'remove_index': {'index': self.alias}})
+        return actions
+
+    def drop(self) -> None:
+        self.elastic.indices.delete(index=self.index_name, ignore=404)
+
+
+def create_rebuilds(
+        elastic: Elasticsearch,
+        aliases: dict[str, str],
+        scheme_paths: dict[str, Path],
+) -> dict[str, IndexRebuild]:
+    """
+    Function that return new versions of indexes named by current time
+    :param elastic: elasticsearch client
+    :param aliases: aliases that are read by API, by part names of settings
+    :param scheme_paths: paths to scheme files, by part names of settings
+    :return: index rebuilds by part names of settings
+    """
+    version = datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S')
+    return {name: IndexRebuild(elastic, alias, scheme_paths[name], version) for name, alias in aliases.items()}
+
+
+def swap_aliases(elastic: Elasticsearch, rebuilds: list[IndexRebuild]) -> None:
+    """
+    Move aliases to new versions of indexes by one atomic request, readers never see half built index
+    """
+    actions = []
+    for rebuild in rebuilds:
+        actions.extend(rebuild.alias_actions())
+    elastic.indices.update_aliases(body={'actions': actions})
+    logger.info('Aliases are moved: %s', ', '.join(f'{r.alias} -> {r.index_name}' for r in rebuilds))
@@ -0,0 +1,128 @@
+""" Connections and clients kept alive across ETL cycles"""
+import logging
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+import psycopg2
+from elasticsearch import Elasticsearch
+from psycopg2 import extensions as pg_ext
+from psycopg2.pool import ThreadedConnectionPool
+
+from etl.batching import BulkThrottle
+from etl.cache import TouchedDocuments
+from etl.records import RecordCursor
+from states.state import State
+from states.state_storage import Storage
+
+logger = logging.getLogger(__name__)
+
+
+class HealthCheckedPool(ThreadedConnectionPool):
+    """
+    Pool that check connection before it is given out, broken connection is closed and replaced by new one
+    """
+
+    @staticmethod
+    def is_healthy(conn: pg_ext.connection) -> bool:
+        if conn.closed:
+            return False
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1;')
+            conn.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    def getconn(self, key: Optional[str] = None) -> pg_ext.connection:
+        conn = super().getconn(key)
+        if not self.is_healthy(conn):
+            logger.warning('Connection with database is broken, it is replaced by new one')
+            self.putconn(conn, key, close=True)
+            conn = super().getconn(key)
+        return conn
+
+    def putconn(self, conn: pg_ext.connection, key: Optional[str] = None, close: bool = False) -> None:
+        try:
+            super().putconn(conn, key, close)
+        except psycopg2.Error:
+            # rollback of broken connection failed, connection is dropped
+            super().putconn(conn, key, close=True)
+
+
+class Resources:
+    """
+    Database connections, elasticsearch client and state that are created on first use and kept between cycles.
+    Pool keeps pool_size connections open, elasticsearch client keeps es_maxsize HTTP connections alive.
+    Indexes that are known to exist are not checked again until invalidate() is called after failed cycle,
+    bulk throttle keeps rate limit learned from rejections of elasticsearch.
+    Touched documents are kept until cache is invalidated, so retried cycle does not lose ids of failed one
+    """
+
+    def __init__(
+        self,
+        dsl: dict,
+        hosts: list[dict],
+        storage: Storage,
+        pool_size: int = 1,
+        es_maxsize: int = 10,
+        state_flush_interval: float = 0,
+        invalidate_limit: int = 0,
+    ) -> None:
+        self.dsl = dsl
+        self.hosts = hosts
+        self.storage = storage
+        self.pool_size = pool_size
+        self.es_maxsize = es_maxsize
+        self.state_flush_interval = state_flush_interval
+        self.known_indexes = set()
+        self.throttle = BulkThrottle()
+        self.touched = TouchedDocuments(invalidate_limit)
+        self._pool = None
+        self._elastic = None
+        self._state = None
+
+    @property
+    def pool(self) -> HealthCheckedPool:
+        if self._pool is None or self._pool.closed:
+            # connections above minconn are closed when they are put back, so pool keeps all of them
+            self._pool = HealthCheckedPool(self.pool_size, self.pool_size, **self.dsl, cursor_factory=RecordCursor)
+        return self._pool
+
+    @property
+    def elastic(self) -> Elasticsearch:
+        if self._elastic is None:
+            self._elastic = Elasticsearch(self.hosts, maxsize=self.es_maxsize)
+        return self._elastic
+
+    @property
+    def state(self) -> State:
+        if self._state is None:
+            self._state = State(self.storage, self.state_flush_interval)
+        return self._state
+
+    @contextmanager
+    def connection(self) -> Iterator[pg_ext.connection]:
+        """
+        Context manager that give connection from pool, transaction is finished when connection is put back
+        """
+        pool = self.pool
+        conn = pool.getconn()
+        try:
+            yield conn
+        finally:
+            pool.putconn(conn)
+
+    def invalidate(self) -> None:
+        """
+        Forget indexes known to exist, they are checked again in the next cycle
+        """
+        self.known_indexes.clear()
+
+    def close(self) -> None:
+        if self._pool is not None and not self._pool.closed:
+            self._pool.closeall()
+        if self._elastic is not None:
+            self._elastic.close()
+        if self._state is not None:
+            self._state.flush()
@@ -0,0 +1,53 @@
+""" Scheduling of parts logic"""
+import logging
+import time
+
+from etl.extract import PartName
+
+logger = logging.getLogger(__name__)
+
+
+class PartSchedule:
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self.next_run = 0.0
+
+
+class AdaptiveScheduler:
+    """
+    Scheduler with its own interval for every part: interval is halved after changes were found
+    and doubled after check without changes, it is kept between min_interval and max_interval
+    """
+
+    def __init__(self, parts: list[PartName], min_interval: float, max_interval: float) -> None:
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.schedules = {part: PartSchedule(min_interval) for part in parts}
+
+    def due(self) -> list[PartName]:
+        """
+        Function that return parts which time to check has come
+        """
+        now = time.monotonic()
+        return [part for part, schedule in self.schedules.items() if schedule.next_run <= now]
+
+    def report(self, part: PartName, has_changes: bool) -> None:
+        """
+        Tune interval of part by result of its check and plan the next check
+        :param part: checked part
+        :param has_changes: True if part had changed rows
+        """
+        schedule = self.schedules[part]
+        if has_changes:
+            schedule.interval = max(self.min_interval, schedule.interval / 2)
+        else:
+            schedule.interval = min(self.max_interval, schedule.interval * 2)
+        schedule.next_run = time.monotonic() + schedule.interval
+        logger.debug('Part %s is checked, next check in %.0fs', part.value, schedule.interval)
+
+    def sleep_time(self) -> float:
+        """
+        Function that return seconds until the next part check
+        """
+        next_run = min(schedule.next_run for schedule in self.schedules.values())
+        return max(0.0, next_run - time.monotonic())
@@ -0,0 +1,183 @@
+""" Sharded initial load logic"""
+import json
+import logging
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Optional
+
+import psycopg2
+from elasticsearch import Elasticsearch
+from psycopg2 import extensions as pg_ext
+
+import raw_sql
+from config import settings
+from etl.batching import AdaptiveBatcher, BulkThrottle
+from etl.extract import FIRST_ID, LAST_ID, Shard
+from etl.pipeline import EtlPipeline
+from etl.records import RecordCursor
+from states.state import BaseState, State
+from states.state_storage import JsonFileStorage
+from utils import db_conn
+
+logger = logging.getLogger(__name__)
+
+PLAN_FILE = 'plan.json'
+UUID_SPACE = 2 ** 128
+
+
+def _uuid_text(value: int) -> str:
+    text = f'{value:032x}'
+    return f'{text[:8]}-{text[8:12]}-{text[12:16]}-{text[16:20]}-{text[20:]}'
+
+
+def id_ranges(count: int) -> list[Shard]:
+    """
+    Function that split space of uuid into count equal ranges (start, end],
+    random uuid of films are spread over shards evenly
+    """
+    bounds = [FIRST_ID] + [_uuid_text(UUID_SPACE * number // count) for number in range(1, count)] + [LAST_ID]
+    return [Shard(number, bounds[number], bounds[number + 1]) for number in range(count)]
+
+
+def _shard_path(shards_dir: str, shard: Shard) -> str:
+    return os.path.join(shards_dir, f'shard_{shard.number}.json')
+
+
+class PipelineFactory:
+    """
+    Factory of pipelines that is passed to worker processes, client and batcher are created in worker
+    """
+
+    def __init__(self, hosts: list[dict], options: dict, adaptive_batch: bool = False) -> None:
+        self.hosts = hosts
+        self.options = options
+        self.adaptive_batch = adaptive_batch
+
+    def __call__(self, state: BaseState) -> EtlPipeline:
+        batcher = None
+        if self.adaptive_batch:
+            batcher = AdaptiveBatcher(
+                settings.elastic.INDEX, settings.elastic.BULK_PROFILES, self.options['es_batch_size'],
+            )
+        return EtlPipeline(Elasticsearch(self.hosts), state, batcher=batcher, throttle=BulkThrottle(), **self.options)
+
+
+def run_shard(
+        shard: Shard,
+        snapshot: str,
+        shards_dir: str,
+        pipeline_factory: PipelineFactory,
+        dsl: dict,
+) -> bool:
+    """
+    Load films of shard in worker process inside exported snapshot, checkpoints are kept in state file of shard
+    :return: True if all documents of shard are loaded
+    """
+    state = State(JsonFileStorage(_shard_path(shards_dir, shard)), flush_interval=5)
+    if state.get_state('done'):
+        return True
+
+    pipeline = pipeline_factory(state)
+    with db_conn(psycopg2.connect(**dsl, cursor_factory=RecordCursor)) as conn:
+        conn.set_session(isolation_level=pg_ext.ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+        with conn.cursor() as cur:
+            cur.execute('SET TRANSACTION SNAPSHOT %s;', (snapshot,))
+        pipeline.run_shard(conn, shard)
+
+    if not pipeline.failed_count:
+        state.set_state('done', True)
+    state.flush()
+    logger.info('Shard %s is processed, failed documents: %s', shard.number, pipeline.failed_count)
+    return not pipeline.failed_count
+
+
+class ShardedInit:
+    """
+    Initial load of films split into id ranges loaded by worker processes.
+    All workers read the same snapshot exported by coordinator transaction. Plan of shards and keyset of the last
+    changed film in the first snapshot are kept in shards_dir, so after interruption only unfinished shards are run
+    and films checkpoint does not skip changes made between snapshots of interrupted and resumed runs
+    """
+
+    def __init__(
+        self,
+        dsl: dict,
+        shards_dir: str,
+        shards: int,
+        pipeline_factory: PipelineFactory,
+    ) -> None:
+        self.dsl = dsl
+        self.shards_dir = shards_dir
+        self.shards = shards
+        self.pipeline_factory = pipeline_factory
+
+    def _plan_path(self) -> str:
+        return os.path.join(self.shards_dir, PLAN_FILE)
+
+    def _read_plan(self) -> Optional[dict]:
+        try:
+            with open(self._plan_path(), 'r') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def _write_plan(self, plan: dict) -> None:
+        os.makedirs(self.shards_dir, exist_ok=True)
+        JsonFileStorage(self._plan_path()).save_state(plan)
+
+    @staticmethod
+    def _last_keyset(conn: pg_ext.connection) -> Optional[dict]:
+        with conn.cursor() as cur:
+            cur.execute(raw_sql.film_last_keyset)
+            row = cur.fetchone()
+        if row is None:
+            return None
+        return {'updated_at': str(row[0]), 'id': str(row[1])}
+
+    def _unfinished(self, shards: list[Shard]) -> list[Shard]:
+        return [
+            shard for shard in shards
+            if not JsonFileStorage(_shard_path(self.shards_dir, shard)).retrieve_state().get('done')
+        ]
+
+    def run(self) -> Optional[dict]:
+        """
+        Run unfinished shards and remove plan when all of them are loaded,
+        RuntimeError is raised when some shards are not loaded
+        :return: films checkpoint for incremental load, None if there are no films
+        """
+        with db_conn(psycopg2.connect(**self.dsl)) as conn:
+            conn.set_session(isolation_level=pg_ext.ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+            with conn.cursor() as cur:
+                cur.execute('SELECT pg_export_snapshot();')
+                snapshot = cur.fetchone()[0]
+
+            plan = self._read_plan()
+            if plan is None:
+                plan = {'shards': self.shards, 'checkpoint': self._last_keyset(conn)}
+                self._write_plan(plan)
+            elif plan['shards'] != self.shards:
+                logger.warning('Unfinished sharded load with %s shards is resumed', plan['shards'])
+
+            shards = self._unfinished(id_ranges(plan['shards']))
+            logger.info('Loading %s shards of films in snapshot %s', len(shards), snapshot)
+            # coordinator transaction keeps snapshot alive until workers are finished
+            results = self._run_workers(shards, snapshot)
+
+        if not all(results):
+            raise RuntimeError('Some shards are not loaded, they are resumed by the next run')
+        shutil.rmtree(self.shards_dir, ignore_errors=True)
+        return plan['checkpoint']
+
+    def _run_workers(self, shards: list[Shard], snapshot: str) -> list[bool]:
+        if not shards:
+            return []
+        # workers are spawned, so they do not share connections of coordinator
+        with ProcessPoolExecutor(max_workers=len(shards), mp_context=get_context('spawn')) as executor:
+            futures = [
+                executor.submit(run_shard, shard, snapshot, self.shards_dir, self.pipeline_factory, self.dsl)
+                for shard in shards
+            ]
+            return [future.result() for future in futures]
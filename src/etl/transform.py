@@ -1,11 +1,12 @@
 """ Transform parts logic"""
-import datetime
 import logging
-from typing import Iterator, Protocol
+from typing import Iterator, Optional, Protocol, Union
 
 from config import settings
-from etl import scheme
+from etl import metrics, ndjson, scheme
 from etl.extract import Extracting
+from etl.fast_scheme import FastScheme
+from states.state import Checkpoint
 from utils import TransformedData
 
 logger = logging.getLogger(__name__)
@@ -19,8 +20,13 @@ class Transform(Protocol):
 
 
 class ElasticTransformer:
-    def __init__(self, extract: Extracting) -> None:
+    # transform generators encode actions to bulk lines by themselves when self.serialize is set
+    encodes_actions = False
+
+    def __init__(self, extract: Extracting, serialize: bool = False, index_names: Optional[dict] = None) -> None:
         self.extract = extract
+        self.serialize = serialize
+        self.index_names = index_names or settings.elastic.INDEX
         self.data = self.extract.extract()
 
     def transform(self) -> TransformedData:
@@ -34,6 +40,9 @@ class ElasticTransformer:
                 result[extract_name] = getattr(self, f'_transform_{extract_name}')()
             except AttributeError:
                 logger.warning('Non-existent extract part: %s', extract_name)
+                continue
+            if self.serialize and not self.encodes_actions:
+                result[extract_name] = ndjson.encode_actions(result[extract_name])
         return result
 
     def _transform_films(self) -> Iterator[dict]:
@@ -41,16 +50,23 @@ class ElasticTransformer:
         Generator to transform films data
         """
         films_data = self.data['films']
+        timer = metrics.BatchTimer('films')
         while film := next(films_data):
-            serialized_film = scheme.FilmScheme(**film)
-            es_action = {
-                '_op_type': 'index',
-                '_index': settings.elastic.INDEX.get('films'),
-                '_id': serialized_film.id,
-                '_source': serialized_film.dict(),
-            }
+            if isinstance(film, Checkpoint):
+                timer.observe()
+                yield film
+                continue
+            with timer:
+                serialized_film = scheme.FilmScheme(**film)
+                es_action = {
+                    '_op_type': 'index',
+                    '_index': self.index_names.get('films'),
+                    '_id': serialized_film.id,
+                    '_source': serialized_film.dict(),
+                }
             yield es_action
 
+        timer.observe()
         yield None
 
     def _transform_films_persons(self) -> Iterator[dict]:
@@ -58,16 +74,23 @@ class ElasticTransformer:
         Generator to transform film persons data
         """
         persons_data = self.data['films_persons']
+        timer = metrics.BatchTimer('films_persons')
         while person := next(persons_data):
-            serialized_person = scheme.PersonScheme(**person)
-            es_action = {
-                '_op_type': 'update',
-                '_index': settings.elastic.INDEX.get('films'),
-                '_id': serialized_person.film_id,
-                'doc': serialized_person.dict(exclude={'film_id'}),
-            }
+            if isinstance(person, Checkpoint):
+                timer.observe()
+                yield person
+                continue
+            with timer:
+                serialized_person = scheme.PersonScheme(**person)
+                es_action = {
+                    '_op_type': 'update',
+                    '_index': self.index_names.get('films'),
+                    '_id': serialized_person.film_id,
+                    'doc': serialized_person.dict(exclude={'film_id'}),
+                }
             yield es_action
 
+        timer.observe()
         yield None
 
     def _transform_films_genres(self) -> Iterator[dict]:
@@ -75,17 +98,24 @@ class ElasticTransformer:
         Generator to transform film genres data
         """
         genres_data = self.data['films_genres']
+        timer = metrics.BatchTimer('films_genres')
         while genre := next(genres_data):
-            serialized_genre = scheme.GenreScheme(**genre)
-            es_action = {
-                '_op_type': 'update',
-                '_index': settings.elastic.INDEX.get('films'),
-                '_id': serialized_genre.film_id,
-                'doc': serialized_genre.dict(exclude={'film_id'}),
-            }
+            if isinstance(genre, Checkpoint):
+                timer.observe()
+                yield genre
+                continue
+            with timer:
+                serialized_genre = scheme.GenreScheme(**genre)
+                es_action = {
+                    '_op_type': 'update',
+                    '_index': self.index_names.get('films'),
+                    '_id': serialized_genre.film_id,
+                    'doc': serialized_genre.dict(exclude={'film_id'}),
+                }
 
             yield es_action
 
+        timer.observe()
         yield None
 
     def _transform_persons(self) -> Iterator[dict]:
@@ -93,17 +123,24 @@ class ElasticTransformer:
         Generator to transform persons data
         """
         persons_data = self.data['persons']
+        timer = metrics.BatchTimer('persons')
         while person := next(persons_data):
-            serialized_person = scheme.Person(**person)
-            es_action = {
-                '_op_type': 'index',
-                '_index': settings.elastic.INDEX.get('persons'),
-                '_id': serialized_person.id,
-                '_source': serialized_person.dict(),
-            }
+            if isinstance(person, Checkpoint):
+                timer.observe()
+                yield person
+                continue
+            with timer:
+                serialized_person = scheme.Person(**person)
+                es_action = {
+                    '_op_type': 'index',
+                    '_index': self.index_names.get('persons'),
+                    '_id': serialized_person.id,
+                    '_source': serialized_person.dict(),
+                }
 
             yield es_action
 
+        timer.observe()
         yield None
 
     def _transform_genres(self) -> Iterator[dict]:
@@ -111,15 +148,126 @@ class ElasticTransformer:
         Generator to transform genres data
         """
         genres_data = self.data['genres']
+        timer = metrics.BatchTimer('genres')
         while genre := next(genres_data):
-            serialized_genre = scheme.Genre(**genre)
-            es_action = {
-                '_op_type': 'index',
-                '_index': settings.elastic.INDEX.get('genres'),
-                '_id': serialized_genre.id,
-                '_source': serialized_genre.dict(),
-            }
+            if isinstance(genre, Checkpoint):
+                timer.observe()
+                yield genre
+                continue
+            with timer:
+                serialized_genre = scheme.Genre(**genre)
+                es_action = {
+                    '_op_type': 'index',
+                    '_index': self.index_names.get('genres'),
+                    '_id': serialized_genre.id,
+                    '_source': serialized_genre.dict(),
+                }
 
             yield es_action
 
+        timer.observe()
+        yield None
+
+
+class FastElasticTransformer(ElasticTransformer):
+    """
+    Transformer that validate rows by batches with FastScheme instead of pydantic models instances
+    """
+
+    films_scheme = FastScheme(scheme.FilmScheme)
+    films_persons_scheme = FastScheme(scheme.PersonScheme)
+    films_genres_scheme = FastScheme(scheme.GenreScheme)
+    persons_scheme = FastScheme(scheme.Person)
+    genres_scheme = FastScheme(scheme.Genre)
+    encodes_actions = True
+
+    def __init__(
+        self,
+        extract: Extracting,
+        batch_size: int = 1000,
+        serialize: bool = False,
+        index_names: Optional[dict] = None,
+    ) -> None:
+        super().__init__(extract, serialize, index_names)
+        self.batch_size = batch_size
+
+    def _batches(self, extract_name: str) -> Iterator[Union[list, Checkpoint]]:
+        """
+        Generator that return rows of part by lists of self.batch_size, checkpoints are returned as is
+        """
+        data = self.data[extract_name]
+        batch = []
+        while row := next(data):
+            if isinstance(row, Checkpoint):
+                if batch:
+                    yield batch
+                    batch = []
+                yield row
+                continue
+            batch.append(row)
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _index_actions(self, extract_name: str, index_name: str) -> Iterator[Union[dict, bytes]]:
+        """
+        Generator of index actions with validated rows of part as documents,
+        actions are encoded to bulk lines when self.serialize is set
+        """
+        fast_scheme = getattr(self, f'{extract_name}_scheme')
+        index = self.index_names.get(index_name)
+        timer = metrics.BatchTimer(extract_name)
+        for batch in self._batches(extract_name):
+            if isinstance(batch, Checkpoint):
+                yield batch
+                continue
+            with timer:
+                sources = fast_scheme.convert_batch(batch)
+            timer.observe()
+            if self.serialize:
+                yield from (ndjson.index_lines(index, source['id'], source) for source in sources)
+            else:
+                yield from ({'_op_type': 'index', '_index': index, '_id': source['id'], '_source': source}
+                            for source in sources)
+
+        yield None
+
+    def _update_actions(self, extract_name: str, index_name: str) -> Iterator[Union[dict, bytes]]:
+        """
+        Generator of update actions with validated rows of part without film_id as partial documents,
+        actions are encoded to bulk lines when self.serialize is set
+        """
+        fast_scheme = getattr(self, f'{extract_name}_scheme')
+        index = self.index_names.get(index_name)
+        timer = metrics.BatchTimer(extract_name)
+        for batch in self._batches(extract_name):
+            if isinstance(batch, Checkpoint):
+                yield batch
+                continue
+            with timer:
+                docs = fast_scheme.convert_batch(batch)
+            timer.observe()
+            if self.serialize:
+                yield from (ndjson.update_lines(index, doc.pop('film_id'), doc) for doc in docs)
+            else:
+                yield from ({'_op_type': 'update', '_index': index, '_id': doc.pop('film_id'), 'doc': doc}
+                            for doc in docs)
+
         yield None
+
+    def _transform_films(self) -> Iterator[dict]:
+        return self._index_actions('films', 'films')
+
+    def _transform_films_persons(self) -> Iterator[dict]:
+        return self._update_actions('films_persons', 'films')
+
+    def _transform_films_genres(self) -> Iterator[dict]:
+        return self._update_actions('films_genres', 'films')
+
+    def _transform_persons(self) -> Iterator[dict]:
+        return self._index_actions('persons', 'persons')
+
+    def _transform_genres(self) -> Iterator[dict]:
+        return self._index_actions('genres', 'genres')
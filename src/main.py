@@ -1,63 +1,333 @@
 import argparse
-import datetime
 import logging.config
-from time import sleep
+import sys
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
 
 import psycopg2
-import jwt
 import requests
-from elasticsearch import Elasticsearch
-from psycopg2.extras import DictCursor
 
 from config import settings
+from etl import metrics
+from etl.batching import AdaptiveBatcher
+from etl.cache import CacheInvalidator, TouchedDocuments
+from etl.cdc import ChangeListener, Changes, install_triggers
+from etl.dead_letters import DeadLetterSpool, spool_changes
 from etl.extract import PartName, PostgresExtracting
-from etl.load import ElasticLoader
-from etl.transform import ElasticTransformer
+from etl.indexes import create_indexes, verify_plans
+from etl.load import LoadMode
+from etl.pipeline import EtlPipeline
+from etl.profiling import StageProfiler
+from etl.reindex import create_rebuilds, swap_aliases
+from etl.resources import Resources
+from etl.scheduler import AdaptiveScheduler
+from etl.sharding import PipelineFactory, ShardedInit
 from states.state import State
-from states.state_storage import JsonFileStorage
+from states.state_storage import JsonFileStorage, MemoryStorage
 from utils import Backoff, db_conn
 
 logging.config.dictConfig(settings.LOG_CONFIG)
 logger = logging.getLogger(__name__)
 
+STATE_PATH = './src/data/state.json'
+INIT_SHARDS_DIR = './src/data/init_shards'
+DEAD_LETTERS_PATH = './src/data/dead_letters.jsonl'
+ES_MIN_MAXSIZE = 10
+
+
+cache = CacheInvalidator(settings.FAST_APU_URL, settings.SECRET, settings.CACHE_INVALIDATE_BATCH)
+dead_letters = DeadLetterSpool(DEAD_LETTERS_PATH)
+
+
+def create_resources(args: argparse.Namespace) -> Resources:
+    return Resources(
+        settings.postgres.dsl,
+        settings.elastic.hosts,
+        JsonFileStorage(STATE_PATH),
+        args.workers,
+        max(args.workers * args.ld_threads, ES_MIN_MAXSIZE),
+        args.state_flush_interval,
+        args.invalidate_limit,
+    )
+
+
+def pipeline_options(args: argparse.Namespace) -> dict:
+    return {
+        'pg_batch_size': args.ex_batch_size,
+        'es_batch_size': args.ld_batch_size,
+        'pg_page_size': args.ex_page_size,
+        'server_side': args.server_side,
+        'load_mode': args.ld_mode,
+        'load_threads': args.ld_threads,
+        'load_retries': args.ld_retries,
+        'queue_size': args.queue_size,
+        'fast_transform': args.fast_transform,
+        'coalesce_limit': args.coalesce_limit,
+        # initial load reads every film, so it is always extracted by COPY
+        'copy_threshold': 1 if args.init else args.copy_threshold,
+    }
+
+
+def create_pipeline(
+        args: argparse.Namespace,
+        resources: Resources,
+        batcher: Optional[AdaptiveBatcher],
+        state: Optional[State] = None,
+        index_names: Optional[dict] = None,
+        profiler: Optional[StageProfiler] = None,
+) -> EtlPipeline:
+    return EtlPipeline(
+        resources.elastic,
+        state or resources.state,
+        batcher=batcher,
+        index_names=index_names,
+        known_indexes=resources.known_indexes,
+        profiler=profiler,
+        touched=resources.touched,
+        throttle=resources.throttle,
+        dead_letters=None if args.no_dead_letters else dead_letters,
+        **pipeline_options(args),
+    )
+
+
+def run_pipeline(
+        args: argparse.Namespace,
+        resources: Resources,
+        pipeline: EtlPipeline,
+        parts_to_extract: list[PartName],
+) -> bool:
+    """
+    Run pipeline for parts on one connection or on args.workers connections from pool
+    :return: True if any document was loaded
+    """
+    if args.workers > 1:
+        return pipeline.run_concurrently(resources.pool, parts_to_extract, args.workers)
+    with resources.connection() as conn:
+        return pipeline.run(conn, parts_to_extract)
+
+
+def invalidate_cache(touched: TouchedDocuments) -> None:
+    """
+    Ask API service to drop cached documents acknowledged by elasticsearch. It is done after failed cycles too,
+    because checkpoints of their parts may be already advanced. Ids are kept when API service is not available
+    """
+    try:
+        cache.invalidate(touched)
+    except requests.RequestException as e:
+        logger.warning('Cache is not invalidated, touched documents are kept for the next cycle: %s', e)
+        return
+    touched.clear()
+
+
+@contextmanager
+def etl_cycle(args: argparse.Namespace, resources: Resources) -> Iterator[None]:
+    """
+    Context manager of one ETL cycle: records its duration and failure to metrics,
+    flushes state, invalidates cache of loaded documents and after failure makes resources check indexes again
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        metrics.CYCLE_FAILURES.inc()
+        resources.invalidate()
+        raise
+    finally:
+        resources.state.flush()
+        invalidate_cache(resources.touched)
+        metrics.CYCLE_SECONDS.observe(time.perf_counter() - start)
+        if args.metrics_file:
+            metrics.write_textfile(args.metrics_file)
+
+
+def replay_dead_letters(args: argparse.Namespace, resources: Resources) -> None:
+    """
+    Load documents of dead letter spool again after mapping or data is fixed: their current rows are extracted
+    by ids, documents that are refused again are written to the new spool
+    """
+    path = dead_letters.take()
+    if path is None:
+        logger.info('Dead letter spool is empty')
+        return
+
+    changes = spool_changes(path, settings.elastic.INDEX)
+    pipeline = create_pipeline(args, resources, None)
+    pipeline.dead_letters = dead_letters.refused()
+    try:
+        with resources.connection() as conn:
+            pipeline.run_changes(conn, changes)
+        if pipeline.failed_count:
+            raise RuntimeError(f'{pipeline.failed_count} documents were not loaded, {path} is replayed again next time')
+    except Exception:
+        dead_letters.discard_refused()
+        raise
+    finally:
+        invalidate_cache(resources.touched)
+    dead_letters.finish()
+    logger.info('Replayed %s documents', len(changes))
+
 
 @Backoff()
 def start_etl_process(
+        args: argparse.Namespace,
+        resources: Resources,
         parts_to_extract: list[PartName],
-        pg_batch_size: int,
-        es_batch_size: int,
+        batcher: Optional[AdaptiveBatcher] = None,
+        profiler: Optional[StageProfiler] = None,
 ) -> None:
-    state = State(JsonFileStorage('./src/data/state.json'))
+    pipeline = create_pipeline(args, resources, batcher, profiler=profiler)
 
-    with db_conn(psycopg2.connect(**settings.postgres.dsl, cursor_factory=DictCursor)) as conn:
-        extract = PostgresExtracting(conn, state, settings.DEFAULT_PROCESS_TIME, parts_to_extract, pg_batch_size)
+    with etl_cycle(args, resources):
+        run_pipeline(args, resources, pipeline, parts_to_extract)
 
-        transform = ElasticTransformer(extract)
 
-        loader = ElasticLoader(
-            transform,
-            Elasticsearch(settings.elastic.hosts),
-            settings.elastic.INDEX,
-            settings.elastic.INDEX_FILES,
-            es_batch_size,
-        )
+@Backoff()
+def start_changes_process(
+        args: argparse.Namespace,
+        resources: Resources,
+        changes: Changes,
+        batcher: Optional[AdaptiveBatcher] = None,
+) -> None:
+    pipeline = create_pipeline(args, resources, batcher)
 
-        loader.load()
+    with etl_cycle(args, resources), resources.connection() as conn:
+        pipeline.run_changes(conn, changes)
 
-        if loader.is_loaded:
-            token = jwt.encode({'exp': datetime.datetime.utcnow() + datetime.timedelta(minutes=5),
-                                'iat': datetime.datetime.utcnow()},
-                               settings.SECRET,
-                               algorithm="HS256")
-            url = settings.FAST_APU_URL + '/api/v1/services/flush-cache'
-            response = requests.post(url=url,
-                                     headers={'Authorization': f'Bearer {token}'})
-            if response.status_code != 200:
-                logger.warning('Request for url %s, return status_code: %s', url, response.status_code)
 
+@Backoff()
+def probe_changes(resources: Resources, parts: list[PartName]) -> list[PartName]:
+    """
+    Function that return parts with rows changed after their checkpoints
+    """
+    with resources.connection() as conn:
+        extract = PostgresExtracting(conn, resources.state, settings.DEFAULT_PROCESS_TIME, parts, 1)
+        return [part for part in parts if extract.has_changes(part)]
 
-if __name__ == '__main__':
+
+def run_scheduled(
+        args: argparse.Namespace,
+        resources: Resources,
+        parts: list[PartName],
+        batcher: Optional[AdaptiveBatcher],
+) -> None:
+    """
+    Check every part by cheap query on its own interval and process only parts with changes,
+    intervals of busy parts become shorter and of idle parts longer
+    """
+    scheduler = AdaptiveScheduler(parts, args.min_interval, args.max_interval)
+    while True:
+        if due := scheduler.due():
+            changed = probe_changes(resources, due)
+            for part in due:
+                scheduler.report(part, part in changed)
+            if changed:
+                start_etl_process(args, resources, changed, batcher)
+        time.sleep(scheduler.sleep_time())
+
+
+def run_cdc(
+        args: argparse.Namespace,
+        resources: Resources,
+        parts: list[PartName],
+        batcher: Optional[AdaptiveBatcher],
+) -> None:
+    """
+    Process changed rows as soon as notifications about them come,
+    every args.freq minutes full sweep by updated_at catches up missed changes
+    """
+    listener = ChangeListener(settings.postgres.dsl)
+    next_sweep = 0
+    while True:
+        if time.monotonic() >= next_sweep:
+            start_etl_process(args, resources, parts, batcher)
+            next_sweep = time.monotonic() + args.freq * 60
+
+        changes = listener.wait(next_sweep - time.monotonic(), args.cdc_debounce, args.cdc_max_ids)
+        if changes:
+            logger.info('Processing %s changed ids', len(changes))
+            start_changes_process(args, resources, changes, batcher)
+
+
+@Backoff()
+def sharded_init(args: argparse.Namespace, resources: Resources) -> None:
+    """
+    Load all films by args.init_shards worker processes, unfinished shards are resumed on retry.
+    Films checkpoint is set when all shards are loaded, so next cycles load only films changed after the snapshot
+    """
+    factory = PipelineFactory(settings.elastic.hosts, pipeline_options(args), args.adaptive_batch)
+    checkpoint = ShardedInit(settings.postgres.dsl, INIT_SHARDS_DIR, args.init_shards, factory).run()
+    if checkpoint is not None:
+        resources.state.set_state('films', checkpoint)
+        resources.state.flush()
+    cache.flush()
+
+
+def rebuild_indexes(args: argparse.Namespace, resources: Resources) -> None:
+    """
+    Load all documents to new versions of indexes and move aliases to them when load is finished.
+    Rebuild keeps checkpoints in memory, they replace checkpoints of state file only after aliases are moved.
+    ETL daemon should be stopped during rebuild: it keeps its own checkpoints in memory and overwrites rebuild ones
+    by the next flush, and documents it loads to old indexes after they are read by rebuild are lost by the swap
+    """
+    elastic = resources.elastic
+    rebuilds = create_rebuilds(elastic, settings.elastic.INDEX, settings.elastic.INDEX_FILES)
+    index_names = {name: rebuild.index_name for name, rebuild in rebuilds.items()}
+    batcher = None
+    if args.adaptive_batch:
+        batcher = AdaptiveBatcher(index_names, settings.elastic.BULK_PROFILES, args.ld_batch_size)
+
+    rebuild_state = State(MemoryStorage())
+    pipeline = create_pipeline(args, resources, batcher, rebuild_state, index_names)
+    # aliases are moved only when every document is loaded to new indexes, then the whole cache is flushed
+    pipeline.dead_letters = None
+    pipeline.touched = None
+    try:
+        for rebuild in rebuilds.values():
+            rebuild.create()
+        run_pipeline(args, resources, pipeline, [PartName.films, PartName.persons, PartName.genres])
+        if pipeline.failed_count:
+            raise RuntimeError(f'{pipeline.failed_count} documents were not loaded, aliases are not moved')
+        for rebuild in rebuilds.values():
+            rebuild.finish()
+        swap_aliases(elastic, list(rebuilds.values()))
+    except BaseException:
+        logger.error('Rebuild failed, new versions of indexes are removed')
+        for rebuild in rebuilds.values():
+            rebuild.drop()
+        raise
+
+    for key in rebuilds:
+        if (value := rebuild_state.get_state(key)) is not None:
+            resources.state.set_state(key, value)
+    resources.state.flush()
+    cache.flush()
+
+
+@Backoff()
+def check_plans(strict: bool, min_rows: int) -> None:
+    """
+    Check that extract queries do not read large tables by sequential scan,
+    with strict check ETL is not started when they do
+    """
+    with db_conn(psycopg2.connect(**settings.postgres.dsl)) as conn:
+        problems = verify_plans(conn, min_rows)
+
+    for problem in problems:
+        logger.warning(problem)
+    if problems and strict:
+        logger.error('Query plans check failed, create indexes by command: python3 src/main.py bootstrap-indexes')
+        sys.exit(1)
+
+
+def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('cdc-install', help='Create triggers that notify ETL about changed rows')
+    subparsers.add_parser('bootstrap-indexes', help='Create indexes that extract queries rely on')
+    subparsers.add_parser('rebuild', help='Load all documents to new versions of indexes and move aliases to them')
+    subparsers.add_parser('replay', help='Load documents of dead letter spool again')
+
     parser.add_argument(
         '--init',
         help='Start ETL process only for films parts',
@@ -65,16 +335,235 @@ if __name__ == '__main__':
         const=True,
         default=False,
     )
+    parser.add_argument(
+        '--init-shards',
+        type=int,
+        help='Count of worker processes that load films of initial load by id ranges in one snapshot',
+        default=1,
+    )
     parser.add_argument('--ex-batch-size', type=int, help='Count extracted data from', default=1000)
     parser.add_argument('--ld-batch-size', type=int, help='Count loaded data for one iteration of ETL', default=1000)
+    parser.add_argument('--ex-page-size', type=int, help='Count of rows requested by one extract query', default=10000)
+    parser.add_argument(
+        '--copy-threshold',
+        type=int,
+        help='Count of changed films from which they are extracted by one COPY stream instead of pages, 0 to disable',
+        default=0,
+    )
+    parser.add_argument(
+        '--server-side',
+        help='Stream extracted data through named server side cursors',
+        action='store_const',
+        const=True,
+        default=False,
+    )
+    parser.add_argument(
+        '--ld-mode',
+        type=LoadMode,
+        choices=list(LoadMode),
+        metavar='{' + ','.join(mode.value for mode in LoadMode) + '}',
+        help='How to send bulk requests: bulk, streaming, parallel or raw',
+        default=LoadMode.bulk,
+    )
+    parser.add_argument('--ld-threads', type=int, help='Count of bulk requests in flight for parallel mode', default=4)
+    parser.add_argument(
+        '--ld-retries',
+        type=int,
+        help='How many times documents rejected by elasticsearch with 429 status are sent again',
+        default=5,
+    )
+    parser.add_argument(
+        '--no-dead-letters',
+        help='Stop checkpoint on documents refused by elasticsearch instead of writing them to dead letter spool',
+        action='store_const',
+        const=True,
+        default=False,
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        help='Count of parts processed at the same time, parts of films index are run in order by one worker',
+        default=1,
+    )
+    parser.add_argument(
+        '--queue-size',
+        type=int,
+        help='Count of batches buffered between extract, transform and load running at the same time',
+        default=0,
+    )
+    parser.add_argument(
+        '--fast-transform',
+        help='Validate extracted rows by batches without pydantic models instantiation',
+        action='store_const',
+        const=True,
+        default=False,
+    )
+    parser.add_argument(
+        '--state-flush-interval',
+        type=float,
+        help='How often loaded checkpoints are written to state file in seconds',
+        default=5,
+    )
+    parser.add_argument(
+        '--adaptive-batch',
+        help='Limit bulk requests by bytes and tune their size by latency, separately for every index',
+        action='store_const',
+        const=True,
+        default=False,
+    )
+    parser.add_argument(
+        '--coalesce-limit',
+        type=int,
+        help='Count of films whose actions of all parts are merged in memory before load, 0 to disable',
+        default=0,
+    )
+    parser.add_argument(
+        '--cdc',
+        help='Process changed rows by notifications of triggers, sweep every --freq minutes catches up missed ones',
+        action='store_const',
+        const=True,
+        default=False,
+    )
+    parser.add_argument(
+        '--cdc-debounce',
+        type=float,
+        help='Seconds to collect notifications after the first one before processing',
+        default=1,
+    )
+    parser.add_argument(
+        '--cdc-max-ids',
+        type=int,
+        help='Count of changed ids after which collecting of notifications stops early, 0 to disable',
+        default=10000,
+    )
+    parser.add_argument(
+        '--schedule',
+        help='Check every part for changes on its own interval tuned between --min-interval and --max-interval',
+        action='store_const',
+        const=True,
+        default=False,
+    )
+    parser.add_argument('--min-interval', type=float, help='Min seconds between checks of part', default=10)
+    parser.add_argument('--max-interval', type=float, help='Max seconds between checks of part', default=600)
+    parser.add_argument(
+        '--check-plans',
+        choices=['off', 'warn', 'strict'],
+        help='Warn about sequential scans of large tables in extract queries plans or refuse to start',
+        default='warn',
+    )
+    parser.add_argument('--plan-min-rows', type=int, help='Count of rows from which table is large', default=10000)
+    parser.add_argument(
+        '--invalidate-limit',
+        type=int,
+        help='Count of loaded documents above which the whole API cache is flushed instead of ids, 0 to always flush',
+        default=10000,
+    )
+    parser.add_argument('--metrics-port', type=int, help='Port of HTTP endpoint with metrics, 0 to disable', default=0)
+    parser.add_argument('--metrics-file', help='File for textfile collector rewritten with metrics after every cycle')
+    parser.add_argument(
+        '--profile',
+        metavar='DIR',
+        help='Run one cycle with cProfile and tracemalloc of every stage and part, write reports to DIR and exit',
+    )
+    parser.add_argument(
+        '--profile-snapshot-every',
+        type=int,
+        help='Compare allocations after every this count of extracted batches of part',
+        default=1,
+    )
     parser.add_argument('--freq', type=int, help='How often should the process be performed in minutes', default=10)
     args = parser.parse_args()
+    if args.coalesce_limit and args.workers > 1:
+        parser.error('--coalesce-limit merges actions of all parts and can not be used with --workers > 1')
+    if args.schedule and args.cdc:
+        parser.error('--schedule and --cdc are different modes, choose one of them')
+    if args.profile and (args.queue_size or args.workers > 1):
+        parser.error('--profile runs stages in one thread and can not be used with --queue-size or --workers > 1')
+    return args
+
+
+def run_command(args: argparse.Namespace, resources: Resources) -> None:
+    """
+    Run one time command instead of ETL process
+    """
+    if args.command == 'cdc-install':
+        with db_conn(psycopg2.connect(**settings.postgres.dsl)) as conn:
+            install_triggers(conn)
+        logger.info('Triggers are installed')
+    elif args.command == 'bootstrap-indexes':
+        with db_conn(psycopg2.connect(**settings.postgres.dsl)) as conn:
+            create_indexes(conn)
+        logger.info('Indexes are created')
+    elif args.command == 'rebuild':
+        rebuild_indexes(args, resources)
+        logger.info('Indexes are rebuilt')
+    elif args.command == 'replay':
+        replay_dead_letters(args, resources)
+
+
+def profile_cycle(
+        args: argparse.Namespace,
+        resources: Resources,
+        parts: list[PartName],
+        batcher: Optional[AdaptiveBatcher],
+) -> None:
+    """
+    Run one cycle with profiles of every stage and part, profiles are written to args.profile directory
+    """
+    profiler = StageProfiler(args.profile, args.profile_snapshot_every)
+    profiler.start()
+    try:
+        start_etl_process(args, resources, parts, batcher, profiler)
+    finally:
+        profiler.dump()
+
+
+def run_etl(args: argparse.Namespace, resources: Resources) -> None:
+    """
+    Run ETL process in the mode chosen by args, process runs until it is stopped
+    """
+    if args.check_plans != 'off':
+        check_plans(args.check_plans == 'strict', args.plan_min_rows)
+
+    metrics.track_checkpoints(resources.state, [part.value for part in PartName])
+    if args.metrics_port:
+        metrics.start_http_server(args.metrics_port)
 
     if args.init:
         parts = [PartName.films]
     else:
         parts = [PartName.films, PartName.films_persons, PartName.films_genres, PartName.persons, PartName.genres]
 
+    batcher = None
+    if args.adaptive_batch:
+        batcher = AdaptiveBatcher(settings.elastic.INDEX, settings.elastic.BULK_PROFILES, args.ld_batch_size)
+
+    if args.profile:
+        profile_cycle(args, resources, parts, batcher)
+        return
+
+    if args.init and args.init_shards > 1:
+        sharded_init(args, resources)
+
+    if args.cdc:
+        run_cdc(args, resources, parts, batcher)
+
+    if args.schedule:
+        run_scheduled(args, resources, parts, batcher)
+
     while True:
-        start_etl_process(parts, args.ex_batch_size, args.ld_batch_size)
-        sleep(args.freq * 60)
+        start_etl_process(args, resources, parts, batcher)
+        time.sleep(args.freq * 60)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    resources = create_resources(args)
+
+    try:
+        if args.command:
+            run_command(args, resources)
+        else:
+            run_etl(args, resources)
+    finally:
+        resources.close()
@@ -1,9 +1,6 @@
 """ Raw SQL queries."""
 
-# Можно ли оптимизировать запросы?
-# Например как то объеденить запросы person_film_id и person_films
-
-film = """
+film_select = """
 SELECT
    fw.id,
    fw.title,
@@ -29,97 +26,342 @@ LEFT JOIN content.person_film_work pfw ON pfw.film_work_id = fw.id
 LEFT JOIN content.person p ON p.id = pfw.person_id
 LEFT JOIN content.genre_film_work gfw ON gfw.film_work_id = fw.id
 LEFT JOIN content.genre g ON g.id = gfw.genre_id
-WHERE fw.updated_at > %s
-GROUP BY fw.id
-ORDER BY fw.updated_at;
 """
 
-person_id = """
-SELECT id, updated_at
-FROM content.person
-WHERE updated_at > %s
-ORDER BY updated_at;
-"""
-
-persons = """
-SELECT p.id, 
-       p.full_name,
-       p.updated_at,
-       ARRAY_AGG(DISTINCT pfw.role) as role,
-       ARRAY_AGG(DISTINCT pfw.film_work_id)::text[] as film_ids
-FROM content.person p
-LEFT JOIN content.person_film_work pfw ON pfw.person_id = p.id
-WHERE updated_at > %s
-GROUP BY p.id, role
-ORDER BY updated_at;
+# Page of changed films is taken from film_work by keyset index first, only films of the page are aggregated
+film = """
+WITH page AS (
+    SELECT id
+    FROM content.film_work
+    WHERE (updated_at, id) > (%(updated_at)s, %(id)s)
+    ORDER BY updated_at, id
+    LIMIT %(limit)s
+)""" + film_select + """
+WHERE fw.id IN (SELECT id FROM page)
+GROUP BY fw.id
+ORDER BY fw.updated_at, fw.id;
 """
 
-person_film_id = """
-SELECT fw.id
-FROM content.film_work fw
-LEFT JOIN content.person_film_work pfw ON pfw.film_work_id = fw.id
-LEFT JOIN content.person p ON p.id = pfw.person_id
-WHERE pfw.person_id IN %s AND p.updated_at > fw.updated_at AND fw.updated_at > %s
-ORDER BY fw.updated_at;
+films_by_ids = film_select + """
+WHERE fw.id = ANY(%(film_ids)s::uuid[])
+GROUP BY fw.id;
 """
 
-person_films = """
-SELECT DISTINCT fw.id as film_id, 
+# Persons fields of films of changed persons for partial update of films, the same rows as person_films_fanout
+person_films_by_ids = """
+WITH films AS (
+    SELECT DISTINCT film_work_id AS id
+    FROM content.person_film_work
+    WHERE person_id = ANY(%(person_ids)s::uuid[])
+)
+SELECT fw.id as film_id,
        fw.updated_at,
-       COALESCE(ARRAY_AGG(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name)) 
+       COALESCE(ARRAY_AGG(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name))
        FILTER (WHERE pfw.role = 'director' AND p.id is not null), '{}') AS director,
-       ARRAY_AGG(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name)) 
+       ARRAY_AGG(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name))
        FILTER (WHERE pfw.role = 'actor' AND p.id is not null) AS actors,
-       ARRAY_AGG(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name)) 
+       ARRAY_AGG(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name))
        FILTER (WHERE pfw.role = 'writer' AND p.id is not null) AS writers,
-       ARRAY_AGG(DISTINCT p.full_name) 
+       ARRAY_AGG(DISTINCT p.full_name)
        FILTER (WHERE pfw.role = 'actor' AND p.id is not null) AS actors_names,
-       ARRAY_AGG(DISTINCT p.full_name) 
+       ARRAY_AGG(DISTINCT p.full_name)
        FILTER (WHERE pfw.role = 'writer' AND p.id is not null) AS writers_names
-FROM content.film_work fw
+FROM films f
+JOIN content.film_work fw ON fw.id = f.id
 LEFT JOIN content.person_film_work pfw ON pfw.film_work_id = fw.id
 LEFT JOIN content.person p ON p.id = pfw.person_id
-WHERE fw.id IN %s
+GROUP BY fw.id;
+"""
+
+# Genres field of films of changed genres for partial update of films, the same rows as genre_films_fanout
+genre_films_by_ids = """
+WITH films AS (
+    SELECT DISTINCT film_work_id AS id
+    FROM content.genre_film_work
+    WHERE genre_id = ANY(%(genre_ids)s::uuid[])
+)
+SELECT fw.id as film_id,
+       fw.updated_at,
+       ARRAY_AGG(DISTINCT jsonb_build_object('id', g.id, 'name', g.name))
+       FILTER (WHERE g.id is not null) as genre
+FROM films f
+JOIN content.film_work fw ON fw.id = f.id
+LEFT JOIN content.genre_film_work gfw ON gfw.film_work_id = fw.id
+LEFT JOIN content.genre g ON g.id = gfw.genre_id
+GROUP BY fw.id;
+"""
+
+# Films of one shard of id range for sharded initial load, paginated by id inside exported snapshot
+film_shard = film_select + """
+WHERE fw.id > %(id)s AND fw.id <= %(shard_end)s
 GROUP BY fw.id
-ORDER BY fw.updated_at;
+ORDER BY fw.id
+LIMIT %(limit)s;
 """
 
-genre_id = """
-SELECT id, updated_at
-FROM content.genre
-WHERE updated_at > %s
-ORDER BY updated_at;
+# Rows of wrapped query as JSON lines. CSV quote and delimiter are control characters that JSON never contains
+# unescaped, so lines are written as is
+copy_json_start = """
+COPY (SELECT row_to_json(copied) FROM (
 """
 
-genres = """
+copy_json_end = """
+) copied) TO STDOUT WITH (FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02');
+"""
+
+# All films changed after keyset by one COPY for initial load and large backlogs
+film_copy = copy_json_start + film_select + """
+WHERE (fw.updated_at, fw.id) > (%(updated_at)s, %(id)s)
+GROUP BY fw.id
+ORDER BY fw.updated_at, fw.id
+""" + copy_json_end
+
+film_shard_copy = copy_json_start + film_select + """
+WHERE fw.id > %(id)s AND fw.id <= %(shard_end)s
+GROUP BY fw.id
+ORDER BY fw.id
+""" + copy_json_end
+
+# Count of changed films up to limit, backlog of limit films is extracted by COPY
+film_backlog = """
+SELECT count(*)
+FROM (
+    SELECT 1
+    FROM content.film_work
+    WHERE (updated_at, id) > (%(updated_at)s, %(id)s)
+    LIMIT %(limit)s
+) backlog;
+"""
+
+film_last_keyset = """
+SELECT updated_at, id
+FROM content.film_work
+ORDER BY updated_at DESC, id DESC
+LIMIT 1;
+"""
+
+persons_select = """
+SELECT p.id, 
+       p.full_name,
+       p.updated_at,
+       ARRAY_AGG(DISTINCT pfw.role) as role,
+       ARRAY_AGG(DISTINCT pfw.film_work_id)::text[] as film_ids
+FROM content.person p
+LEFT JOIN content.person_film_work pfw ON pfw.person_id = p.id
+"""
+
+# Page of changed persons is taken by keyset index first, only persons of the page are aggregated
+persons = """
+WITH page AS (
+    SELECT id
+    FROM content.person
+    WHERE (updated_at, id) > (%(updated_at)s, %(id)s)
+    ORDER BY updated_at, id
+    LIMIT %(limit)s
+)""" + persons_select + """
+WHERE p.id IN (SELECT id FROM page)
+GROUP BY p.id
+ORDER BY p.updated_at, p.id;
+"""
+
+persons_by_ids = persons_select + """
+WHERE p.id = ANY(%(person_ids)s::uuid[])
+GROUP BY p.id;
+"""
+
+genres_select = """
 SELECT id,
        name,
        description,
        updated_at
 FROM content.genre
-WHERE updated_at > %s
-ORDER BY updated_at;
 """
 
-genre_film_id = """
-SELECT fw.id, fw.updated_at
-FROM content.film_work fw
-LEFT JOIN content.genre_film_work gfw ON gfw.film_work_id = fw.id
-LEFT JOIN content.genre g ON g.id = gfw.genre_id
-WHERE gfw.genre_id IN %s AND g.updated_at > fw.updated_at AND fw.updated_at > %s
-ORDER BY fw.updated_at;
+genres = genres_select + """
+WHERE (updated_at, id) > (%(updated_at)s, %(id)s)
+ORDER BY updated_at, id
+LIMIT %(limit)s;
 """
 
+genres_by_ids = genres_select + """
+WHERE id = ANY(%(genre_ids)s::uuid[]);
+"""
 
-genre_films = """
-SELECT DISTINCT fw.id as film_id,
-       fw.updated_at,
-       ARRAY_AGG(DISTINCT jsonb_build_object('id', g.id, 'name', g.name))
-       FILTER (WHERE g.id is not null) as genre
-FROM content.film_work fw
-LEFT JOIN content.genre_film_work gfw ON gfw.film_work_id = fw.id
-LEFT JOIN content.genre g ON g.id = gfw.genre_id
-WHERE fw.id IN %s
-GROUP BY fw.id
-ORDER BY fw.updated_at;
+# One pass fan-out of changed persons page: the page bounds are returned in every row,
+# films of the page persons are re-aggregated in the same query.
+# When page persons have no films to update the only row has NULL film_id.
+person_films_fanout = """
+WITH changed AS (
+    SELECT id, updated_at
+    FROM content.person
+    WHERE (updated_at, id) > (%(updated_at)s, %(id)s)
+    ORDER BY updated_at, id
+    LIMIT %(limit)s
+),
+page AS (
+    SELECT c.updated_at AS last_updated_at,
+           c.id AS last_id,
+           (SELECT COUNT(*) FROM changed) AS page_rows
+    FROM changed c
+    ORDER BY c.updated_at DESC, c.id DESC
+    LIMIT 1
+),
+films AS (
+    SELECT DISTINCT fw.id
+    FROM changed c
+    JOIN content.person_film_work pfw ON pfw.person_id = c.id
+    JOIN content.film_work fw ON fw.id = pfw.film_work_id
+    WHERE c.updated_at > fw.updated_at
+),
+aggregated AS (
+    SELECT fw.id as film_id,
+           fw.updated_at,
+           COALESCE(ARRAY_AGG(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name)) 
+           FILTER (WHERE pfw.role = 'director' AND p.id is not null), '{}') AS director,
+           ARRAY_AGG(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name)) 
+           FILTER (WHERE pfw.role = 'actor' AND p.id is not null) AS actors,
+           ARRAY_AGG(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name)) 
+           FILTER (WHERE pfw.role = 'writer' AND p.id is not null) AS writers,
+           ARRAY_AGG(DISTINCT p.full_name) 
+           FILTER (WHERE pfw.role = 'actor' AND p.id is not null) AS actors_names,
+           ARRAY_AGG(DISTINCT p.full_name) 
+           FILTER (WHERE pfw.role = 'writer' AND p.id is not null) AS writers_names
+    FROM films f
+    JOIN content.film_work fw ON fw.id = f.id
+    LEFT JOIN content.person_film_work pfw ON pfw.film_work_id = fw.id
+    LEFT JOIN content.person p ON p.id = pfw.person_id
+    GROUP BY fw.id
+)
+SELECT page.*, aggregated.*
+FROM page
+LEFT JOIN aggregated ON true
+ORDER BY aggregated.updated_at, aggregated.film_id;
+"""
+
+# One pass fan-out of changed genres page, the same shape as person_films_fanout.
+genre_films_fanout = """
+WITH changed AS (
+    SELECT id, updated_at
+    FROM content.genre
+    WHERE (updated_at, id) > (%(updated_at)s, %(id)s)
+    ORDER BY updated_at, id
+    LIMIT %(limit)s
+),
+page AS (
+    SELECT c.updated_at AS last_updated_at,
+           c.id AS last_id,
+           (SELECT COUNT(*) FROM changed) AS page_rows
+    FROM changed c
+    ORDER BY c.updated_at DESC, c.id DESC
+    LIMIT 1
+),
+films AS (
+    SELECT DISTINCT fw.id
+    FROM changed c
+    JOIN content.genre_film_work gfw ON gfw.genre_id = c.id
+    JOIN content.film_work fw ON fw.id = gfw.film_work_id
+    WHERE c.updated_at > fw.updated_at
+),
+aggregated AS (
+    SELECT fw.id as film_id,
+           fw.updated_at,
+           ARRAY_AGG(DISTINCT jsonb_build_object('id', g.id, 'name', g.name))
+           FILTER (WHERE g.id is not null) as genre
+    FROM films f
+    JOIN content.film_work fw ON fw.id = f.id
+    LEFT JOIN content.genre_film_work gfw ON gfw.film_work_id = fw.id
+    LEFT JOIN content.genre g ON g.id = gfw.genre_id
+    GROUP BY fw.id
+)
+SELECT page.*, aggregated.*
+FROM page
+LEFT JOIN aggregated ON true
+ORDER BY aggregated.updated_at, aggregated.film_id;
+"""
+
+# Cheap check that table of part has rows after the checkpoint, served by (updated_at, id) index
+change_probe = """
+SELECT EXISTS (
+    SELECT 1
+    FROM content.{table}
+    WHERE (updated_at, id) > (%(updated_at)s, %(id)s)
+) AS has_changes;
+"""
+
+part_tables = {
+    'films': 'film_work',
+    'films_persons': 'person',
+    'films_genres': 'genre',
+    'persons': 'person',
+    'genres': 'genre',
+}
+
+change_probes = {part: change_probe.format(table=table) for part, table in part_tables.items()}
+
+# Indexes that extract queries rely on
+etl_indexes = [
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS film_work_updated_at_id_idx ON content.film_work (updated_at, id);',
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS person_updated_at_id_idx ON content.person (updated_at, id);',
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS genre_updated_at_id_idx ON content.genre (updated_at, id);',
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS person_film_work_film_work_id_idx '
+    'ON content.person_film_work (film_work_id);',
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS person_film_work_person_id_idx ON content.person_film_work (person_id);',
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS genre_film_work_film_work_id_idx ON content.genre_film_work (film_work_id);',
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS genre_film_work_genre_id_idx ON content.genre_film_work (genre_id);',
+]
+
+table_rows = """
+SELECT c.relname, c.reltuples
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE n.nspname = 'content' AND c.relkind = 'r';
+"""
+
+# Notification about every changed row of content tables, for link tables film id and person or genre id are sent
+cdc_channel = 'etl_changes'
+
+cdc_triggers = """
+CREATE OR REPLACE FUNCTION content.etl_notify_change() RETURNS trigger AS $$
+DECLARE
+    changed record;
+    payload json;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        changed := OLD;
+    ELSE
+        changed := NEW;
+    END IF;
+
+    IF TG_TABLE_NAME = 'person_film_work' THEN
+        payload := json_build_object('table', TG_TABLE_NAME, 'id', changed.film_work_id, 'ref_id', changed.person_id);
+    ELSIF TG_TABLE_NAME = 'genre_film_work' THEN
+        payload := json_build_object('table', TG_TABLE_NAME, 'id', changed.film_work_id, 'ref_id', changed.genre_id);
+    ELSE
+        payload := json_build_object('table', TG_TABLE_NAME, 'id', changed.id);
+    END IF;
+
+    PERFORM pg_notify('etl_changes', payload::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS etl_notify_change ON content.film_work;
+CREATE TRIGGER etl_notify_change AFTER INSERT OR UPDATE OR DELETE ON content.film_work
+FOR EACH ROW EXECUTE FUNCTION content.etl_notify_change();
+
+DROP TRIGGER IF EXISTS etl_notify_change ON content.person;
+CREATE TRIGGER etl_notify_change AFTER INSERT OR UPDATE OR DELETE ON content.person
+FOR EACH ROW EXECUTE FUNCTION content.etl_notify_change();
+
+DROP TRIGGER IF EXISTS etl_notify_change ON content.genre;
+CREATE TRIGGER etl_notify_change AFTER INSERT OR UPDATE OR DELETE ON content.genre
+FOR EACH ROW EXECUTE FUNCTION content.etl_notify_change();
+
+DROP TRIGGER IF EXISTS etl_notify_change ON content.person_film_work;
+CREATE TRIGGER etl_notify_change AFTER INSERT OR UPDATE OR DELETE ON content.person_film_work
+FOR EACH ROW EXECUTE FUNCTION content.etl_notify_change();
+
+DROP TRIGGER IF EXISTS etl_notify_change ON content.genre_film_work;
+CREATE TRIGGER etl_notify_change AFTER INSERT OR UPDATE OR DELETE ON content.genre_film_work
+FOR EACH ROW EXECUTE FUNCTION content.etl_notify_change();
 """
@@ -1,4 +1,6 @@
-from typing import Any, Protocol
+import time
+from threading import Lock
+from typing import Any, NamedTuple, Protocol
 
 from states.state_storage import Storage
 
@@ -10,11 +12,27 @@ class BaseState(Protocol):
     def get_state(self, key: str) -> Any:
         ...
 
+    def flush(self) -> None:
+        ...
+
+
+class Checkpoint(NamedTuple):
+    """
+    Value of state key that should be saved when all data before it is loaded
+    """
+
+    key: str
+    value: Any
+
 
 class State:
-    def __init__(self, storage: Storage):
+    def __init__(self, storage: Storage, flush_interval: float = 0):
         self.storage = storage
         self.state = self.retrieve_state()
+        self.lock = Lock()
+        self.flush_interval = flush_interval
+        self.flushed_at = time.monotonic()
+        self.is_dirty = False
 
     def retrieve_state(self) -> dict:
         data = self.storage.retrieve_state()
@@ -23,9 +41,28 @@ class State:
         return data
 
     def set_state(self, key: str, value: Any) -> None:
-        self.state[key] = value
+        """
+        Set state value, storage is written not often than once in self.flush_interval seconds
+        """
+        with self.lock:
+            self.state[key] = value
+            self.is_dirty = True
 
-        self.storage.save_state(self.state)
+            if time.monotonic() - self.flushed_at >= self.flush_interval:
+                self._save()
 
     def get_state(self, key: str) -> Any:
         return self.state.get(key)
+
+    def flush(self) -> None:
+        """
+        Write not saved state values to storage
+        """
+        with self.lock:
+            if self.is_dirty:
+                self._save()
+
+    def _save(self) -> None:
+        self.storage.save_state(self.state)
+        self.is_dirty = False
+        self.flushed_at = time.monotonic()
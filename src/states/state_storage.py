@@ -1,4 +1,6 @@
 import json
+import os
+import tempfile
 from typing import Optional, Protocol
 
 
@@ -20,11 +22,20 @@ class JsonFileStorage:
         self.file_path = file_path
 
     def save_state(self, state: dict) -> None:
+        """
+        Save state atomically: state is written to temporary file that replaces old one,
+        so the file keeps previous state if process is stopped during writing
+        """
         if self.file_path is None:
             raise FilePathNotSpecifiedError
 
-        with open(self.file_path, 'w') as f:
+        dir_path = os.path.dirname(os.path.abspath(self.file_path))
+        os.makedirs(dir_path, exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=dir_path, suffix='.tmp', delete=False) as f:
             json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f.name, self.file_path)
 
     def retrieve_state(self) -> dict:
         if self.file_path is None:
@@ -41,3 +52,18 @@ class JsonFileStorage:
         except FileNotFoundError:
             self.save_state({})
             return {}
+
+
+class MemoryStorage:
+    """
+    Storage that keeps state in memory, state is lost when process is stopped
+    """
+
+    def __init__(self, state: Optional[dict] = None):
+        self.state = dict(state or {})
+
+    def save_state(self, state: dict) -> None:
+        self.state = dict(state)
+
+    def retrieve_state(self) -> dict:
+        return dict(self.state)
@@ -1,9 +1,13 @@
+import datetime
 import logging
+import re
 import time
 from contextlib import contextmanager
 from functools import wraps
 from logging import Logger
-from typing import Callable, Iterator, Protocol, TypeAlias, TypeVar
+from queue import Full, Queue
+from threading import Event, Thread
+from typing import Any, Callable, Iterator, Protocol, TypeAlias, TypeVar
 
 logger = logging.getLogger(__name__)
 
@@ -20,6 +24,13 @@ T = TypeVar('T', Connection, Connection)
 
 DEFAULT_DELAY = 1
 
+_BUFFER_END = object()
+
+# Postgres writes as many digits of fraction of seconds as needed and may omit minutes of UTC offset,
+# fromisoformat of Python 3.10 takes only 3 or 6 digits and HH:MM offsets
+_FRACTION = re.compile(r'\.(\d{1,6})')
+_SHORT_OFFSET = re.compile(r'(:\d{2}(?:\.\d+)?[+-]\d{2})$')
+
 
 @contextmanager
 def db_conn(connection: T) -> T:
@@ -32,6 +43,92 @@ def db_conn(connection: T) -> T:
         connection.close()
 
 
+def parse_timestamp(value: Any) -> datetime.datetime:
+    """
+    Parse timestamp written by Python or by Postgres as text or JSON, timestamp without time zone is UTC
+    :param value: datetime or its ISO format
+    :return: aware datetime
+    """
+    if not isinstance(value, datetime.datetime):
+        value = _FRACTION.sub(lambda match: '.' + match.group(1).ljust(6, '0'), str(value).replace('Z', '+00:00'), 1)
+        value = datetime.datetime.fromisoformat(_SHORT_OFFSET.sub(r'\1:00', value))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value
+
+
+class BackgroundBuffer:
+    """
+    Bounded queue filled by items of generator running in background thread.
+    Items are passed by lists of batch_size, background thread waits when queue_size lists are not consumed.
+    Exception raised in background thread is raised again in consumer.
+    """
+
+    def __init__(self, data: Iterator[Any], batch_size: int, queue_size: int) -> None:
+        self.data = data
+        self.batch_size = batch_size
+        self.chunks = Queue(maxsize=queue_size)
+        self.stop = Event()
+
+    def put(self, item: Any) -> bool:
+        """
+        Put item to queue, waits while queue is full
+        :return: False if consumer stopped reading and producer should stop
+        """
+        while not self.stop.is_set():
+            try:
+                self.chunks.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def produce(self) -> None:
+        try:
+            chunk = []
+            for item in self.data:
+                if item is None:
+                    break
+                chunk.append(item)
+                if len(chunk) == self.batch_size:
+                    if not self.put(chunk):
+                        return
+                    chunk = []
+            if chunk and not self.put(chunk):
+                return
+            self.put(_BUFFER_END)
+        except Exception as e:
+            self.put(e)
+
+    def consume(self) -> Iterator[Any]:
+        thread = Thread(target=self.produce, daemon=True)
+        thread.start()
+        try:
+            while (chunk := self.chunks.get()) is not _BUFFER_END:
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield from chunk
+        finally:
+            self.stop.set()
+            thread.join()
+            # producer is finished, so source can be closed here and release its cursors before connection is reused
+            close = getattr(self.data, 'close', None)
+            if close is not None:
+                close()
+
+
+def buffered(data: Iterator[Any], batch_size: int, queue_size: int) -> Iterator[Any]:
+    """
+    Generator that run data generator in background thread and pass its items through bounded queue.
+    Like wrapped generators it returns None at the end.
+    :param data: generator to run in background, can be finished with None
+    :param batch_size: count of items passed through queue at once
+    :param queue_size: count of batches that can wait for consumer
+    """
+    yield from BackgroundBuffer(data, batch_size, queue_size).consume()
+    yield None
+
+
 def default_backoff_gen(start_delay: int, delay_limit: int):
     """
     Default generator with increase delay logic as start_delay * 2
@@ -0,0 +1,10 @@
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+# settings are read from environment on import, tests do not connect to services
+ENVIRONMENT = {'PG_USER': 'etl', 'PG_PASSWORD': 'etl', 'PG_DB': 'etl', 'PG_HOST': 'localhost', 'ES_HOST': 'localhost'}
+for name, value in ENVIRONMENT.items():
+    os.environ.setdefault(name, value)
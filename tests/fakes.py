@@ -0,0 +1,98 @@
+""" In-process stand-ins of elasticsearch client and database connection"""
+from types import SimpleNamespace
+from typing import Callable, Optional
+
+import orjson
+from elasticsearch.serializer import JSONSerializer
+
+from etl.records import record_type
+
+
+class FakeElastic:
+    """
+    Elasticsearch client that keep bodies of bulk requests and documents by index and id.
+    Document with statuses is answered by them one by one, the last status is repeated
+    """
+
+    def __init__(self, statuses: Optional[dict] = None) -> None:
+        self.statuses = statuses or {}
+        self.bodies = []
+        self.documents = {}
+        self.indices = SimpleNamespace(exists=lambda index: True)
+        self.transport = SimpleNamespace(serializer=JSONSerializer())
+
+    def _apply(self, op_type: str, target: dict, source: dict) -> int:
+        key = (target['_index'], str(target['_id']))
+        if op_type == 'update':
+            if key not in self.documents:
+                return 404
+            self.documents[key] = {**self.documents[key], **source['doc']}
+            return 200
+        self.documents[key] = source
+        return 201
+
+    def bulk(self, body: bytes) -> dict:
+        self.bodies.append(body)
+        lines = body.splitlines()
+        items = []
+        for meta, source in zip(lines[::2], lines[1::2]):
+            op_type, target = orjson.loads(meta).popitem()
+            statuses = self.statuses.get(target['_id'])
+            if statuses:
+                status = statuses.pop(0) if len(statuses) > 1 else statuses[0]
+            else:
+                status = self._apply(op_type, target, orjson.loads(source))
+            items.append({op_type: {**target, 'status': status}})
+        return {'items': items}
+
+
+class FakeCursor:
+    def __init__(self, answers: dict[str, Callable[[dict], list[dict]]], name: Optional[str] = None) -> None:
+        self.answers = answers
+        self.name = name
+        self.itersize = 2000
+        self.rows = []
+        self.executed = []
+
+    def __enter__(self) -> 'FakeCursor':
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+    def execute(self, query: str, params: Optional[dict] = None) -> None:
+        self.executed.append((query, params))
+        rows = self.answers[query](params or {})
+        columns = tuple(dict.fromkeys(column for row in rows for column in row))
+        record = record_type(columns)
+        self.rows = [record(tuple(row.get(column) for column in columns)) for row in rows]
+
+    def fetchmany(self, size: int) -> list:
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def __iter__(self):
+        rows, self.rows = self.rows, []
+        return iter(rows)
+
+
+class FakeConnection:
+    """
+    Connection that answer queries by functions of their parameters, every answer is list of rows as dicts
+    """
+
+    def __init__(self, answers: dict[str, Callable[[dict], list[dict]]]) -> None:
+        self.answers = answers
+        self.cursors = []
+
+    def cursor(self, name: Optional[str] = None, **kwargs) -> FakeCursor:
+        cursor = FakeCursor(self.answers, name)
+        self.cursors.append(cursor)
+        return cursor
+
+    @property
+    def queries(self) -> list[tuple[str, dict]]:
+        return [executed for cursor in self.cursors for executed in cursor.executed]
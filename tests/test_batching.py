@@ -0,0 +1,101 @@
+import pytest
+
+from etl import batching
+from etl.batching import BulkProfile, BulkThrottle
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(batching.time, 'monotonic', clock)
+    monkeypatch.setattr(batching.time, 'sleep', clock.sleep)
+    return clock
+
+
+def profile() -> BulkProfile:
+    return BulkProfile(min_docs=50, max_docs=1100, start_docs=1000, target_latency=1.0)
+
+
+def test_docs_are_halved_on_rejection():
+    bulk = profile()
+
+    bulk.observe(1000, 0.1, rejected=1)
+    assert bulk.docs == 500
+    for _ in range(5):
+        bulk.observe(bulk.docs, 0.1, rejected=10)
+    assert bulk.docs == 50
+
+
+def test_docs_are_halved_on_slow_request():
+    bulk = profile()
+
+    bulk.observe(1000, 1.5)
+    assert bulk.docs == 1000
+    bulk.observe(1000, 2.5)
+    assert bulk.docs == 500
+
+
+def test_docs_grow_on_fast_full_requests_only():
+    bulk = profile()
+
+    bulk.observe(400, 0.1)
+    assert bulk.docs == 1000
+    bulk.observe(1000, 0.1)
+    assert bulk.docs == 1100
+    bulk.observe(1100, 0.1)
+    assert bulk.docs == 1100
+
+
+def test_rate_is_not_limited_before_rejection(clock):
+    throttle = BulkThrottle()
+
+    throttle.acquire(10000)
+    throttle.accepted()
+
+    assert throttle.rate is None
+    assert clock.sleeps == []
+
+
+def test_rate_is_set_from_observed_rate_on_rejection(clock):
+    throttle = BulkThrottle(min_rate=50, increase=50)
+    throttle.acquire(100)
+    clock.now = 1.0
+    throttle.acquire(100)
+
+    throttle.rejected()
+    assert throttle.rate == 100
+    # bucket keeps one second of tokens
+    throttle.acquire(150)
+    assert clock.sleeps == [0.5]
+
+    throttle.rejected()
+    assert throttle.rate == 50
+    throttle.rejected()
+    assert throttle.rate == 50
+
+
+def test_rate_is_raised_and_limit_is_removed(clock):
+    throttle = BulkThrottle(min_rate=50, increase=50)
+    throttle.acquire(100)
+    clock.now = 1.0
+    throttle.acquire(100)
+    throttle.rejected()
+
+    rates = []
+    while throttle.rate is not None:
+        throttle.accepted()
+        rates.append(throttle.rate)
+
+    assert rates == [150, 200, 250, 300, 350, 400, None]
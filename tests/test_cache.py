@@ -0,0 +1,182 @@
+from types import SimpleNamespace
+
+import jwt
+import pytest
+from elasticsearch.helpers import BulkIndexError
+
+import main
+from etl.cache import FLUSH_PATH, INVALIDATE_PATH, CacheInvalidator, TouchedDocuments
+from etl.load import ElasticLoader
+from etl.resources import Resources
+from states.state import Checkpoint
+from states.state_storage import MemoryStorage
+
+from fakes import FakeElastic
+
+API_URL = 'http://api'
+SECRET = 'secret-of-api-service-for-etl-tokens'
+
+
+class FakeSession:
+    """
+    Session that keep posted paths and payloads and answer by status of path
+    """
+
+    def __init__(self, statuses: dict = None) -> None:
+        self.statuses = statuses or {}
+        self.requests = []
+
+    def post(self, url: str, json: dict, headers: dict, timeout: float) -> SimpleNamespace:
+        jwt.decode(headers['Authorization'].removeprefix('Bearer '), SECRET, algorithms=['HS256'])
+        path = url.removeprefix(API_URL)
+        self.requests.append((path, json))
+        return SimpleNamespace(status_code=self.statuses.get(path, 200))
+
+
+@pytest.fixture
+def session() -> FakeSession:
+    return FakeSession()
+
+
+def invalidator(session: FakeSession, batch_size: int = 2) -> CacheInvalidator:
+    cache = CacheInvalidator(API_URL, SECRET, batch_size)
+    cache.session = session
+    return cache
+
+
+def test_touched_documents_are_unique_by_index():
+    touched = TouchedDocuments(5)
+    assert not touched
+
+    touched.add('movies', ['1', '2'])
+    touched.add('movies', ['2', '3'])
+    touched.add('genres', ['1'])
+
+    assert touched
+    assert not touched.overflow
+    assert touched.count == 4
+    assert touched.ids == {'movies': {'1', '2', '3'}, 'genres': {'1'}}
+
+
+def test_touched_documents_overflow_drops_ids():
+    touched = TouchedDocuments(2)
+
+    touched.add('movies', ['1', '2', '3'])
+    touched.add('movies', ['4'])
+
+    assert touched
+    assert touched.overflow
+    assert not touched.ids
+
+
+def test_zero_limit_overflows_on_any_document():
+    touched = TouchedDocuments(0)
+    assert not touched
+
+    touched.add('movies', [])
+    assert not touched
+
+    touched.add('movies', ['1'])
+    assert touched.overflow
+    assert touched
+
+
+def test_clear_forgets_ids_and_overflow():
+    touched = TouchedDocuments(1)
+    touched.add('movies', ['1', '2'])
+
+    touched.clear()
+
+    assert not touched
+    touched.add('movies', ['3'])
+    assert touched.ids == {'movies': {'3'}}
+
+
+def test_documents_are_invalidated_by_batches(session):
+    touched = TouchedDocuments(10)
+    touched.add('movies', ['3', '1', '2', '5', '4'])
+    touched.add('genres', ['1'])
+
+    invalidator(session).invalidate(touched)
+
+    assert session.requests == [
+        (INVALIDATE_PATH, {'index': 'movies', 'ids': ['1', '2']}),
+        (INVALIDATE_PATH, {'index': 'movies', 'ids': ['3', '4']}),
+        (INVALIDATE_PATH, {'index': 'movies', 'ids': ['5']}),
+        (INVALIDATE_PATH, {'index': 'genres', 'ids': ['1']}),
+    ]
+
+
+def test_overflow_flushes_whole_cache(session):
+    touched = TouchedDocuments(1)
+    touched.add('movies', ['1', '2'])
+
+    invalidator(session).invalidate(touched)
+
+    assert session.requests == [(FLUSH_PATH, None)]
+
+
+def test_failed_invalidation_flushes_whole_cache():
+    session = FakeSession({INVALIDATE_PATH: 500})
+    touched = TouchedDocuments(10)
+    touched.add('movies', ['1', '2', '3'])
+
+    invalidator(session).invalidate(touched)
+
+    assert session.requests == [(INVALIDATE_PATH, {'index': 'movies', 'ids': ['1', '2']}), (FLUSH_PATH, None)]
+
+
+def test_nothing_is_sent_without_touched_documents(session):
+    invalidator(session).invalidate(TouchedDocuments(10))
+
+    assert session.requests == []
+
+
+class FakeTransform:
+    def __init__(self, data: dict[str, list]) -> None:
+        self.data = data
+
+    def transform(self) -> dict:
+        return {name: iter([*actions, None]) for name, actions in self.data.items()}
+
+
+def index_action(index_name: str, doc_id: str) -> dict:
+    return {'_op_type': 'index', '_index': index_name, '_id': doc_id, '_source': {'id': doc_id}}
+
+
+def test_documents_of_failed_cycle_are_invalidated(monkeypatch, session):
+    monkeypatch.setattr(main, 'cache', invalidator(session))
+    resources = Resources({}, [], MemoryStorage(), invalidate_limit=10)
+    transform = FakeTransform({
+        'films': [index_action('movies', 'f1'), index_action('movies', 'f2'), Checkpoint('films', 'c1')],
+        'persons': [index_action('persons', 'p1'), index_action('persons', 'p2'), Checkpoint('persons', 'c1')],
+    })
+    # person p2 is refused, so bulk mode raises after films are loaded and their checkpoint is saved
+    elastic = FakeElastic({'p2': [400]})
+    loader = ElasticLoader(transform, elastic, {}, {}, 10, resources.state, touched=resources.touched)
+
+    with pytest.raises(BulkIndexError), main.etl_cycle(SimpleNamespace(metrics_file=None), resources):
+        loader.load()
+
+    assert resources.state.get_state('films') == 'c1'
+    assert resources.state.get_state('persons') is None
+    assert session.requests == [
+        (INVALIDATE_PATH, {'index': 'movies', 'ids': ['f1', 'f2']}),
+        (INVALIDATE_PATH, {'index': 'persons', 'ids': ['p1']}),
+    ]
+    assert not resources.touched
+
+
+def test_touched_documents_are_kept_when_api_is_not_available(monkeypatch):
+    def refuse(*args, **kwargs):
+        raise main.requests.ConnectionError('API service is down')
+
+    session = FakeSession()
+    monkeypatch.setattr(session, 'post', refuse)
+    monkeypatch.setattr(main, 'cache', invalidator(session))
+    touched = TouchedDocuments(10)
+    touched.add('movies', ['1'])
+
+    main.invalidate_cache(touched)
+
+    assert touched.ids == {'movies': {'1'}}
@@ -0,0 +1,107 @@
+import os
+import uuid
+from pathlib import Path
+
+import psycopg2
+import pytest
+
+import raw_sql
+from etl.cdc import ChangeListener, Changes, install_triggers
+from etl.extract import PostgresChangesExtracting
+from states.state import State
+from states.state_storage import MemoryStorage
+
+from fakes import FakeConnection
+
+SCHEMA_PATH = Path(__file__).parent.parent / 'bench' / 'schema.sql'
+TEST_DSN = os.environ.get('ETL_TEST_DSN')
+
+
+def rows_of(data) -> list:
+    return list(iter(lambda: next(data), None))
+
+
+def ids_answer(param_name: str, column: str):
+    return lambda params: [{column: value} for value in params[param_name]]
+
+
+@pytest.fixture
+def fake_conn() -> FakeConnection:
+    return FakeConnection({
+        raw_sql.films_by_ids: ids_answer('film_ids', 'id'),
+        raw_sql.person_films_by_ids: ids_answer('person_ids', 'film_id'),
+        raw_sql.genre_films_by_ids: ids_answer('genre_ids', 'film_id'),
+        raw_sql.persons_by_ids: ids_answer('person_ids', 'id'),
+        raw_sql.genres_by_ids: ids_answer('genre_ids', 'id'),
+    })
+
+
+def test_ids_are_queried_by_batches_of_extract_size(fake_conn):
+    changes = Changes()
+    changes.film_ids.update(str(number) for number in range(5))
+
+    data = PostgresChangesExtracting(fake_conn, State(MemoryStorage()), changes, 2).extract()
+
+    assert list(data) == ['films']
+    assert [row['id'] for row in rows_of(data['films'])] == ['0', '1', '2', '3', '4']
+    assert [params['film_ids'] for _, params in fake_conn.queries] == [['0', '1'], ['2', '3'], ['4']]
+
+
+def test_films_of_changed_persons_and_genres_are_updated_partially(fake_conn):
+    changes = Changes()
+    changes.person_ids.add('p1')
+    changes.genre_ids.add('g1')
+
+    data = PostgresChangesExtracting(fake_conn, State(MemoryStorage()), changes, 10, server_side=True).extract()
+
+    assert list(data) == ['films_persons', 'films_genres', 'persons', 'genres']
+    assert {name: len(rows_of(rows)) for name, rows in data.items()} == dict.fromkeys(data, 1)
+    assert [query for query, _ in fake_conn.queries] == [
+        raw_sql.person_films_by_ids, raw_sql.genre_films_by_ids, raw_sql.persons_by_ids, raw_sql.genres_by_ids,
+    ]
+    assert all(cursor.name for cursor in fake_conn.cursors if cursor.executed)
+
+
+@pytest.fixture
+def database():
+    if not TEST_DSN:
+        pytest.skip('ETL_TEST_DSN of test database is not set')
+    conn = psycopg2.connect(TEST_DSN)
+    with conn.cursor() as cur:
+        cur.execute(SCHEMA_PATH.read_text())
+    conn.commit()
+    install_triggers(conn)
+    yield conn
+    conn.close()
+
+
+def test_notifications_of_triggers_are_extracted_as_changes(database):
+    film_id, genre_id, link_id = (str(uuid.uuid4()) for _ in range(3))
+    listener = ChangeListener({'dsn': TEST_DSN})
+    listener.connect()
+    try:
+        with database.cursor() as cur:
+            cur.execute(
+                "INSERT INTO content.film_work (id, title, type) VALUES (%s, 'Star', 'movie');"
+                "INSERT INTO content.genre (id, name) VALUES (%s, 'Drama');"
+                'INSERT INTO content.genre_film_work (id, film_work_id, genre_id) VALUES (%s, %s, %s);',
+                (film_id, genre_id, link_id, film_id, genre_id),
+            )
+        database.commit()
+
+        changes = listener.wait(5, 0.5)
+
+        assert film_id in changes.film_ids
+        assert changes.genre_ids == {genre_id}
+        data = PostgresChangesExtracting(database, State(MemoryStorage()), changes, 100, server_side=True).extract()
+        films = {str(row['id']): row for row in rows_of(data['films'])}
+        assert films[film_id]['genre'] == [{'id': genre_id, 'name': 'Drama'}]
+        assert [str(row['film_id']) for row in rows_of(data['films_genres'])] == [film_id]
+        assert [str(row['id']) for row in rows_of(data['genres'])] == [genre_id]
+    finally:
+        listener.close()
+        database.rollback()
+        with database.cursor() as cur:
+            cur.execute('DELETE FROM content.film_work WHERE id = %s;', (film_id,))
+            cur.execute('DELETE FROM content.genre WHERE id = %s;', (genre_id,))
+        database.commit()
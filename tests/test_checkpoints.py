@@ -0,0 +1,24 @@
+import datetime
+
+from etl.extract import PostgresExtracting
+from etl.metrics import _checkpoint_time
+
+FILM_ID = '3fa85f64-5717-4562-b3fc-2c963f66afa6'
+UPDATED_AT = datetime.datetime(2021, 6, 16, 20, 14, 9, 220000, tzinfo=datetime.timezone.utc)
+
+
+def test_keyset_of_copy_row_is_equal_to_keyset_of_page_row():
+    page_row = {'id': FILM_ID, 'updated_at': UPDATED_AT}
+    copy_row = {'id': FILM_ID, 'updated_at': '2021-06-16T20:14:09.22+00:00'}
+
+    assert PostgresExtracting._row_keyset(copy_row) == PostgresExtracting._row_keyset(page_row)
+    assert PostgresExtracting._row_keyset(copy_row)['updated_at'] == '2021-06-16 20:14:09.220000+00:00'
+
+
+def test_checkpoint_time_of_postgres_json_timestamp():
+    assert _checkpoint_time({'updated_at': '2021-06-16T20:14:09.22+00:00', 'id': FILM_ID}) == UPDATED_AT.timestamp()
+
+
+def test_checkpoint_time_of_invalid_value_is_skipped():
+    assert _checkpoint_time({'updated_at': 'yesterday', 'id': FILM_ID}) is None
+    assert _checkpoint_time(None) is None
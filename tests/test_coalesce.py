@@ -0,0 +1,93 @@
+import orjson
+
+from etl.coalesce import CoalescingTransform, merge_actions
+from states.state import Checkpoint
+
+INDEX = 'movies'
+
+
+def index(doc_id: str, **source) -> dict:
+    return {'_op_type': 'index', '_index': INDEX, '_id': doc_id, '_source': {'id': doc_id, **source}}
+
+
+def update(doc_id: str, **doc) -> dict:
+    return {'_op_type': 'update', '_index': INDEX, '_id': doc_id, 'doc': doc}
+
+
+class FakeTransform:
+    def __init__(self, data: dict[str, list]) -> None:
+        self.data = data
+
+    def transform(self) -> dict:
+        return {name: iter([*actions, None]) for name, actions in self.data.items()}
+
+
+def coalesced(data: dict[str, list], max_documents: int = 100, serialize: bool = False) -> dict[str, list]:
+    result = CoalescingTransform(FakeTransform(data), max_documents, serialize).transform()
+    return {name: list(iter(lambda actions=actions: next(actions), None)) for name, actions in result.items()}
+
+
+def test_update_is_merged_into_index():
+    merged = merge_actions(index('1', title='Star', genre=[]), update('1', genre=['Drama']))
+
+    assert merged == index('1', title='Star', genre=['Drama'])
+
+
+def test_updates_are_merged():
+    merged = merge_actions(update('1', actors=['Ghost'], genre=[]), update('1', genre=['Drama']))
+
+    assert merged == update('1', actors=['Ghost'], genre=['Drama'])
+
+
+def test_index_replaces_previous_action():
+    assert merge_actions(update('1', genre=['Drama']), index('1', title='Star')) == index('1', title='Star')
+    assert merge_actions(None, update('1', genre=['Drama'])) == update('1', genre=['Drama'])
+
+
+def test_films_parts_are_merged_into_one_action_per_film():
+    result = coalesced({
+        'films': [index('1', title='Star', actors=[], genre=[]), Checkpoint('films', 'f1')],
+        'films_persons': [
+            update('1', actors=['Ghost']), update('2', actors=['Ghost']), Checkpoint('films_persons', 'p1'),
+        ],
+        'films_genres': [update('2', genre=['Drama']), Checkpoint('films_genres', 'g1')],
+        'persons': [index('3'), Checkpoint('persons', 'p1')],
+    })
+
+    assert list(result) == ['films', 'persons']
+    assert result['films'] == [
+        index('1', title='Star', actors=['Ghost'], genre=[]),
+        update('2', actors=['Ghost'], genre=['Drama']),
+        Checkpoint('films', 'f1'),
+        Checkpoint('films_persons', 'p1'),
+        Checkpoint('films_genres', 'g1'),
+    ]
+    assert result['persons'] == [index('3'), Checkpoint('persons', 'p1')]
+
+
+def test_checkpoints_follow_every_action_they_cover_when_max_documents_is_reached():
+    result = coalesced({
+        'films': [index('1'), Checkpoint('films', 'f1'), index('2'), index('3'), Checkpoint('films', 'f3')],
+        'films_persons': [update('3', actors=['Ghost']), Checkpoint('films_persons', 'p1')],
+    }, max_documents=2)
+
+    assert result['films'] == [
+        index('1'),
+        index('2'),
+        Checkpoint('films', 'f1'),
+        index('3', actors=['Ghost']),
+        Checkpoint('films', 'f3'),
+        Checkpoint('films_persons', 'p1'),
+    ]
+
+
+def test_actions_are_encoded_after_merging_in_raw_mode():
+    result = coalesced({
+        'films': [index('1', title='Star', genre=[]), Checkpoint('films', 'f1')],
+        'films_genres': [update('1', genre=['Drama'])],
+    }, serialize=True)
+
+    meta, source = result['films'][0].splitlines()
+    assert orjson.loads(meta) == {'index': {'_index': INDEX, '_id': '1'}}
+    assert orjson.loads(source) == {'id': '1', 'title': 'Star', 'genre': ['Drama']}
+    assert result['films'][1:] == [Checkpoint('films', 'f1')]
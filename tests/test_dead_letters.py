@@ -0,0 +1,146 @@
+import uuid
+
+import orjson
+import pytest
+
+import raw_sql
+from etl import ndjson
+from etl.dead_letters import DeadLetterSpool, is_permanent, spool_changes
+from etl.pipeline import EtlPipeline
+from states.state import State
+from states.state_storage import MemoryStorage
+
+from fakes import FakeConnection, FakeElastic
+
+INDEX = 'movies'
+INDEX_NAMES = {'films': INDEX, 'persons': 'persons', 'genres': 'genres'}
+
+
+def action(doc_id: str) -> dict:
+    return {'_op_type': 'index', '_index': INDEX, '_id': doc_id, '_source': {'id': doc_id}}
+
+
+def item(status: int, doc_id: str = '1') -> dict:
+    return {'index': {'_index': INDEX, '_id': doc_id, 'status': status, 'error': {'type': 'mapper_parsing_exception'}}}
+
+
+def records(path) -> list[dict]:
+    with open(path, 'rb') as file:
+        return [orjson.loads(line) for line in file]
+
+
+def replayed(path: str) -> set[str]:
+    return spool_changes(path, INDEX_NAMES).film_ids
+
+
+@pytest.mark.parametrize('status, expected', [(400, True), (404, True), (409, True), (429, False), (500, False)])
+def test_is_permanent(status, expected):
+    assert is_permanent(item(status)) is expected
+
+
+@pytest.fixture
+def spool(tmp_path) -> DeadLetterSpool:
+    return DeadLetterSpool(str(tmp_path / 'spool' / 'dead_letters.jsonl'))
+
+
+def test_take_of_empty_spool(spool):
+    assert spool.take() is None
+
+
+def test_spool_keeps_targets_of_documents_with_errors(spool):
+    update = {'_op_type': 'update', '_index': INDEX, '_id': '2', 'doc': {'title': 'Star'}}
+    spool.write(action('1'), item(400))
+    spool.write(ndjson.action_lines(update), item(404, '2'))
+
+    path = spool.take()
+
+    assert path == spool.replay_path
+    assert [
+        {key: record[key] for key in ('op_type', 'index', 'id', 'error')} for record in records(path)
+    ] == [
+        {'op_type': 'index', 'index': INDEX, 'id': '1', 'error': {'type': 'mapper_parsing_exception'}},
+        {'op_type': 'update', 'index': INDEX, 'id': '2', 'error': {'type': 'mapper_parsing_exception'}},
+    ]
+    assert all('document' not in record for record in records(path))
+
+
+def test_changes_of_spool_by_index(spool):
+    spool.write(action('1'), item(400))
+    spool.write({**action('2'), '_index': 'persons'}, item(400, '2'))
+    spool.write({**action('3'), '_index': 'genres'}, item(400, '3'))
+    spool.write({**action('4'), '_index': 'unknown'}, item(400, '4'))
+
+    changes = spool_changes(spool.take(), INDEX_NAMES)
+
+    assert (changes.film_ids, changes.person_ids, changes.genre_ids) == ({'1'}, {'2'}, {'3'})
+
+
+def test_spool_of_interrupted_replay_is_taken_first(spool):
+    spool.write(action('1'), item(400))
+    spool.take()
+    spool.write(action('2'), item(400))
+
+    assert replayed(spool.take()) == {'1'}
+
+
+def test_finish_appends_refused_documents_to_new_spool(spool):
+    spool.write(action('1'), item(400))
+    spool.write(action('2'), item(400))
+    spool.take()
+    spool.write(action('3'), item(400))
+    spool.refused().write(action('2'), item(400))
+
+    spool.finish()
+
+    assert [record['id'] for record in records(spool.path)] == ['3', '2']
+    assert spool.take() == spool.replay_path
+    spool.finish()
+    assert spool.take() is None
+
+
+def test_failed_replay_does_not_duplicate_refused_documents(spool):
+    spool.write(action('1'), item(400))
+    spool.write(action('2'), item(400))
+    spool.take()
+    # replay failed after document 1 was refused again
+    spool.refused().write(action('1'), item(400))
+    spool.discard_refused()
+
+    path = spool.take()
+    assert replayed(path) == {'1', '2'}
+    spool.refused().write(action('1'), item(400))
+    spool.finish()
+
+    assert [record['id'] for record in records(spool.path)] == ['1']
+
+
+def test_refused_documents_of_crashed_replay_are_dropped_on_take(spool):
+    spool.write(action('1'), item(400))
+    spool.take()
+    spool.refused().write(action('1'), item(400))
+
+    assert replayed(spool.take()) == {'1'}
+    spool.finish()
+
+    assert not spool.take()
+
+
+def test_replay_loads_current_row_instead_of_failed_document(spool):
+    film_id = str(uuid.uuid4())
+    row = {'id': film_id, 'title': 'Star', 'imdb_rating': 7.5}
+    conn = FakeConnection({raw_sql.films_by_ids: lambda params: [row] if film_id in params['film_ids'] else []})
+    elastic = FakeElastic()
+    stale = {'_op_type': 'index', '_index': INDEX, '_id': film_id, '_source': {'id': film_id, 'title': 'Stra'}}
+    spool.write(stale, item(400, film_id))
+    # the row is fixed and the newer version is indexed by a regular cycle before replay
+    row['title'] = 'Star Night'
+    elastic.documents[(INDEX, film_id)] = {'id': film_id, 'title': 'Star Night'}
+
+    state = State(MemoryStorage())
+    pipeline = EtlPipeline(elastic, state, 10, 10, index_names=INDEX_NAMES, dead_letters=spool.refused())
+    pipeline.run_changes(conn, spool_changes(spool.take(), INDEX_NAMES))
+    spool.finish()
+
+    assert len(elastic.bodies) == 1
+    assert elastic.documents[(INDEX, film_id)]['title'] == 'Star Night'
+    assert spool.take() is None
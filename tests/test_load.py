@@ -0,0 +1,83 @@
+import logging
+
+import pytest
+
+from etl import metrics, ndjson
+from etl.batching import BulkThrottle
+from etl.load import ElasticLoader, LoadMode
+from states.state import Checkpoint, State
+from states.state_storage import MemoryStorage
+
+from fakes import FakeElastic
+
+INDEX = 'movies'
+
+
+class FakeTransform:
+    def __init__(self, actions: list) -> None:
+        self.actions = actions
+
+    def transform(self) -> dict:
+        return {'films': iter([*self.actions, None])}
+
+
+def actions(count: int) -> list[dict]:
+    return [
+        {'_op_type': 'index', '_index': INDEX, '_id': str(number), '_source': {'id': str(number), 'title': 'Star'}}
+        for number in range(count)
+    ]
+
+
+def loader(elastic: FakeElastic, data: list, mode: LoadMode = LoadMode.bulk, **kwargs) -> ElasticLoader:
+    state = State(MemoryStorage())
+    return ElasticLoader(FakeTransform(data), elastic, {'films': INDEX}, {}, 2, state, mode, **kwargs)
+
+
+def bulk_bytes() -> float:
+    return metrics.BULK_BYTES.values.get((('index', INDEX),), 0)
+
+
+@pytest.mark.parametrize('mode', list(LoadMode))
+def test_bulk_bytes_are_bytes_of_request_bodies(mode):
+    data = actions(5)
+    if mode == LoadMode.raw:
+        data = [ndjson.action_lines(action) for action in data]
+    elastic = FakeElastic()
+    before = bulk_bytes()
+
+    loader(elastic, [*data, Checkpoint('films', 'last')], mode).load()
+
+    assert len(elastic.bodies) == 3
+    assert bulk_bytes() - before == sum(len(body) for body in elastic.bodies)
+
+
+def test_actions_are_not_serialized_for_size_without_batcher(monkeypatch):
+    sizes = []
+    monkeypatch.setattr(ElasticLoader, '_action_size', staticmethod(lambda action: sizes.append(action) or 0))
+
+    loader(FakeElastic(), actions(3)).load()
+
+    assert sizes == []
+
+
+def test_rejected_documents_are_retried_with_one_warning_per_round(monkeypatch, caplog):
+    monkeypatch.setattr('etl.load.time.sleep', lambda seconds: None)
+    elastic = FakeElastic({'0': [429, 429, 201], '1': [429, 201]})
+    state = State(MemoryStorage())
+    load = ElasticLoader(
+        FakeTransform([*actions(2), Checkpoint('films', 'last')]), elastic, {'films': INDEX}, {}, 2, state,
+        throttle=BulkThrottle(),
+    )
+
+    with caplog.at_level(logging.WARNING, logger='etl'):
+        load.load()
+
+    assert load.loaded_count == 2
+    assert state.get_state('films') == 'last'
+    assert [len(body.splitlines()) for body in elastic.bodies] == [4, 4, 2]
+    assert [record.getMessage() for record in caplog.records] == [
+        '2 of 2 documents of index movies are rejected by elasticsearch, retry 1 of 5 in 0.5 s, '
+        'bulk rate is limited to 50 docs/s',
+        '1 of 2 documents of index movies are rejected by elasticsearch, retry 2 of 5 in 1.0 s, '
+        'bulk rate is limited to 50 docs/s',
+    ]
@@ -0,0 +1,49 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from etl.extract import PartName
+from etl.load import LoadMode
+from etl.pipeline import EtlPipeline, part_groups
+from states.state import State
+from states.state_storage import MemoryStorage
+
+from fakes import FakeElastic
+
+INDEX = 'movies'
+
+
+class FakeTransform:
+    def __init__(self, doc_ids: list[str]) -> None:
+        self.doc_ids = doc_ids
+
+    def transform(self) -> dict:
+        actions = [
+            {'_op_type': 'index', '_index': INDEX, '_id': doc_id, '_source': {'id': doc_id}} for doc_id in self.doc_ids
+        ]
+        return {'films': iter([*actions, None])}
+
+
+def test_parts_of_films_index_are_one_group():
+    parts = [PartName.persons, PartName.films, PartName.genres, PartName.films_persons, PartName.films_genres]
+
+    assert part_groups(parts) == [
+        [PartName.films, PartName.films_persons, PartName.films_genres],
+        [PartName.persons],
+        [PartName.genres],
+    ]
+
+
+def test_groups_without_films_index_parts():
+    assert part_groups([PartName.persons, PartName.genres]) == [[PartName.persons], [PartName.genres]]
+
+
+def test_failed_documents_of_parts_loaded_at_the_same_time_are_counted():
+    loads = [[f'{load}-{number}' for number in range(20)] for load in range(40)]
+    elastic = FakeElastic({doc_id: [400] for doc_ids in loads for doc_id in doc_ids})
+    pipeline = EtlPipeline(
+        elastic, State(MemoryStorage()), 1, 5, load_mode=LoadMode.streaming, index_names={'films': INDEX},
+    )
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda doc_ids: pipeline._load(FakeTransform(doc_ids)), loads))
+
+    assert pipeline.failed_count == 800
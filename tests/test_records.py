@@ -0,0 +1,66 @@
+from types import SimpleNamespace
+
+import pytest
+
+from etl.fast_scheme import FastScheme
+from etl.records import Record, RecordCursor, record_type
+from etl.scheme import Genre
+
+GENRE_ID = '0b6c3d9e-1f1a-4d6b-8c4f-2a7f6a2f0c22'
+
+
+@pytest.fixture
+def row() -> Record:
+    return record_type(('id', 'name', 'description'))((GENRE_ID, 'Drama', None))
+
+
+def test_values_by_position_and_column_name(row):
+    assert row[0] == row['id'] == GENRE_ID
+    assert row[-1] is row['description'] is None
+    assert row[:2] == (GENRE_ID, 'Drama')
+    with pytest.raises(KeyError):
+        row['title']
+
+
+def test_get_of_missing_column_returns_default(row):
+    assert row.get('name') == 'Drama'
+    assert row.get('description', 'default') is None
+    assert row.get('title') is None
+    assert row.get('title', 'default') == 'default'
+
+
+def test_record_is_mapping_of_columns(row):
+    assert list(row.keys()) == ['id', 'name', 'description']
+    assert dict(row.items()) == {'id': GENRE_ID, 'name': 'Drama', 'description': None}
+    assert dict(**row) == {'id': GENRE_ID, 'name': 'Drama', 'description': None}
+    assert 'name' in row
+    assert 'Drama' not in row
+
+
+def test_record_is_tuple_without_dict(row):
+    assert isinstance(row, tuple)
+    assert row == (GENRE_ID, 'Drama', None)
+    assert not hasattr(row, '__dict__')
+
+
+def test_record_type_is_shared_by_the_same_columns():
+    assert record_type(('id', 'name')) is record_type(('id', 'name'))
+    assert record_type(('id', 'name')) is not record_type(('name', 'id'))
+
+
+def test_cursor_resolves_record_type_once_per_query():
+    cursor = SimpleNamespace(record=None, description=[SimpleNamespace(name='id'), SimpleNamespace(name='name')])
+
+    record = RecordCursor._record_type(cursor)
+
+    assert record is record_type(('id', 'name'))
+    assert RecordCursor._record_type(cursor) is record
+
+
+def test_fast_scheme_converts_records_and_dicts_equally(row):
+    scheme = FastScheme(Genre)
+    rows = [row, record_type(('id', 'name'))((GENRE_ID, 'Comedy'))]
+
+    assert scheme.convert_batch([row]) == scheme.convert_batch([dict(**row)])
+    assert scheme.convert_batch(rows) == [scheme.convert(row) for row in rows]
+    assert scheme.convert_batch(rows)[1]['description'] is None
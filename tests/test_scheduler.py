@@ -0,0 +1,59 @@
+import pytest
+
+from etl import scheduler
+from etl.extract import PartName
+from etl.scheduler import AdaptiveScheduler
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(scheduler.time, 'monotonic', clock)
+    return clock
+
+
+def test_interval_is_halved_after_changes_and_doubled_without_them(clock):
+    schedule = AdaptiveScheduler([PartName.films], 10, 80)
+
+    intervals = []
+    for has_changes in (False, False, False, False, True, True, True, True):
+        schedule.report(PartName.films, has_changes)
+        intervals.append(schedule.schedules[PartName.films].interval)
+
+    assert intervals == [20, 40, 80, 80, 40, 20, 10, 10]
+
+
+def test_all_parts_are_due_at_start(clock):
+    schedule = AdaptiveScheduler([PartName.films, PartName.persons], 10, 80)
+
+    assert schedule.due() == [PartName.films, PartName.persons]
+    assert schedule.sleep_time() == 0.0
+
+
+def test_part_is_due_when_its_interval_has_passed(clock):
+    schedule = AdaptiveScheduler([PartName.films, PartName.persons], 10, 80)
+    schedule.report(PartName.films, has_changes=False)
+    schedule.report(PartName.persons, has_changes=True)
+
+    assert schedule.due() == []
+    assert schedule.sleep_time() == 10
+
+    clock.now += 10
+    assert schedule.due() == [PartName.persons]
+    assert schedule.sleep_time() == 0.0
+
+    schedule.report(PartName.persons, has_changes=True)
+    clock.now += 5
+    assert schedule.due() == []
+    assert schedule.sleep_time() == 5
+
+    clock.now += 5
+    assert schedule.due() == [PartName.films, PartName.persons]
@@ -0,0 +1,92 @@
+import os
+import uuid
+
+import pytest
+
+import raw_sql
+from etl import sharding
+from etl.extract import FIRST_ID, LAST_ID, Shard
+from etl.sharding import ShardedInit, id_ranges
+from states.state_storage import JsonFileStorage
+
+from fakes import FakeConnection
+
+SNAPSHOT = '00000003-0000001B-1'
+
+
+@pytest.mark.parametrize('count', [1, 2, 3, 7, 16])
+def test_id_ranges_cover_uuid_space_without_gaps_and_overlaps(count):
+    shards = id_ranges(count)
+
+    assert [shard.number for shard in shards] == list(range(count))
+    assert shards[0].start == FIRST_ID
+    assert shards[-1].end == LAST_ID
+    for shard, next_shard in zip(shards, shards[1:]):
+        assert shard.end == next_shard.start
+    assert all(uuid.UUID(shard.start).int < uuid.UUID(shard.end).int for shard in shards)
+
+
+def test_one_range_is_whole_uuid_space():
+    assert id_ranges(1) == [Shard(0, FIRST_ID, LAST_ID)]
+
+
+class SnapshotConnection(FakeConnection):
+    def set_session(self, **kwargs) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class FakeWorkers:
+    """
+    Workers that mark as done shards of loaded numbers
+    """
+
+    def __init__(self, shards_dir: str, loaded: set[int]) -> None:
+        self.shards_dir = shards_dir
+        self.loaded = loaded
+        self.runs = []
+
+    def __call__(self, shards: list[Shard], snapshot: str) -> list[bool]:
+        assert snapshot == SNAPSHOT
+        self.runs.append([shard.number for shard in shards])
+        for shard in shards:
+            if shard.number in self.loaded:
+                JsonFileStorage(sharding._shard_path(self.shards_dir, shard)).save_state({'done': True})
+        return [shard.number in self.loaded for shard in shards]
+
+
+@pytest.fixture
+def conn(monkeypatch) -> SnapshotConnection:
+    keysets = [
+        {'updated_at': '2022-01-01 00:00:00', 'id': str(uuid.UUID(int=1))},
+        {'updated_at': '2022-02-01 00:00:00', 'id': str(uuid.UUID(int=2))},
+    ]
+    conn = SnapshotConnection({
+        'SELECT pg_export_snapshot();': lambda params: [{'pg_export_snapshot': SNAPSHOT}],
+        raw_sql.film_last_keyset: lambda params: [keysets.pop(0)],
+    })
+    monkeypatch.setattr(sharding.psycopg2, 'connect', lambda **dsl: conn)
+    return conn
+
+
+def sharded_init(shards_dir: str, shards: int, workers: FakeWorkers) -> ShardedInit:
+    init = ShardedInit({}, shards_dir, shards, None)
+    init._run_workers = workers
+    return init
+
+
+def test_resumed_init_runs_only_unfinished_shards_of_plan(conn, tmp_path):
+    shards_dir = str(tmp_path / 'init_shards')
+    workers = FakeWorkers(shards_dir, loaded={0, 2})
+
+    with pytest.raises(RuntimeError):
+        sharded_init(shards_dir, 3, workers).run()
+    workers.loaded.add(1)
+    # plan of interrupted load is kept when count of shards is changed
+    checkpoint = sharded_init(shards_dir, 4, workers).run()
+
+    assert workers.runs == [[0, 1, 2], [1]]
+    assert checkpoint == {'updated_at': '2022-01-01 00:00:00', 'id': str(uuid.UUID(int=1))}
+    assert not os.path.exists(shards_dir)
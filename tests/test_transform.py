@@ -0,0 +1,127 @@
+import datetime
+import decimal
+import uuid
+
+import pytest
+from pydantic import ValidationError
+
+from etl.fast_scheme import FastScheme
+from etl.records import record_type
+from etl.scheme import FilmScheme
+from etl.transform import ElasticTransformer, FastElasticTransformer
+from states.state import Checkpoint
+
+FILM_ID = uuid.UUID('3fa85f64-5717-4562-b3fc-2c963f66afa6')
+PERSON_ID = '6a1d1b05-6f2e-4a8f-9d3a-7e0e1c1f5b11'
+GENRE_ID = '0b6c3d9e-1f1a-4d6b-8c4f-2a7f6a2f0c22'
+UPDATED_AT = datetime.datetime(2022, 6, 16, 20, 14, 9, tzinfo=datetime.timezone.utc)
+
+ROWS = {
+    'films': [
+        {
+            # coerced values: uuid object, decimal rating, integer flag, tuple of names
+            'id': FILM_ID,
+            'title': 'Star Night',
+            'description': 'River',
+            'imdb_rating': decimal.Decimal('7.5'),
+            'updated_at': UPDATED_AT,
+            'only_sub': 1,
+            'director': [{'id': PERSON_ID, 'name': 'Ghost'}],
+            'actors': [{'id': PERSON_ID, 'name': 'Ghost'}],
+            'writers': None,
+            'actors_names': ('Ghost',),
+            'writers_names': None,
+            'genre': [{'id': GENRE_ID, 'name': 'Drama'}],
+        },
+        # rating None becomes 0, optional fields are missing
+        {'id': str(uuid.uuid4()), 'title': 'Empire', 'imdb_rating': None, 'updated_at': UPDATED_AT},
+        {'id': str(uuid.uuid4()), 'title': 'Queen', 'description': None, 'imdb_rating': '8', 'only_sub': 'false'},
+    ],
+    'films_persons': [
+        {'film_id': str(FILM_ID), 'director': [], 'actors': None, 'actors_names': ['Ghost'], 'writers_names': []},
+    ],
+    'films_genres': [
+        {'film_id': FILM_ID, 'genre': [{'id': GENRE_ID, 'name': 'Drama'}]},
+    ],
+    'persons': [
+        {'id': PERSON_ID, 'full_name': 'Ghost', 'role': ('actor', 'director'), 'film_ids': [str(FILM_ID)]},
+    ],
+    'genres': [
+        {'id': GENRE_ID, 'name': 'Drama', 'description': None},
+        {'id': str(uuid.uuid4()), 'name': 'Comedy'},
+    ],
+}
+
+
+def as_records(rows: list[dict]) -> list:
+    """
+    Rows of one query have the same columns, missing columns are filled with None like in database
+    """
+    columns = tuple(dict.fromkeys(column for row in rows for column in row))
+    record = record_type(columns)
+    return [record(tuple(row.get(column) for column in columns)) for row in rows]
+
+
+class FakeExtracting:
+    def __init__(self, rows: dict[str, list]) -> None:
+        self.rows = rows
+
+    def extract(self) -> dict:
+        return {name: self._data(name, rows) for name, rows in self.rows.items()}
+
+    @staticmethod
+    def _data(name: str, rows: list):
+        for number, row in enumerate(rows):
+            yield row
+            yield Checkpoint(name, number)
+        yield None
+
+
+def transformed(transformer) -> dict[str, list]:
+    result = {}
+    for name, data in transformer.transform().items():
+        result[name] = list(iter(lambda data=data: next(data), None))
+    return result
+
+
+RECORDS = {name: as_records(rows) for name, rows in ROWS.items()}
+
+
+@pytest.mark.parametrize('rows', [ROWS, RECORDS], ids=['dict', 'record'])
+@pytest.mark.parametrize('serialize', [False, True], ids=['actions', 'ndjson'])
+def test_fast_transformer_output_is_equal_to_pydantic_one(rows, serialize):
+    expected = transformed(ElasticTransformer(FakeExtracting(rows), serialize))
+    result = transformed(FastElasticTransformer(FakeExtracting(rows), 2, serialize))
+
+    assert result == expected
+
+
+def test_checkpoints_keep_their_positions():
+    result = transformed(FastElasticTransformer(FakeExtracting(ROWS), 2))
+
+    assert [item for item in result['films'] if isinstance(item, Checkpoint)] == [
+        Checkpoint('films', number) for number in range(3)
+    ]
+    assert result['films'][0]['_source']['imdb_rating'] == 7.5
+    assert result['films'][2]['_source']['imdb_rating'] == 0
+    assert result['films'][2]['_source']['actors'] == []
+
+
+def test_ndjson_lines_of_raw_mode():
+    result = transformed(FastElasticTransformer(FakeExtracting({'genres': ROWS['genres'][:1]}), 2, serialize=True))
+
+    assert result['genres'][0] == (
+        b'{"index":{"_index":"genres","_id":"' + GENRE_ID.encode() + b'"}}\n'
+        b'{"id":"' + GENRE_ID.encode() + b'","name":"Drama","description":null}\n'
+    )
+
+
+@pytest.mark.parametrize('row', [{'id': 'not uuid', 'title': 'Star'}, {'id': str(FILM_ID)}], ids=['invalid', 'missing'])
+def test_errors_are_pydantic_validation_errors(row):
+    with pytest.raises(ValidationError) as expected:
+        FilmScheme(**row)
+    with pytest.raises(ValidationError) as error:
+        FastScheme(FilmScheme).convert(row)
+
+    assert error.value.errors() == expected.value.errors()
+    assert str(error.value) == str(expected.value)
@@ -0,0 +1,58 @@
+import datetime
+from itertools import islice
+
+import pytest
+
+from utils import buffered, parse_timestamp
+
+
+def test_buffered_passes_all_items():
+    data = iter([*range(10), None])
+
+    assert list(islice(buffered(data, 3, 2), 11)) == [*range(10), None]
+
+
+def test_buffered_stops_source_when_consumer_stops():
+    pulled = []
+    closed = []
+
+    def source():
+        try:
+            for number in range(100000):
+                pulled.append(number)
+                yield number
+        finally:
+            closed.append(True)
+
+    items = buffered(source(), 5, 2)
+    assert list(islice(items, 25)) == list(range(25))
+    items.close()
+
+    assert closed == [True]
+    # producer stops after batches already put to queue and the one it was filling
+    assert len(pulled) < 25 + 5 * 4
+
+
+def test_buffered_raises_exception_of_source():
+    def source():
+        yield 1
+        raise RuntimeError('broken')
+
+    items = buffered(source(), 1, 1)
+    assert next(items) == 1
+    with pytest.raises(RuntimeError, match='broken'):
+        next(items)
+
+
+@pytest.mark.parametrize('value', [
+    '2021-06-16T20:14:09.22+00:00',
+    '2021-06-16 20:14:09.22+00',
+    '2021-06-16 20:14:09.220000+00:00',
+    '2021-06-16T20:14:09.22Z',
+    '2021-06-16 20:14:09.22',
+    datetime.datetime(2021, 6, 16, 20, 14, 9, 220000, tzinfo=datetime.timezone.utc),
+])
+def test_parse_timestamp_of_python_and_postgres(value):
+    expected = datetime.datetime(2021, 6, 16, 20, 14, 9, 220000, tzinfo=datetime.timezone.utc)
+
+    assert parse_timestamp(value) == expected